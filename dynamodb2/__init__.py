@@ -1,5 +1,6 @@
 import boto.dynamodb2
 from dynamodb2.aws_credential import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+from dynamodb2.schema import schema_cache
 
 __author__ = 'drblez'
 
@@ -17,56 +18,99 @@ def convert_key_value(hash_key_value, hash_key_type):
         return hash_key_value
 
 
+def gen_key(key_schema, hash_key_value, range_key_value=None):
+    """
+
+    @param key_schema: TableKeySchema instance
+    @return: Key attribute dict
+    """
+    s = key_schema
+    key = {
+        s.hash_key_name: {
+            s.hash_key_type: convert_key_value(hash_key_value, s.hash_key_type)
+        }
+    }
+    if not s.range_key_name is None:
+        if range_key_value is None:
+            raise KeyAttributeError('Range key is not specified')
+        key[s.range_key_name] = {
+            s.range_key_type: convert_key_value(range_key_value, s.range_key_type)
+        }
+    return key
+
+
 class AWSDynamoDB2Connection():
     def __init__(self,
                  access_key=AWS_ACCESS_KEY_ID,
                  secret_access_key=AWS_SECRET_ACCESS_KEY,
-                 region=AWS_REGION):
-        self.connection = boto.dynamodb2.connect_to_region(
-            region,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_access_key)
+                 region=AWS_REGION,
+                 prewarm_tables=None,
+                 cache=schema_cache,
+                 backend=None):
+        """
+
+        @param backend: Low level DynamoDB backend (see dynamodb2.backend) used instead of boto connection
+        """
+        self.access_key = access_key
+        self.region = region
+        self.cache = cache
+        self.backend = backend
+        if backend is None:
+            self.connection = boto.dynamodb2.connect_to_region(
+                region,
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_access_key)
+        else:
+            self.connection = backend
+        if not prewarm_tables is None:
+            self.prewarm(prewarm_tables)
+
+    def __cache_key(self, table_name):
+        return self.access_key, self.region, table_name
+
+    def __schema(self, table_name):
+        return self.cache.get(self.__cache_key(table_name),
+                              lambda: self.connection.describe_table(table_name)['Table'], self.backend)
+
+    def prewarm(self, table_names):
+        """
+
+        Load descriptors of tables into schema cache, so first transactions do not pay describe_table
+
+        @param table_names: List of DynamoDB table names
+        """
+        for table_name in table_names:
+            self.__schema(table_name)
+
+    def invalidate_table_descriptor(self, table_name=None):
+        if table_name is None:
+            self.cache.invalidate(backend=self.backend)
+        else:
+            self.cache.invalidate(self.__cache_key(table_name), self.backend)
 
     def get_table_descriptor(self, table_name):
-        table_descriptor = self.connection.describe_table(table_name)
-        table_descriptor = table_descriptor['Table']
-        return table_descriptor
+        return self.__schema(table_name).table_descriptor
+
+    def get_key_schema(self, table_name):
+        """
+
+        @rtype : TableKeySchema
+        """
+        return self.__schema(table_name).key_schema
 
     def get_key_name(self, table_name):
-        t = self.get_table_descriptor(table_name)
-        key_schema = t['KeySchema']
-        keys = [key_schema[0]['AttributeName']]
-        if len(key_schema) > 1:
-            keys.append(key_schema[1]['AttributeName'])
-        return keys
+        return list(self.get_key_schema(table_name).key_names)
+
+    def cached_key_schema(self, table_name):
+        """
+
+        @rtype : TableKeySchema
+        @return: Key schema if it is in cache, else None
+        """
+        entry = self.cache.peek(self.__cache_key(table_name), self.backend)
+        if entry is None:
+            return None
+        return entry.key_schema
 
     def gen_key_attribute(self, table_name, hash_key_value, range_key_value=None):
-        t = self.get_table_descriptor(table_name)
-        key_schema = t['KeySchema']
-        attributes = t['AttributeDefinitions']
-        hash_key_name = None
-        range_key_name = None
-        hash_key_type = None
-        range_key_type = None
-        for key in key_schema:
-            if key['KeyType'] == 'HASH':
-                hash_key_name = key['AttributeName']
-            elif key['KeyType'] == 'RANGE':
-                range_key_name = key['AttributeName']
-        for attr in attributes:
-            if attr['AttributeName'] == hash_key_name:
-                hash_key_type = attr['AttributeType']
-            elif attr['AttributeName'] == range_key_name:
-                range_key_type = attr['AttributeType']
-        key = {
-            hash_key_name: {
-                hash_key_type: convert_key_value(hash_key_value, hash_key_type)
-            }
-        }
-        if not range_key_name is None:
-            if range_key_value is None:
-                raise KeyAttributeError('Range key is not specified')
-            key[range_key_name] = {
-                range_key_type: convert_key_value(range_key_value, range_key_type)
-            }
-        return key
\ No newline at end of file
+        return gen_key(self.get_key_schema(table_name), hash_key_value, range_key_value)
@@ -0,0 +1,55 @@
+__author__ = 'drblez'
+
+"""
+
+    Low level DynamoDB backend interface.
+
+    Everything in dynamodb2 talks to AWSDynamoDB2Connection.connection, which is boto.dynamodb2.layer1
+    DynamoDBConnection by default. A backend is any object with the same methods, arguments, wire format results
+    and boto exceptions (ConditionalCheckFailedException, ResourceNotFoundException, ...). DynamoDBBackend lists
+    the calls used by the transaction manager:
+
+        tx = Tx('Tx1', ISOLATION_LEVEL_FULL_LOCK, backend=MemoryBackend())
+
+"""
+
+
+class DynamoDBBackend():
+    def describe_table(self, table_name):
+        raise NotImplementedError()
+
+    def create_table(self, attribute_definitions, table_name, key_schema, provisioned_throughput,
+                     local_secondary_indexes=None, global_secondary_indexes=None):
+        raise NotImplementedError()
+
+    def get_item(self, table_name, key, attributes_to_get=None, consistent_read=None,
+                 return_consumed_capacity=None):
+        raise NotImplementedError()
+
+    def put_item(self, table_name, item, expected=None, return_values=None, return_consumed_capacity=None,
+                 return_item_collection_metrics=None, conditional_operator=None):
+        raise NotImplementedError()
+
+    def update_item(self, table_name, key, attribute_updates=None, expected=None, conditional_operator=None,
+                    return_values=None, return_consumed_capacity=None, return_item_collection_metrics=None):
+        raise NotImplementedError()
+
+    def delete_item(self, table_name, key, expected=None, conditional_operator=None, return_values=None,
+                    return_consumed_capacity=None, return_item_collection_metrics=None):
+        raise NotImplementedError()
+
+    def batch_get_item(self, request_items, return_consumed_capacity=None):
+        raise NotImplementedError()
+
+    def batch_write_item(self, request_items, return_consumed_capacity=None, return_item_collection_metrics=None):
+        raise NotImplementedError()
+
+    def query(self, table_name, key_conditions, index_name=None, select=None, attributes_to_get=None, limit=None,
+              consistent_read=None, query_filter=None, conditional_operator=None, scan_index_forward=None,
+              exclusive_start_key=None, return_consumed_capacity=None):
+        raise NotImplementedError()
+
+    def scan(self, table_name, attributes_to_get=None, limit=None, select=None, scan_filter=None,
+             conditional_operator=None, exclusive_start_key=None, return_consumed_capacity=None,
+             total_segments=None, segment=None):
+        raise NotImplementedError()
@@ -0,0 +1,563 @@
+import decimal
+import random
+import threading
+from time import sleep, time
+import zlib
+
+from boto.dynamodb2.exceptions import ConditionalCheckFailedException, ProvisionedThroughputExceededException, \
+    ResourceInUseException, ResourceNotFoundException, ValidationException
+import simplejson as json
+
+from dynamodb2.backend import DynamoDBBackend
+from dynamodb2.codec import copy_item, copy_value, format_number
+
+__author__ = 'drblez'
+
+"""
+
+    In-process DynamoDB backend.
+
+    Items are kept in wire format ({'N': '42'}, {'SS': [...]}) per table, every call is atomic under one lock.
+    Supported: legacy Expected/Exists conditions (with ConditionalOperator AND/OR), AttributeUpdates PUT/ADD/DELETE
+    including set ADD/DELETE, ReturnValues NONE/ALL_OLD/UPDATED_OLD/ALL_NEW/UPDATED_NEW, ConsumedCapacity TOTAL,
+    batch get/write limits, query on table and local secondary indexes, segmented scan with ScanFilter.
+
+    latency (seconds or callable(operation) -> seconds) is slept before every call outside of the lock, so
+    concurrent clients overlap like with a real network. throttle_rate and unprocessed_rate inject
+    ProvisionedThroughputExceededException and unprocessed batch items.
+
+"""
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+
+_TYPE_PREFIX = 'com.amazonaws.dynamodb.v20120810#'
+
+
+def _error(exception_class, message):
+    return exception_class(400, 'Bad Request', {'__type': _TYPE_PREFIX + exception_class.__name__,
+                                                'message': message})
+
+
+def _normalize(value):
+    """
+
+    Comparable form of wire value: numbers become Decimal, sets become frozenset
+
+    """
+    t, v = list(value.items())[0]
+    if t == 'N':
+        return t, decimal.Decimal(str(v))
+    if t == 'NS':
+        return t, frozenset(decimal.Decimal(str(i)) for i in v)
+    if t in ('SS', 'BS'):
+        return t, frozenset(v)
+    return t, v
+
+
+def _size(item):
+    size = 0
+    for k, v in item.items():
+        size += len(k) + len(json.dumps(v))
+    return size
+
+
+def _is_true(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() == 'true'
+
+
+def _compare(operator, attribute, values):
+    """
+
+    ComparisonOperator semantics of Query KeyConditions, ScanFilter and QueryFilter
+
+    """
+    if operator == 'NULL':
+        return attribute is None
+    if operator == 'NOT_NULL':
+        return not attribute is None
+    if attribute is None:
+        return operator == 'NE'
+    t, a = _normalize(attribute)
+    vs = [_normalize(v) for v in values]
+    if operator == 'EQ':
+        return (t, a) == vs[0]
+    if operator == 'NE':
+        return (t, a) != vs[0]
+    if operator == 'IN':
+        return (t, a) in vs
+    if operator == 'CONTAINS':
+        return t in ('SS', 'NS', 'BS') and vs[0][1] in a or t == 'S' and vs[0][1] in a
+    if operator == 'NOT_CONTAINS':
+        return not (t in ('SS', 'NS', 'BS') and vs[0][1] in a or t == 'S' and vs[0][1] in a)
+    if t != vs[0][0]:
+        return False
+    if operator == 'LT':
+        return a < vs[0][1]
+    if operator == 'LE':
+        return a <= vs[0][1]
+    if operator == 'GT':
+        return a > vs[0][1]
+    if operator == 'GE':
+        return a >= vs[0][1]
+    if operator == 'BEGINS_WITH':
+        return a.startswith(vs[0][1])
+    if operator == 'BETWEEN':
+        return vs[0][1] <= a <= vs[1][1]
+    raise _error(ValidationException, 'Unsupported ComparisonOperator {}'.format(operator))
+
+
+def _check_conditions(item, conditions, conditional_operator, expected_form):
+    results = []
+    for name, condition in conditions.items():
+        attribute = None if item is None else item.get(name)
+        if not expected_form or 'ComparisonOperator' in condition:
+            results.append(_compare(condition['ComparisonOperator'], attribute,
+                                    condition.get('AttributeValueList', [])))
+        elif 'Value' in condition:
+            if not _is_true(condition.get('Exists', True)):
+                raise _error(ValidationException, 'Value is not allowed with Exists false for {}'.format(name))
+            results.append(not attribute is None and _normalize(attribute) == _normalize(condition['Value']))
+        elif _is_true(condition.get('Exists', True)):
+            raise _error(ValidationException, 'Exists true requires Value for {}'.format(name))
+        else:
+            results.append(attribute is None)
+    if conditional_operator == 'OR':
+        return any(results)
+    return all(results)
+
+
+class _Table():
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self.items = {}
+        self.hash_key_name = None
+        self.range_key_name = None
+        for key in descriptor['KeySchema']:
+            if key['KeyType'] == 'HASH':
+                self.hash_key_name = key['AttributeName']
+            else:
+                self.range_key_name = key['AttributeName']
+        self.key_names = [n for n in (self.hash_key_name, self.range_key_name) if not n is None]
+        self.indexes = {}
+        for index in descriptor.get('LocalSecondaryIndexes', []) + descriptor.get('GlobalSecondaryIndexes', []):
+            names = {}
+            for key in index['KeySchema']:
+                names[key['KeyType']] = key['AttributeName']
+            self.indexes[index['IndexName']] = (names.get('HASH'), names.get('RANGE'))
+
+    def item_key(self, key):
+        if len(key) != len(self.key_names):
+            raise _error(ValidationException, 'The provided key element does not match the schema')
+        try:
+            return tuple(_normalize(key[name]) for name in self.key_names)
+        except KeyError:
+            raise _error(ValidationException, 'The provided key element does not match the schema')
+
+    def key_of(self, item):
+        try:
+            return dict((name, item[name]) for name in self.key_names)
+        except KeyError:
+            raise _error(ValidationException, 'One of the required keys was not given a value')
+
+
+class MemoryBackend(DynamoDBBackend):
+    def __init__(self, latency=0, throttle_rate=0, unprocessed_rate=0, table_create_time=0, seed=None):
+        """
+
+        @param latency: Seconds slept before every call, or callable(operation) returning seconds
+        @param throttle_rate: Probability of ProvisionedThroughputExceededException for every call
+        @param unprocessed_rate: Probability for every batch key/item to be returned as unprocessed
+        @param table_create_time: Seconds a new table stays in CREATING status
+        @param seed: Random seed for throttling and unprocessed items injection
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.unprocessed_rate = unprocessed_rate
+        self.table_create_time = table_create_time
+        self.random = random.Random(seed)
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.calls = {}
+
+    def __call(self, operation):
+        if callable(self.latency):
+            delay = self.latency(operation)
+        else:
+            delay = self.latency
+        if delay > 0:
+            sleep(delay)
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            throttled = self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+        if throttled:
+            raise _error(ProvisionedThroughputExceededException,
+                         'The level of configured provisioned throughput for the table was exceeded')
+
+    def __unprocessed(self):
+        return self.unprocessed_rate > 0 and self.random.random() < self.unprocessed_rate
+
+    def __table(self, table_name):
+        table = self.tables.get(table_name)
+        if table is None:
+            raise _error(ResourceNotFoundException, 'Requested resource not found: Table: {} not found'.format(
+                table_name))
+        return table
+
+    @staticmethod
+    def __capacity(table_name, return_consumed_capacity, units):
+        if return_consumed_capacity in ('TOTAL', 'INDEXES'):
+            return {'TableName': table_name, 'CapacityUnits': units}
+        return None
+
+    @staticmethod
+    def __write_units(old, new):
+        return max(1, (max(_size(old or {}), _size(new or {})) + 1023) // 1024)
+
+    @staticmethod
+    def __read_units(item, consistent_read):
+        units = max(1, (_size(item or {}) + 4095) // 4096)
+        if consistent_read:
+            return float(units)
+        return units / 2.0
+
+    @staticmethod
+    def __project(item, attributes_to_get):
+        if attributes_to_get is None:
+            return copy_item(item)
+        return dict((k, copy_value(item[k])) for k in attributes_to_get if k in item)
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls = {}
+
+    def describe_table(self, table_name):
+        self.__call('DescribeTable')
+        with self.lock:
+            table = self.__table(table_name)
+            if table.descriptor['TableStatus'] == 'CREATING' and time() >= table.active_at:
+                table.descriptor['TableStatus'] = 'ACTIVE'
+            descriptor = json.loads(json.dumps(table.descriptor))
+            descriptor['ItemCount'] = len(table.items)
+            return {'Table': descriptor}
+
+    def create_table(self, attribute_definitions, table_name, key_schema, provisioned_throughput,
+                     local_secondary_indexes=None, global_secondary_indexes=None):
+        self.__call('CreateTable')
+        with self.lock:
+            if table_name in self.tables:
+                raise _error(ResourceInUseException, 'Table already exists: {}'.format(table_name))
+            descriptor = {
+                'TableName': table_name,
+                'AttributeDefinitions': list(attribute_definitions),
+                'KeySchema': list(key_schema),
+                'ProvisionedThroughput': dict(provisioned_throughput),
+                'TableStatus': 'CREATING' if self.table_create_time > 0 else 'ACTIVE',
+                'CreationDateTime': time()
+            }
+            if local_secondary_indexes:
+                descriptor['LocalSecondaryIndexes'] = list(local_secondary_indexes)
+            if global_secondary_indexes:
+                descriptor['GlobalSecondaryIndexes'] = list(global_secondary_indexes)
+            table = _Table(descriptor)
+            table.active_at = time() + self.table_create_time
+            self.tables[table_name] = table
+            return {'TableDescription': json.loads(json.dumps(descriptor))}
+
+    def delete_table(self, table_name):
+        self.__call('DeleteTable')
+        with self.lock:
+            table = self.__table(table_name)
+            del self.tables[table_name]
+            return {'TableDescription': json.loads(json.dumps(table.descriptor))}
+
+    def list_tables(self, exclusive_start_table_name=None, limit=None):
+        self.__call('ListTables')
+        with self.lock:
+            return {'TableNames': sorted(self.tables.keys())}
+
+    def get_item(self, table_name, key, attributes_to_get=None, consistent_read=None,
+                 return_consumed_capacity=None, projection_expression=None, expression_attribute_names=None):
+        self.__call('GetItem')
+        with self.lock:
+            table = self.__table(table_name)
+            item = table.items.get(table.item_key(key))
+            result = {}
+            if not item is None:
+                result['Item'] = self.__project(item, attributes_to_get)
+            capacity = self.__capacity(table_name, return_consumed_capacity,
+                                       self.__read_units(item, consistent_read))
+            if not capacity is None:
+                result['ConsumedCapacity'] = capacity
+            return result
+
+    @staticmethod
+    def __return_values(return_values, old, new, updated=None):
+        if return_values in (None, 'NONE'):
+            return None
+        if return_values == 'ALL_OLD':
+            return old
+        if return_values == 'ALL_NEW':
+            return new
+        source = old if return_values == 'UPDATED_OLD' else new
+        if source is None:
+            return None
+        return dict((k, source[k]) for k in updated if k in source)
+
+    def __write_result(self, table_name, attributes, return_consumed_capacity, units):
+        result = {}
+        if attributes:
+            result['Attributes'] = copy_item(attributes)
+        capacity = self.__capacity(table_name, return_consumed_capacity, units)
+        if not capacity is None:
+            result['ConsumedCapacity'] = capacity
+        return result
+
+    def put_item(self, table_name, item, expected=None, return_values=None, return_consumed_capacity=None,
+                 return_item_collection_metrics=None, conditional_operator=None, condition_expression=None,
+                 expression_attribute_names=None, expression_attribute_values=None):
+        self.__call('PutItem')
+        with self.lock:
+            table = self.__table(table_name)
+            item_key = table.item_key(table.key_of(item))
+            old = table.items.get(item_key)
+            if expected and not _check_conditions(old, expected, conditional_operator, True):
+                raise _error(ConditionalCheckFailedException, 'The conditional request failed')
+            new = copy_item(item)
+            table.items[item_key] = new
+            return self.__write_result(table_name, self.__return_values(return_values, old, new),
+                                       return_consumed_capacity, self.__write_units(old, new))
+
+    @staticmethod
+    def __apply_update(item, name, update):
+        action = update.get('Action', 'PUT')
+        value = update.get('Value')
+        if action == 'PUT':
+            item[name] = copy_value(value)
+        elif action == 'DELETE':
+            if value is None:
+                item.pop(name, None)
+                return
+            t, v = list(value.items())[0]
+            if not t in ('SS', 'NS', 'BS'):
+                raise _error(ValidationException, 'DELETE with value requires a set for {}'.format(name))
+            current = item.get(name)
+            if current is None:
+                return
+            if list(current.keys())[0] != t:
+                raise _error(ValidationException, 'Type mismatch for attribute {}'.format(name))
+            removed = _normalize(value)[1]
+            if t == 'NS':
+                left = [i for i in current[t] if not decimal.Decimal(str(i)) in removed]
+            else:
+                left = [i for i in current[t] if not i in removed]
+            if len(left) == 0:
+                del item[name]
+            else:
+                item[name] = {t: left}
+        elif action == 'ADD':
+            t, v = list(value.items())[0]
+            current = item.get(name)
+            if t == 'N':
+                if current is None:
+                    item[name] = {'N': str(v)}
+                elif not 'N' in current:
+                    raise _error(ValidationException, 'Type mismatch for attribute {}'.format(name))
+                else:
+                    total = decimal.Decimal(str(current['N'])) + decimal.Decimal(str(v))
+                    item[name] = {'N': format_number(total)}
+            elif t in ('SS', 'NS', 'BS'):
+                if current is None:
+                    item[name] = {t: list(v)}
+                elif not t in current:
+                    raise _error(ValidationException, 'Type mismatch for attribute {}'.format(name))
+                else:
+                    merged = list(current[t])
+                    present = _normalize(current)[1]
+                    for i in v:
+                        n = decimal.Decimal(str(i)) if t == 'NS' else i
+                        if not n in present:
+                            merged.append(i)
+                            present = present | frozenset([n])
+                    item[name] = {t: merged}
+            else:
+                raise _error(ValidationException, 'ADD is supported for numbers and sets only ({})'.format(name))
+        else:
+            raise _error(ValidationException, 'Unknown action {}'.format(action))
+
+    def update_item(self, table_name, key, attribute_updates=None, expected=None, conditional_operator=None,
+                    return_values=None, return_consumed_capacity=None, return_item_collection_metrics=None,
+                    update_expression=None, condition_expression=None, expression_attribute_names=None,
+                    expression_attribute_values=None):
+        self.__call('UpdateItem')
+        with self.lock:
+            table = self.__table(table_name)
+            item_key = table.item_key(key)
+            old = table.items.get(item_key)
+            if expected and not _check_conditions(old, expected, conditional_operator, True):
+                raise _error(ConditionalCheckFailedException, 'The conditional request failed')
+            attribute_updates = attribute_updates or {}
+            for name in attribute_updates.keys():
+                if name in table.key_names:
+                    raise _error(ValidationException, 'Cannot update attribute {}. This attribute is part of the '
+                                                      'key'.format(name))
+            if old is None:
+                new = dict((k, copy_value(v)) for k, v in key.items())
+            else:
+                new = copy_item(old)
+            for name, update in attribute_updates.items():
+                self.__apply_update(new, name, update)
+            creates = [u for u in attribute_updates.values() if u.get('Action', 'PUT') != 'DELETE']
+            if not old is None or len(creates) > 0:
+                table.items[item_key] = new
+            else:
+                new = None
+            return self.__write_result(
+                table_name, self.__return_values(return_values, old, new, list(attribute_updates.keys())),
+                return_consumed_capacity, self.__write_units(old, new))
+
+    def delete_item(self, table_name, key, expected=None, conditional_operator=None, return_values=None,
+                    return_consumed_capacity=None, return_item_collection_metrics=None, condition_expression=None,
+                    expression_attribute_names=None, expression_attribute_values=None):
+        self.__call('DeleteItem')
+        with self.lock:
+            table = self.__table(table_name)
+            item_key = table.item_key(key)
+            old = table.items.get(item_key)
+            if expected and not _check_conditions(old, expected, conditional_operator, True):
+                raise _error(ConditionalCheckFailedException, 'The conditional request failed')
+            table.items.pop(item_key, None)
+            return self.__write_result(table_name, self.__return_values(return_values, old, None),
+                                       return_consumed_capacity, self.__write_units(old, None))
+
+    def batch_get_item(self, request_items, return_consumed_capacity=None):
+        self.__call('BatchGetItem')
+        with self.lock:
+            if sum(len(r['Keys']) for r in request_items.values()) > BATCH_GET_MAX_KEYS:
+                raise _error(ValidationException, 'Too many items requested for the BatchGetItem call')
+            responses = {}
+            unprocessed = {}
+            capacity = []
+            for table_name, request in request_items.items():
+                table = self.__table(table_name)
+                consistent_read = _is_true(request.get('ConsistentRead', False))
+                units = 0
+                responses[table_name] = []
+                for key in request['Keys']:
+                    if self.__unprocessed():
+                        u = unprocessed.setdefault(table_name, dict(
+                            (k, v) for k, v in request.items() if k != 'Keys'))
+                        u.setdefault('Keys', []).append(key)
+                        continue
+                    item = table.items.get(table.item_key(key))
+                    units += self.__read_units(item, consistent_read)
+                    if not item is None:
+                        responses[table_name].append(self.__project(item, request.get('AttributesToGet')))
+                c = self.__capacity(table_name, return_consumed_capacity, units)
+                if not c is None:
+                    capacity.append(c)
+            result = {'Responses': responses, 'UnprocessedKeys': unprocessed}
+            if return_consumed_capacity in ('TOTAL', 'INDEXES'):
+                result['ConsumedCapacity'] = capacity
+            return result
+
+    def batch_write_item(self, request_items, return_consumed_capacity=None, return_item_collection_metrics=None):
+        self.__call('BatchWriteItem')
+        with self.lock:
+            if sum(len(r) for r in request_items.values()) > BATCH_WRITE_MAX_ITEMS:
+                raise _error(ValidationException, 'Too many items requested for the BatchWriteItem call')
+            unprocessed = {}
+            capacity = []
+            for table_name, requests in request_items.items():
+                table = self.__table(table_name)
+                units = 0
+                for request in requests:
+                    if self.__unprocessed():
+                        unprocessed.setdefault(table_name, []).append(request)
+                        continue
+                    if 'PutRequest' in request:
+                        item = request['PutRequest']['Item']
+                        item_key = table.item_key(table.key_of(item))
+                        old = table.items.get(item_key)
+                        table.items[item_key] = copy_item(item)
+                        units += self.__write_units(old, item)
+                    else:
+                        item_key = table.item_key(request['DeleteRequest']['Key'])
+                        units += self.__write_units(table.items.pop(item_key, None), None)
+                c = self.__capacity(table_name, return_consumed_capacity, units)
+                if not c is None:
+                    capacity.append(c)
+            result = {'UnprocessedItems': unprocessed}
+            if return_consumed_capacity in ('TOTAL', 'INDEXES'):
+                result['ConsumedCapacity'] = capacity
+            return result
+
+    @staticmethod
+    def __page(table, items, range_key_name, limit, exclusive_start_key, attributes_to_get, select):
+        if not exclusive_start_key is None:
+            start = table.item_key(table.key_of(exclusive_start_key))
+            for n, item in enumerate(items):
+                if table.item_key(table.key_of(item)) == start:
+                    items = items[n + 1:]
+                    break
+        result = {}
+        if not limit is None and len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            last_key = table.key_of(last)
+            if not range_key_name is None and range_key_name in last:
+                last_key[range_key_name] = last[range_key_name]
+            result['LastEvaluatedKey'] = copy_item(last_key)
+        result['Count'] = len(items)
+        result['ScannedCount'] = len(items)
+        if select != 'COUNT':
+            result['Items'] = [MemoryBackend.__project(i, attributes_to_get) for i in items]
+        return result
+
+    def query(self, table_name, key_conditions, index_name=None, select=None, attributes_to_get=None, limit=None,
+              consistent_read=None, query_filter=None, conditional_operator=None, scan_index_forward=None,
+              exclusive_start_key=None, return_consumed_capacity=None, projection_expression=None,
+              filter_expression=None, expression_attribute_names=None, expression_attribute_values=None):
+        self.__call('Query')
+        with self.lock:
+            table = self.__table(table_name)
+            if index_name is None:
+                hash_key_name, range_key_name = table.hash_key_name, table.range_key_name
+            elif index_name in table.indexes:
+                hash_key_name, range_key_name = table.indexes[index_name]
+            else:
+                raise _error(ValidationException, 'Index {} not found'.format(index_name))
+            if not hash_key_name in key_conditions:
+                raise _error(ValidationException, 'Query condition missed key schema element {}'.format(
+                    hash_key_name))
+            items = []
+            for item in table.items.values():
+                if not range_key_name is None and not range_key_name in item:
+                    continue
+                if _check_conditions(item, key_conditions, 'AND', False):
+                    if not query_filter or _check_conditions(item, query_filter, conditional_operator, False):
+                        items.append(item)
+            if not range_key_name is None:
+                items.sort(key=lambda i: _normalize(i[range_key_name])[1],
+                           reverse=scan_index_forward is False)
+            return self.__page(table, items, range_key_name, limit, exclusive_start_key, attributes_to_get, select)
+
+    def scan(self, table_name, attributes_to_get=None, limit=None, select=None, scan_filter=None,
+             conditional_operator=None, exclusive_start_key=None, return_consumed_capacity=None,
+             total_segments=None, segment=None, projection_expression=None, filter_expression=None,
+             expression_attribute_names=None, expression_attribute_values=None):
+        self.__call('Scan')
+        with self.lock:
+            table = self.__table(table_name)
+            items = []
+            for item_key in sorted(table.items.keys()):
+                if not total_segments is None and \
+                        zlib.crc32(json.dumps(item_key[0][1], default=str).encode('utf-8')) % total_segments != \
+                        segment:
+                    continue
+                item = table.items[item_key]
+                if not scan_filter or _check_conditions(item, scan_filter, conditional_operator, False):
+                    items.append(item)
+            return self.__page(table, items, None, limit, exclusive_start_key, attributes_to_get, select)
@@ -0,0 +1,505 @@
+from datetime import datetime
+import decimal
+import re
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+__author__ = 'drblez'
+
+"""
+
+    Attribute codec.
+
+    Python values are encoded to DynamoDB wire format by encoders cached per exact type, so an attribute costs one
+    dict lookup instead of a chain of type comparisons. Semantics are the ones of constructor.Field: str -> S,
+    int/float/Decimal -> N, datetime -> S (isoformat), non-empty list or set -> SS, NS, or SS of isoformats for
+    datetimes. Every set member is encoded by its own type, members which do not fit the set type raise
+    BadDynamoDBType. A list of lists or sets is encoded as L of typed values. Other types (including bool, unicode
+    and long on Python 2) raise BadDynamoDBType.
+
+        encode({'a': 1})                   -> BadDynamoDBType
+        encode([1, 2])                     -> {'NS': ['1', '2']}
+        encode([['a'], set([1])])          -> {'L': [{'SS': ['a']}, {'NS': ['1']}]}
+        encode_item({'id': 'x', 'n': 42})  -> {'id': {'S': 'x'}, 'n': {'N': '42'}}
+        encode_updates({'n': ('ADD', 1), 'name': 'y', 'old': ('DELETE', None)})
+                                           -> {'n': {'Value': {'N': '1'}, 'Action': 'ADD'},
+                                               'name': {'Value': {'S': 'y'}, 'Action': 'PUT'},
+                                               'old': {'Action': 'DELETE'}}
+
+    A table may register an AttributeSchema which pre-binds attribute types: values of declared attributes are
+    converted to the declared type without type dispatch (e.g. 'N' for a str counter, 'SS' for ids given as ints),
+    other attributes are encoded by their Python type.
+
+        register_schema('orders', {'total': 'N', 'created': 'D', 'tags': 'SS'})
+        encode_item(item, get_schema('orders'))
+
+    Decoding is the inverse: N -> int (Decimal if fractional or with exponent), SS/NS/BS -> set, S -> str or, if
+    asked, datetime for values in isoformat. ItemView decodes attributes lazily, on first access, and caches them.
+
+        decode_item({'n': {'N': '42'}, 'tags': {'SS': ['a']}})  -> {'n': 42, 'tags': set(['a'])}
+        ItemView(result['Item'], datetimes=['created'])['created']  -> datetime(...)
+
+"""
+
+
+class EmptyList(Exception):
+    pass
+
+
+class BadDynamoDBType(Exception):
+    pass
+
+
+_COLLECTION_TYPES = (list, set, frozenset)
+
+
+def dynamodb_type(value):
+    if type(value) == str:
+        return 'S'
+    elif type(value) == int:
+        return 'N'
+    elif type(value) == float:
+        return 'N'
+    elif type(value) == decimal.Decimal:
+        return 'N'
+    elif type(value) == datetime:
+        return 'D'
+    elif type(value) in _COLLECTION_TYPES:
+        if len(value) == 0:
+            raise EmptyList()
+        first = next(iter(value))
+        if type(first) in _COLLECTION_TYPES:
+            return 'L'
+        return dynamodb_type(first) + 'S'
+    else:
+        raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
+
+
+def _encode_string(value):
+    return 'S', value
+
+
+def _encode_number(value):
+    return 'N', str(value)
+
+
+def _encode_datetime(value):
+    return 'S', value.isoformat()
+
+
+_scalar_encoders = {
+    str: _encode_string,
+    int: _encode_number,
+    float: _encode_number,
+    decimal.Decimal: _encode_number,
+    datetime: _encode_datetime
+}
+
+
+def _string_members(value):
+    return list(value)
+
+
+def _number_members(value):
+    return [str(v) for v in value]
+
+
+def _datetime_members(value):
+    return [v.isoformat() for v in value]
+
+
+# Members of sets of one Python type: (set type, function value -> wire members)
+_set_encoders = {
+    str: ('SS', _string_members),
+    int: ('NS', _number_members),
+    float: ('NS', _number_members),
+    decimal.Decimal: ('NS', _number_members),
+    datetime: ('SS', _datetime_members)
+}
+
+
+def _encode_set(value):
+    """
+
+    Set of scalars, every member is encoded by its own type and must have the type of the first one (S or N)
+
+    """
+    if len(value) == 0:
+        raise EmptyList()
+    first_type = None
+    for v in value:
+        if first_type is None:
+            first_type = type(v)
+        elif type(v) != first_type:
+            break
+    else:
+        if first_type in _set_encoders:
+            set_type, f = _set_encoders[first_type]
+            return set_type, f(value)
+    # Members of mixed types, e.g. int and Decimal
+    member_type = None
+    members = []
+    for v in value:
+        f = _scalar_encoders.get(type(v))
+        if f is None:
+            raise BadDynamoDBType('Bad type {} of set member {}'.format(type(v), v))
+        t, member = f(v)
+        if member_type is None:
+            member_type = t
+        elif t != member_type:
+            raise BadDynamoDBType('Member {} does not fit {}S set {}'.format(v, member_type, value))
+        members.append(member)
+    return member_type + 'S', members
+
+
+def _encode_list(value):
+    """
+
+    List of values or collections: set of the values, or L of the collections encoded by their own types
+
+    """
+    if len(value) == 0:
+        raise EmptyList()
+    if not type(value[0]) in _COLLECTION_TYPES:
+        return _encode_set(value)
+    members = []
+    for v in value:
+        if not type(v) in _COLLECTION_TYPES:
+            raise BadDynamoDBType('Member {} does not fit L of collections {}'.format(v, value))
+        members.append(encode(v))
+    return 'L', members
+
+
+_encoders = dict(_scalar_encoders)
+_encoders[list] = _encode_list
+_encoders[set] = _encode_set
+_encoders[frozenset] = _encode_set
+
+
+def _wire_string(value):
+    return {'S': value}
+
+
+def _wire_number(value):
+    return {'N': str(value)}
+
+
+def _wire_datetime(value):
+    return {'S': value.isoformat()}
+
+
+def _wire_collection(value):
+    t, v = _encoders[type(value)](value)
+    return {t: v}
+
+
+# Encoders straight to wire format, used by encode()
+_wire_encoders = {
+    str: _wire_string,
+    int: _wire_number,
+    float: _wire_number,
+    decimal.Decimal: _wire_number,
+    datetime: _wire_datetime,
+    list: _wire_collection,
+    set: _wire_collection,
+    frozenset: _wire_collection
+}
+
+
+def format_number(n):
+    """
+
+    @param n: Decimal
+    @return: N wire value without exponent and trailing zeros, as DynamoDB returns it
+    """
+    s = str(n)
+    if 'E' in s or '.' in s:
+        s = '{:f}'.format(n)
+        if '.' in s:
+            s = s.rstrip('0').rstrip('.')
+    return s
+
+
+def copy_value(value):
+    """
+
+    @param value: Attribute value in wire format
+    @return: Copy not sharing lists with value, numbers as str
+    """
+    t, v = list(value.items())[0]
+    if t == 'N':
+        return {t: str(v)}
+    if t == 'NS':
+        return {t: [str(i) for i in v]}
+    if isinstance(v, list):
+        return {t: list(v)}
+    return {t: v}
+
+
+def copy_item(item):
+    return dict((k, copy_value(v)) for k, v in item.items())
+
+
+def encoder(value_type):
+    """
+
+    @param value_type: Exact Python type
+    @return: Function value -> (DynamoDB type, wire value), None if the type is not supported
+    """
+    return _encoders.get(value_type)
+
+
+def encode_typed(value):
+    """
+
+    @return: (DynamoDB type, wire value), e.g. ('N', '42')
+    """
+    f = _encoders.get(type(value))
+    if f is None:
+        raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
+    return f(value)
+
+
+def encode(value):
+    """
+
+    @return: Attribute value in wire format, e.g. {'N': '42'}
+    """
+    f = _wire_encoders.get(type(value))
+    if f is None:
+        raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
+    return f(value)
+
+
+def _bind_string(value):
+    if type(value) == str:
+        return 'S', value
+    if type(value) == datetime:
+        return 'S', value.isoformat()
+    return 'S', str(value)
+
+
+def _bind_string_set(value):
+    if len(value) == 0:
+        raise EmptyList()
+    if type(value[0]) == datetime:
+        return 'SS', [v.isoformat() for v in value]
+    return 'SS', [str(v) for v in value]
+
+
+def _bind_number_set(value):
+    if len(value) == 0:
+        raise EmptyList()
+    return 'NS', [str(v) for v in value]
+
+
+# Encoders of schema attribute types, the value is converted without type dispatch
+_bound_encoders = {
+    'S': _bind_string,
+    'N': _encode_number,
+    'D': _bind_string,
+    'SS': _bind_string_set,
+    'NS': _bind_number_set,
+    'DS': _bind_string_set
+}
+
+
+class AttributeSchema():
+    def __init__(self, attribute_types):
+        """
+
+        @param attribute_types: {attribute name: 'S', 'N', 'D', 'SS', 'NS' or 'DS'}, types of dynamodb_type()
+        """
+        self.attribute_types = dict(attribute_types)
+        self.encoders = {}
+        for name, t in self.attribute_types.items():
+            if not t in _bound_encoders:
+                raise BadDynamoDBType('Bad type {} of attribute {}'.format(t, name))
+            self.encoders[name] = _bound_encoders[t]
+
+    def encode_typed(self, name, value):
+        """
+
+        @return: (DynamoDB type, wire value) of attribute name
+        """
+        f = self.encoders.get(name)
+        if f is None:
+            return encode_typed(value)
+        return f(value)
+
+    def encode(self, name, value):
+        t, v = self.encode_typed(name, value)
+        return {t: v}
+
+
+schemas = {}
+
+
+def register_schema(table_name, attribute_types):
+    """
+
+    @param attribute_types: See AttributeSchema
+    @return: AttributeSchema registered for table_name
+    """
+    schema = AttributeSchema(attribute_types)
+    schemas[table_name] = schema
+    return schema
+
+
+def get_schema(table_name):
+    """
+
+    @return: AttributeSchema of table_name, None if not registered
+    """
+    return schemas.get(table_name)
+
+
+def encode_item(item, schema=None):
+    """
+
+    @param item: {attribute name: Python value}
+    @param schema: AttributeSchema pre-binding attribute types, optional
+    @return: Item in wire format
+    """
+    result = {}
+    bound = {} if schema is None else schema.encoders
+    for name, value in item.items():
+        f = bound.get(name)
+        if f is None:
+            f = _encoders.get(type(value))
+            if f is None:
+                raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
+        t, v = f(value)
+        result[name] = {t: v}
+    return result
+
+
+def encode_updates(updates, schema=None):
+    """
+
+    @param updates: {attribute name: (action, Python value) or Python value for PUT}, action is 'ADD', 'PUT' or
+    'DELETE', value of DELETE is None to remove the attribute or a list to remove set members
+    @param schema: AttributeSchema pre-binding attribute types, optional
+    @return: AttributeUpdates in wire format
+    """
+    result = {}
+    bound = {} if schema is None else schema.encoders
+    for name, update in updates.items():
+        if type(update) == tuple:
+            action, value = update
+        else:
+            action, value = 'PUT', update
+        if value is None and action == 'DELETE':
+            result[name] = {'Action': action}
+            continue
+        f = bound.get(name)
+        if f is None:
+            f = _encoders.get(type(value))
+            if f is None:
+                raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
+        t, v = f(value)
+        result[name] = {'Value': {t: v}, 'Action': action}
+    return result
+
+
+_ISO_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{6})?$')
+
+
+def _decode_number(value):
+    if '.' in value or 'e' in value or 'E' in value:
+        return decimal.Decimal(value)
+    return int(value)
+
+
+def _decode_string(value, datetimes):
+    if datetimes and _ISO_DATETIME.match(value):
+        if len(value) == 19:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return value
+
+
+def decode(value, datetimes=False):
+    """
+
+    @param value: Attribute value in wire format, e.g. {'N': '42'}
+    @param datetimes: Decode S values in isoformat of naive datetime (as written by encode) to datetime
+    @return: Python value
+    """
+    for t, v in value.items():
+        if t == 'S':
+            return _decode_string(v, datetimes)
+        elif t == 'N':
+            return _decode_number(v)
+        elif t == 'SS':
+            return set(_decode_string(i, datetimes) for i in v)
+        elif t == 'NS':
+            return set(_decode_number(i) for i in v)
+        elif t == 'BS':
+            return set(v)
+        elif t == 'NULL':
+            return None
+        elif t == 'L':
+            return [decode(i, datetimes) for i in v]
+        elif t == 'M':
+            return decode_item(v, datetimes)
+        # B and BOOL
+        return v
+    raise BadDynamoDBType('Bad attribute value {}'.format(value))
+
+
+def _decodes_datetime(datetimes, name):
+    if datetimes is True or datetimes is False:
+        return datetimes
+    return name in datetimes
+
+
+def decode_item(item, datetimes=False, hidden_fields=()):
+    """
+
+    @param item: Item in wire format
+    @param datetimes: True to decode every S value in isoformat to datetime, or names of such attributes
+    @param hidden_fields: Attribute names left out
+    @return: {attribute name: Python value}
+    """
+    return dict((k, decode(v, _decodes_datetime(datetimes, k))) for k, v in item.items() if not k in hidden_fields)
+
+
+class ItemView(Mapping):
+    def __init__(self, item, datetimes=False, hidden_fields=()):
+        """
+
+        Read-only mapping over an item in wire format, every attribute is decoded on first access
+
+        @param datetimes: See decode_item()
+        @param hidden_fields: Attribute names not visible through the view
+        """
+        self.item = item
+        self.datetimes = datetimes
+        self.hidden_fields = hidden_fields
+        self.decoded = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.decoded[name]
+        except KeyError:
+            pass
+        if name in self.hidden_fields:
+            raise KeyError(name)
+        value = decode(self.item[name], _decodes_datetime(self.datetimes, name))
+        self.decoded[name] = value
+        return value
+
+    def __contains__(self, name):
+        return name in self.item and not name in self.hidden_fields
+
+    def __iter__(self):
+        return (k for k in self.item if not k in self.hidden_fields)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'ItemView({})'.format(dict(self.items()))
@@ -1,5 +1,4 @@
-from datetime import datetime
-import decimal
+from dynamodb2.codec import BadDynamoDBType, EmptyList, dynamodb_type, encode
 
 __author__ = 'drblez'
 
@@ -43,12 +42,9 @@ __author__ = 'drblez'
 """
 
 
-class EmptyList(Exception):
-    pass
-
-
-class BadDynamoDBType(Exception):
-    pass
+# Exceptions and dynamodb_type() live in codec and stay importable from here
+__all__ = ['ActionAlreadyExists', 'BadDynamoDBType', 'EmptyList', 'Expected', 'ExpectedError', 'Field', 'KeyConditions',
+           'Update', 'dynamodb_type']
 
 
 class ActionAlreadyExists(Exception):
@@ -59,57 +55,19 @@ class ExpectedError(Exception):
     pass
 
 
-def dynamodb_type(value):
-    if type(value) == str:
-        return 'S'
-    elif type(value) == int:
-        return 'N'
-    elif type(value) == float:
-        return 'N'
-    elif type(value) == decimal.Decimal:
-        return 'N'
-    elif type(value) == datetime:
-        return 'D'
-    elif type(value) == list:
-        if len(value) == 0:
-            raise EmptyList()
-        return dynamodb_type(value[0]) + 'S'
-    else:
-        raise BadDynamoDBType('Bad type {} of value {}'.format(type(value), value))
-
-
 class Field():
     def __init__(self, name, value):
         self.name = name
-        self.type = dynamodb_type(value)
-        if self.type in ['SS', 'NS']:
-            t = []
-            for v in value:
-                t.append(str(v))
-            self.value = t
-        elif self.type == 'D':
-            self.type = 'S'
-            self.value = value.isoformat()
-        elif self.type == 'DS':
-            self.type = 'SS'
-            t = []
-            for v in value:
-                t.append(v.isoformat())
-            self.value = t
-        else:
-            self.value = str(value)
-        self.items = [self]
+        self.value = encode(value)
+        # (name, wire value) of this and following fields, no Field per attribute
+        self.items = [(name, self.value)]
 
     def field(self, name, value):
-        f = Field(name, value)
-        self.items.append(f)
+        self.items.append((name, encode(value)))
         return self
 
     def dict(self):
-        d = {}
-        for i in self.items:
-            d[i.name] = {i.type: i.value}
-        return d
+        return dict(self.items)
 
 
 class Update():
@@ -122,20 +80,20 @@ class Update():
     def add(self, value):
         if not self.action is None:
             raise ActionAlreadyExists('For field {} exists action {}'.format(self.field, self.action))
-        self.value = Field('Value', value).dict()
+        self.value = encode(value)
         self.action = 'ADD'
         self.items.append(self)
         return self
 
     def put(self, value):
-        self.value = Field('Value', value).dict()
+        self.value = encode(value)
         self.action = 'PUT'
         self.items.append(self)
         return self
 
     def delete(self, value=None):
         if not value is None:
-            self.value = Field('Value', value).dict()
+            self.value = encode(value)
         self.action = 'DELETE'
         self.items.append(self)
         return self
@@ -147,12 +105,10 @@ class Update():
     def dict(self):
         d = {}
         for i in self.items:
-            if not i.value is None:
-                t = i.value
+            if i.value is None:
+                d[i.field] = {'Action': i.action}
             else:
-                t = {}
-            t['Action'] = i.action
-            d[i.field] = t
+                d[i.field] = {'Value': i.value, 'Action': i.action}
         return d
 
 
@@ -165,7 +121,7 @@ class Expected():
         if value is None:
             self.value = None
         else:
-            self.value = Field('Value', value).dict()
+            self.value = encode(value)
         self.items = [self]
 
     def expected(self, field, exists, value=None):
@@ -176,12 +132,10 @@ class Expected():
     def dict(self):
         d = {}
         for i in self.items:
-            if not i.value is None:
-                t = i.value
+            if i.value is None:
+                d[i.field] = {'Exists': i.exists}
             else:
-                t = {}
-            t['Exists'] = i.exists
-            d[i.field] = t
+                d[i.field] = {'Value': i.value, 'Exists': i.exists}
         return d
 
 
@@ -193,8 +147,8 @@ class KeyConditions():
         self.values = []
 
     def between(self, lower, upper):
-        v1 = Field('Value', lower).dict()['Value']
-        v2 = Field('Value', upper).dict()['Value']
+        v1 = encode(lower)
+        v2 = encode(upper)
         self.values = [v1, v2]
         self.operator = 'BETWEEN'
         self.items.append(self)
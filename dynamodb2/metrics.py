@@ -0,0 +1,290 @@
+import bisect
+import threading
+from time import time
+
+__author__ = 'drblez'
+
+"""
+
+    DynamoDB request metrics.
+
+    Every request made by a transaction goes through Tx._call, which counts it per transaction (Tx.calls) and, only
+    when a sink is registered, times it and reports it to all sinks labeled by category, operation and table:
+
+        category    'data' for user item reads/writes, 'lock' for lock/unlock updates and lock token reads,
+                    'tx' for tx record and undo log bookkeeping
+        operation   low level call name: get_item, put_item, update_item, delete_item, batch_write_item, ...
+        outcome     'ok' or DynamoDB error code, e.g. 'ConditionalCheckFailedException'
+
+    Sinks also receive lock waits (dynamodb2.transaction.wait.LockWait) and retries. With no sink registered the
+    cost of instrumentation is one dict increment per request.
+
+        sink = AggregatingSink()
+        add_sink(sink)
+        set_consumed_capacity('TOTAL')
+        ...
+        export(sink.snapshot())
+
+"""
+
+CATEGORY_DATA = 'data'
+CATEGORY_LOCK = 'lock'
+CATEGORY_TX = 'tx'
+
+OUTCOME_OK = 'ok'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Calls accepting return_consumed_capacity
+CAPACITY_OPERATIONS = frozenset(['get_item', 'put_item', 'update_item', 'delete_item', 'batch_get_item',
+                                 'batch_write_item', 'query', 'scan'])
+
+# Registered sinks, replaced (never mutated) under _sinks_lock so readers need no lock
+sinks = ()
+_sinks_lock = threading.Lock()
+
+return_consumed_capacity = None
+
+
+class MetricsSink():
+    def call(self, category, operation, table_name, latency, outcome, capacity_units):
+        """
+
+        @param latency: Request time, sec.
+        @param outcome: OUTCOME_OK or error code
+        @param capacity_units: Consumed capacity units or None if not returned
+        """
+        pass
+
+    def lock_wait(self, lock_wait):
+        """
+
+        @param lock_wait: LockWait instance
+        """
+        pass
+
+    def retry(self, category, operation, table_name, reason):
+        pass
+
+
+def add_sink(sink):
+    global sinks
+    with _sinks_lock:
+        sinks = sinks + (sink,)
+
+
+def remove_sink(sink):
+    global sinks
+    with _sinks_lock:
+        sinks = tuple(s for s in sinks if not s is sink)
+
+
+def clear_sinks():
+    global sinks
+    with _sinks_lock:
+        sinks = ()
+
+
+def set_consumed_capacity(mode):
+    """
+
+    @param mode: 'TOTAL' or 'INDEXES' to request ConsumedCapacity with every instrumented call while a sink is
+    registered, None to report only capacity requested by caller
+    """
+    global return_consumed_capacity
+    return_consumed_capacity = mode
+
+
+def table_label(operation, args):
+    if operation in ('batch_get_item', 'batch_write_item'):
+        return ','.join(sorted(args[0].keys()))
+    return args[0]
+
+
+def capacity_units(result):
+    if not isinstance(result, dict):
+        return None
+    consumed = result.get('ConsumedCapacity')
+    if consumed is None:
+        return None
+    if isinstance(consumed, dict):
+        return consumed.get('CapacityUnits')
+    return sum(c.get('CapacityUnits', 0) for c in consumed)
+
+
+def timed_call(category, operation, func, args, kwargs):
+    """
+
+    Make request func(*args, **kwargs) and report it to registered sinks
+
+    """
+    if not return_consumed_capacity is None and operation in CAPACITY_OPERATIONS and \
+            kwargs.get('return_consumed_capacity') is None:
+        kwargs['return_consumed_capacity'] = return_consumed_capacity
+    table_name = table_label(operation, args)
+    started = time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        outcome = getattr(e, 'error_code', None) or e.__class__.__name__
+        report_call(category, operation, table_name, time() - started, outcome, None)
+        raise
+    report_call(category, operation, table_name, time() - started, OUTCOME_OK, capacity_units(result))
+    return result
+
+
+def report_call(category, operation, table_name, latency, outcome, units):
+    for sink in sinks:
+        sink.call(category, operation, table_name, latency, outcome, units)
+
+
+def report_lock_wait(lock_wait):
+    for sink in sinks:
+        sink.lock_wait(lock_wait)
+
+
+def report_retry(category, operation, table_name, reason):
+    for sink in sinks:
+        sink.retry(category, operation, table_name, reason)
+
+
+class Histogram():
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+
+        @param buckets: Sorted upper bounds, values above the last bound fall into overflow bucket
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+
+        @param p: Percentile, 0 .. 100
+        @return: Upper bound of bucket holding percentile (max observed value for overflow bucket)
+        """
+        if self.count == 0:
+            return 0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for n, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                if n < len(self.buckets):
+                    return min(self.buckets[n], self.max)
+                return self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+
+
+class _CallStat():
+    def __init__(self):
+        self.latency = Histogram()
+        self.outcomes = {}
+        self.capacity_units = 0.0
+        self.retries = 0
+
+
+class _LockWaitStat():
+    def __init__(self):
+        self.wait_time = Histogram()
+        self.acquired = 0
+        self.timeouts = 0
+        self.attempts = 0
+
+
+class AggregatingSink(MetricsSink):
+    def __init__(self):
+        """
+
+        Sink keeping latency histograms, outcome counters, consumed capacity, retries and lock waits in memory,
+        snapshot() returns them for export
+
+        """
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.lock_waits = {}
+
+    def __call_stat(self, category, operation, table_name):
+        labels = (category, operation, table_name)
+        stat = self.calls.get(labels)
+        if stat is None:
+            stat = self.calls[labels] = _CallStat()
+        return stat
+
+    def call(self, category, operation, table_name, latency, outcome, capacity_units):
+        with self.lock:
+            stat = self.__call_stat(category, operation, table_name)
+            stat.latency.observe(latency)
+            stat.outcomes[outcome] = stat.outcomes.get(outcome, 0) + 1
+            if not capacity_units is None:
+                stat.capacity_units += capacity_units
+
+    def lock_wait(self, lock_wait):
+        labels = (lock_wait.table_name, lock_wait.lock_state)
+        with self.lock:
+            stat = self.lock_waits.get(labels)
+            if stat is None:
+                stat = self.lock_waits[labels] = _LockWaitStat()
+            stat.wait_time.observe(lock_wait.wait_time)
+            stat.attempts += lock_wait.attempts
+            if lock_wait.acquired:
+                stat.acquired += 1
+            else:
+                stat.timeouts += 1
+
+    def retry(self, category, operation, table_name, reason):
+        with self.lock:
+            self.__call_stat(category, operation, table_name).retries += 1
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.lock_waits = {}
+
+    def snapshot(self):
+        """
+
+        @return: {'calls': [{'category', 'operation', 'table', 'latency', 'outcomes', 'capacity_units',
+        'retries'}, ...], 'lock_waits': [{'table', 'lock', 'wait_time', 'acquired', 'timeouts', 'attempts'}, ...]}
+        """
+        with self.lock:
+            calls = [{
+                'category': category,
+                'operation': operation,
+                'table': table_name,
+                'latency': stat.latency.to_dict(),
+                'outcomes': dict(stat.outcomes),
+                'capacity_units': stat.capacity_units,
+                'retries': stat.retries
+            } for (category, operation, table_name), stat in sorted(self.calls.items())]
+            lock_waits = [{
+                'table': table_name,
+                'lock': lock_state,
+                'wait_time': stat.wait_time.to_dict(),
+                'acquired': stat.acquired,
+                'timeouts': stat.timeouts,
+                'attempts': stat.attempts
+            } for (table_name, lock_state), stat in sorted(self.lock_waits.items())]
+        return {'calls': calls, 'lock_waits': lock_waits}
@@ -0,0 +1,82 @@
+from multiprocessing.pool import ThreadPool
+import threading
+
+from dynamodb2 import tracing
+
+__author__ = 'drblez'
+
+"""
+
+    Shared thread pool for fan-out of independent DynamoDB requests (lock, unlock, restore).
+
+    Calls made from inside a pool worker run inline, so nested parallel_map never waits for its own pool. Workers
+    run with the current tracing span of the caller, see tracing.attach.
+
+"""
+
+DEFAULT_MAX_WORKERS = 16
+
+_pool = None
+_max_workers = DEFAULT_MAX_WORKERS
+_pool_lock = threading.Lock()
+_worker = threading.local()
+
+
+def set_max_workers(max_workers):
+    global _pool, _max_workers
+    with _pool_lock:
+        _max_workers = max_workers
+        if not _pool is None:
+            _pool.close()
+            _pool = None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(_max_workers)
+        return _pool
+
+
+def _run(args):
+    func, item, span = args
+    _worker.active = True
+    if span is None:
+        return func(item)
+    tracing.attach(span)
+    try:
+        return func(item)
+    finally:
+        tracing.detach(span)
+
+
+def parallel_map(func, items):
+    """
+
+    Apply func to every item on the shared thread pool, result order matches items order.
+    The first exception raised by func is re-raised after all calls are finished.
+
+    @param func: Callable of one argument
+    @param items: Iterable of arguments
+    @return: List of results
+    """
+    items = list(items)
+    if len(items) < 2 or getattr(_worker, 'active', False):
+        return [func(item) for item in items]
+    span = tracing.current_span()
+    return _get_pool().map(_run, [(func, item, span) for item in items])
+
+
+def parallel_try_map(func, items):
+    """
+
+    Same as parallel_map, but exceptions are not raised, every result is (True, value) or (False, exception)
+
+    """
+    def call(item):
+        try:
+            return True, func(item)
+        except Exception as e:
+            return False, e
+    return parallel_map(call, items)
@@ -0,0 +1,77 @@
+from collections import deque
+import threading
+
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.aws_credential import AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_REGION
+
+__author__ = 'drblez'
+
+"""
+
+    Pool of AWSDynamoDB2Connection instances keyed by (access key, secret key, region).
+
+    A connection is borrowed by one Tx at a time and returned on commit/rollback, so its HTTP/TLS state is reused
+    by the next transaction instead of being set up again. Idle connections above max_size are dropped.
+
+"""
+
+DEFAULT_POOL_SIZE = 16
+
+
+class ConnectionPool():
+    def __init__(self, max_size=DEFAULT_POOL_SIZE, factory=AWSDynamoDB2Connection):
+        """
+
+        @param max_size: Max number of idle connections kept for every credentials/region key
+        @param factory: Callable(access_key, secret_access_key, region) returning new connection
+        """
+        self.max_size = max_size
+        self.factory = factory
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.stat = {'HIT': 0, 'MISS': 0, 'RELEASE': 0, 'DISCARD': 0}
+
+    def set_max_size(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            for connections in self.idle.values():
+                while len(connections) > max_size:
+                    connections.pop()
+                    self.stat['DISCARD'] += 1
+
+    def acquire(self, access_key=AWS_ACCESS_KEY_ID, secret_access_key=AWS_SECRET_ACCESS_KEY, region=AWS_REGION):
+        """
+
+        Borrow connection from pool or create new one
+
+        @rtype : AWSDynamoDB2Connection
+        """
+        pool_key = (access_key, secret_access_key, region)
+        with self.lock:
+            connections = self.idle.get(pool_key)
+            if connections:
+                self.stat['HIT'] += 1
+                return connections.pop()
+            self.stat['MISS'] += 1
+        connection = self.factory(access_key, secret_access_key, region)
+        connection.pool_key = pool_key
+        return connection
+
+    def release(self, connection):
+        pool_key = getattr(connection, 'pool_key', None)
+        if pool_key is None:
+            return
+        with self.lock:
+            connections = self.idle.setdefault(pool_key, deque())
+            if len(connections) < self.max_size:
+                connections.append(connection)
+                self.stat['RELEASE'] += 1
+            else:
+                self.stat['DISCARD'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.idle.clear()
+
+
+connection_pool = ConnectionPool()
@@ -0,0 +1,134 @@
+import threading
+from time import time
+import weakref
+
+__author__ = 'drblez'
+
+"""
+
+    Process wide cache of DynamoDB table descriptors.
+
+    describe_table is a control plane call with a low request rate limit, but key schemas practically never change,
+    so descriptors are cached per (access key, region, table name) and parsed once into TableKeySchema.
+    Descriptors of a backend (see dynamodb2.backend) are cached per backend instance, which is referenced weakly:
+    pooled or per-test backends are not kept alive by the cache, their entries go away with them.
+
+"""
+
+DEFAULT_SCHEMA_TTL = 300
+
+
+class TableKeySchema():
+    def __init__(self, table_descriptor):
+        self.hash_key_name = None
+        self.range_key_name = None
+        self.hash_key_type = None
+        self.range_key_type = None
+        for key in table_descriptor['KeySchema']:
+            if key['KeyType'] == 'HASH':
+                self.hash_key_name = key['AttributeName']
+            elif key['KeyType'] == 'RANGE':
+                self.range_key_name = key['AttributeName']
+        for attr in table_descriptor['AttributeDefinitions']:
+            if attr['AttributeName'] == self.hash_key_name:
+                self.hash_key_type = attr['AttributeType']
+            elif attr['AttributeName'] == self.range_key_name:
+                self.range_key_type = attr['AttributeType']
+        self.key_names = [self.hash_key_name]
+        if not self.range_key_name is None:
+            self.key_names.append(self.range_key_name)
+
+
+class _SchemaEntry():
+    def __init__(self, table_descriptor, expires_at):
+        self.table_descriptor = table_descriptor
+        self.key_schema = TableKeySchema(table_descriptor)
+        self.expires_at = expires_at
+
+
+class TableSchemaCache():
+    def __init__(self, ttl=DEFAULT_SCHEMA_TTL):
+        """
+
+        @param ttl: Seconds a cached descriptor stays valid, None means forever
+        """
+        self.ttl = ttl
+        self.entries = {}
+        self.backend_entries = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.stat = {'HIT': 0, 'MISS': 0}
+
+    def __expires_at(self):
+        if self.ttl is None:
+            return None
+        return time() + self.ttl
+
+    def __entries(self, backend):
+        if backend is None:
+            return self.entries
+        entries = self.backend_entries.get(backend)
+        if entries is None:
+            entries = {}
+            self.backend_entries[backend] = entries
+        return entries
+
+    def __valid(self, cache_key, backend):
+        entry = self.__entries(backend).get(cache_key)
+        if not entry is None and (entry.expires_at is None or entry.expires_at > time()):
+            self.stat['HIT'] += 1
+            return entry
+        return None
+
+    def get(self, cache_key, loader, backend=None):
+        """
+
+        Return cached entry for cache_key, on miss or expiry call loader() and cache its result
+
+        @param cache_key: (access key, region, table name)
+        @param loader: Callable returning table descriptor (describe_table()['Table'])
+        @param backend: Backend instance the descriptor belongs to, None for AWS
+        @return: _SchemaEntry instance
+        """
+        with self.lock:
+            entry = self.__valid(cache_key, backend)
+            if not entry is None:
+                return entry
+            self.stat['MISS'] += 1
+        # describe_table is called outside of the lock, concurrent misses for the same table are harmless
+        entry = _SchemaEntry(loader(), self.__expires_at())
+        with self.lock:
+            self.__entries(backend)[cache_key] = entry
+        return entry
+
+    def peek(self, cache_key, backend=None):
+        """
+
+        @return: Valid cached entry or None, never calls describe_table
+        """
+        with self.lock:
+            return self.__valid(cache_key, backend)
+
+    def put(self, cache_key, table_descriptor, backend=None):
+        with self.lock:
+            self.__entries(backend)[cache_key] = _SchemaEntry(table_descriptor, self.__expires_at())
+
+    def invalidate(self, cache_key=None, backend=None):
+        """
+
+        Drop one cached descriptor or, without cache_key, all of them (all descriptors of backend if it is given)
+
+        @param cache_key: (access key, region, table name)
+        @param backend: Backend instance the descriptor belongs to, None for AWS
+        """
+        with self.lock:
+            if cache_key is None:
+                if backend is None:
+                    self.entries.clear()
+                    self.backend_entries.clear()
+                else:
+                    self.backend_entries.pop(backend, None)
+            else:
+                self.__entries(backend).pop(cache_key, None)
+
+
+schema_cache = TableSchemaCache()
@@ -0,0 +1,279 @@
+import functools
+import itertools
+import logging
+import random
+import threading
+from time import time
+import uuid
+
+import simplejson as json
+
+__author__ = 'drblez'
+
+"""
+
+    Structured tracing of transactions.
+
+    Nothing is traced until a Tracer is installed with set_tracer(). Sampling is decided once per transaction: a
+    sampled Tx gets a Trace whose root span covers the transaction, TxItem operations and DynamoDB requests add
+    child spans. Tx.trace of a not sampled transaction is None and every instrumented place skips tracing after
+    one attribute check. Attribute values may be callables, they are called only when the span is rendered.
+
+    Spans are nested per thread. parallel_map passes the current span to its pool workers, so requests fanned out
+    by lock_all, commit and rollback are children of the span which started them.
+
+        set_tracer(Tracer(sample_rate=0.01, exporter=LoggingExporter()))
+
+"""
+
+tracer = None
+
+# Pushed spans of this thread, innermost last
+_context = threading.local()
+
+
+def set_tracer(new_tracer):
+    """
+
+    @param new_tracer: Tracer instance, None disables tracing
+    """
+    global tracer
+    tracer = new_tracer
+
+
+def start_trace(name, attributes):
+    """
+
+    @return: Trace instance or None if tracing is disabled or transaction is not sampled
+    """
+    current = tracer
+    if current is None:
+        return None
+    return current.start_trace(name, attributes)
+
+
+def _stack():
+    stack = getattr(_context, 'stack', None)
+    if stack is None:
+        stack = _context.stack = []
+    return stack
+
+
+def _remove(stack, span):
+    for n in range(len(stack) - 1, -1, -1):
+        if stack[n] is span:
+            del stack[n]
+            return
+
+
+def current_span():
+    """
+
+    @return: Innermost span started with push in this thread (or attached to it), None if there is none
+    """
+    stack = getattr(_context, 'stack', None)
+    if stack:
+        return stack[-1]
+    return None
+
+
+def attach(span):
+    """
+
+    Make span started in another thread current in this thread, until detach(span)
+
+    """
+    _stack().append(span)
+
+
+def detach(span):
+    _remove(_stack(), span)
+
+
+def _error_label(error):
+    return getattr(error, 'error_code', None) or error.__class__.__name__
+
+
+class Span():
+    def __init__(self, trace, span_id, parent_id, name, attributes):
+        self.trace = trace
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time()
+        self.end = None
+        self.error = None
+
+    def set(self, key, value):
+        """
+
+        @param value: Attribute value or callable returning it, called on render
+        """
+        self.attributes[key] = value
+
+    def finish(self, error=None):
+        self.end = time()
+        if not error is None:
+            self.error = _error_label(error)
+        self.trace.finish_span(self)
+
+    def render(self):
+        attributes = {}
+        for k, v in self.attributes.items():
+            if callable(v):
+                try:
+                    v = v()
+                except Exception as e:
+                    v = '<{}>'.format(_error_label(e))
+            attributes[k] = v
+        return {
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': None if self.end is None else self.end - self.start,
+            'error': self.error,
+            'attributes': attributes
+        }
+
+
+class Trace():
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+        self.root = Span(self, next(self.ids), None, name, attributes)
+
+    def current(self):
+        stack = getattr(_context, 'stack', None)
+        if stack:
+            for span in reversed(stack):
+                if span.trace is self:
+                    return span
+        return self.root
+
+    def start_span(self, name, attributes=None, push=True):
+        """
+
+        @param push: Make span current in this thread, so spans started inside are its children. Spans started
+        without push (e.g. from coroutines sharing a thread) are children of the root span.
+        @return: Span instance
+        """
+        if push:
+            parent = self.current()
+        else:
+            parent = self.root
+        span = Span(self, next(self.ids), parent.span_id, name, {} if attributes is None else attributes)
+        if push:
+            _stack().append(span)
+        return span
+
+    def finish_span(self, span):
+        if span is self.root:
+            return
+        stack = getattr(_context, 'stack', None)
+        if stack:
+            _remove(stack, span)
+        with self.lock:
+            if len(self.spans) < self.tracer.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+    def finish(self, error=None, attributes=None):
+        """
+
+        Finish root span and pass the trace to tracer exporter
+
+        """
+        if not attributes is None:
+            self.root.attributes.update(attributes)
+        self.root.finish(error)
+        self.tracer.export(self)
+
+    def render(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            'trace_id': self.trace_id,
+            'dropped_spans': self.dropped,
+            'spans': [self.root.render()] + [s.render() for s in spans]
+        }
+
+
+class Tracer():
+    def __init__(self, sample_rate=1.0, exporter=None, max_spans=10000):
+        """
+
+        @param sample_rate: Part of transactions traced, 0 .. 1
+        @param exporter: Callable(Trace) called with every finished trace
+        @param max_spans: Spans kept per trace, later spans are only counted
+        """
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.max_spans = max_spans
+
+    def start_trace(self, name, attributes):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        return Trace(self, name, attributes)
+
+    def export(self, trace):
+        if not self.exporter is None:
+            self.exporter(trace)
+
+
+class InMemoryExporter():
+    def __init__(self, max_traces=100):
+        self.max_traces = max_traces
+        self.traces = []
+        self.lock = threading.Lock()
+
+    def __call__(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+            del self.traces[:-self.max_traces]
+
+
+class LoggingExporter():
+    def __init__(self, logger_name='dynamodb2.trace', level=logging.DEBUG):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def __call__(self, trace):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s', json.dumps(trace.render(), default=str))
+
+
+def traced(name, get_trace, get_attributes=None):
+    """
+
+    Decorator running method in a span when get_trace(self) returns a Trace, and calling it directly otherwise
+
+    @param name: Span name
+    @param get_trace: Callable(self) returning Trace or None
+    @param get_attributes: Callable(self, *args) returning span attributes dict, optional
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            trace = get_trace(self)
+            if trace is None:
+                return method(self, *args, **kwargs)
+            attributes = None
+            if not get_attributes is None:
+                attributes = get_attributes(self, *args)
+            span = trace.start_span(name, attributes)
+            try:
+                result = method(self, *args, **kwargs)
+            except Exception as e:
+                span.finish(e)
+                raise
+            span.finish()
+            return result
+        return wrapper
+    return decorator
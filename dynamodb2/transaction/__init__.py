@@ -1,14 +1,25 @@
 from datetime import datetime
+from itertools import islice
 import logging
-from time import sleep
+import threading
+from time import sleep, time
 import uuid
-import sys
+import weakref
 
 import simplejson as json
 from boto.exception import JSONResponseError
 
-from dynamodb2 import AWSDynamoDB2Connection
-from dynamodb2.transaction.item import TxItem
+from dynamodb2 import AWSDynamoDB2Connection, KeyAttributeError, metrics, tracing
+from dynamodb2.metrics import CATEGORY_DATA, CATEGORY_TX
+from dynamodb2.parallel import parallel_map, parallel_try_map
+from dynamodb2.pool import connection_pool
+from dynamodb2.transaction.image import make_image, project
+from dynamodb2.transaction.item import HIDDEN_DATA_FIELDS, LOCK_EXCLUSIVE, LOCK_SHARED, READ_COMMITTED, READ_LOCK, \
+    READ_UNCOMMITTED, VERSION_DATA_FIELD, WRITE_DELETE, NotExistingItem, TxItem, item_view, use_item_versions
+from dynamodb2.transaction.log import BATCH_WRITE_MAX_ITEMS, TxLogWriter, batch_write, undo_log_uuid
+from dynamodb2.transaction.rollback import holder_expected, plan_rollback, rollback_steps
+from dynamodb2.transaction.steps import Call, Once, Parallel, Result, Shared, all_steps, run
+from dynamodb2.transaction.wait import DEFAULT_WAIT_STRATEGY
 
 
 __author__ = 'drblez'
@@ -20,9 +31,41 @@ ISOLATION_LEVEL_FULL_LOCK = '000 full lock'
 ISOLATION_LEVEL_READ_COMMITTED = '100 read committed'
 ISOLATION_LEVEL_READ_UNCOMMITTED = '200 read uncommitted'
 
+# TxItem read modes of isolation levels, other levels read under S lock
+_READ_MODES = {
+    ISOLATION_LEVEL_READ_COMMITTED: READ_COMMITTED,
+    ISOLATION_LEVEL_READ_UNCOMMITTED: READ_UNCOMMITTED
+}
+
+# Concurrency control: items are locked by every access, or writes are buffered and validated at commit
+TX_MODE_LOCK = 'lock'
+TX_MODE_OPTIMISTIC = 'optimistic'
+
+# Every recs/logs append is written at once
+TX_RECORD_FLUSH_IMMEDIATE = 'immediate'
+# Appends are buffered and written before every data mutation and at commit/rollback
+TX_RECORD_FLUSH_EVERY_MUTATION = 'every mutation'
+# Appends are buffered and written before the first data mutation and at commit/rollback
+TX_RECORD_FLUSH_FIRST_MUTATION = 'first mutation'
+
+BATCH_GET_MAX_KEYS = 100
+# Items read from the iterable of Tx.bulk_put at once
+BULK_CHUNK_SIZE = 100
+# Max rec/log uuids appended to the tx record, which must stay under the item size limit; the undo records in
+# tx-data table and the 'tables' set are what rollback and recovery rely on, recs/logs are informational
+TX_RECORD_MAX_REFS = 1000
+
+# Tx.stat names of low level calls
+_STAT_NAMES = {
+    'get_item': 'GET',
+    'put_item': 'PUT',
+    'update_item': 'UPDATE',
+    'delete_item': 'DELETE',
+    'batch_write_item': 'BATCH_WRITE'
+}
+
 logger = logging.getLogger('item')
-logger.addHandler(logging.StreamHandler(stream=sys.stderr))
-logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.NullHandler())
 
 
 class BadTxTableAttributes(Exception):
@@ -33,17 +76,58 @@ class BadTxTableKeySchema(Exception):
     pass
 
 
+class TxTableNotActive(Exception):
+    pass
+
+
+class TxReadNotCompleted(Exception):
+    pass
+
+
+class TxConflict(Exception):
+    pass
+
+
+class TxWriteNotCompleted(Exception):
+    pass
+
+
+_bootstrapped_tables = set()
+# Tables of backends (see dynamodb2.backend) are remembered per backend, which the registry does not keep alive
+_bootstrapped_backend_tables = weakref.WeakKeyDictionary()
+_bootstrap_lock = threading.Lock()
+
+
+def __wait_for_table_active(connection, table_name, first_delay=0.5, max_delay=10, timeout=300):
+    deadline = time() + timeout
+    delay = first_delay
+    while True:
+        t = connection.describe_table(table_name)
+        if t['Table']['TableStatus'] == 'ACTIVE':
+            return
+        if time() + delay > deadline:
+            raise TxTableNotActive('Table {} is not ACTIVE after {} sec.'.format(table_name, timeout))
+        logger.debug('Wait %s sec. for table %s became ACTIVE', delay, table_name)
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def _sorted_definitions(definitions):
+    # Dicts are not ordered on Python 3, definitions are compared as sorted lists of their items
+    return sorted(sorted(d.items()) for d in definitions)
+
+
 def __check_or_create_table(attribute_definition, connection, key_schema, provisioned_throughput, table_name,
                             local_secondary_indexes=None):
     try:
         t = connection.describe_table(table_name)
         t = t['Table']
-        if sorted(t['AttributeDefinitions']) != sorted(attribute_definition):
+        if _sorted_definitions(t['AttributeDefinitions']) != _sorted_definitions(attribute_definition):
             raise BadTxTableAttributes('Table {} has attributes {}, need {}'.format(
                 table_name,
                 t['AttributeDefinitions'],
                 attribute_definition))
-        if sorted(t['KeySchema']) != sorted(key_schema):
+        if _sorted_definitions(t['KeySchema']) != _sorted_definitions(key_schema):
             raise BadTxTableKeySchema('Table {} has key schema {}, need {}'.format(
                 table_name,
                 t['KeySchema'],
@@ -52,12 +136,7 @@ def __check_or_create_table(attribute_definition, connection, key_schema, provis
         if e.error_code == 'ResourceNotFoundException':
             connection.create_table(attribute_definition, table_name, key_schema, provisioned_throughput,
                                     local_secondary_indexes=local_secondary_indexes)
-            while True:
-                logger.debug('Wait for table {} became ACTIVE'.format(table_name))
-                sleep(10)
-                t = connection.describe_table(table_name)
-                if t['Table']['TableStatus'] == 'ACTIVE':
-                    break
+            __wait_for_table_active(connection, table_name)
         else:
             raise e
 
@@ -102,27 +181,159 @@ def _check_or_create_tx_data_table(connection, table_name=TX_DATA_TABLE_NAME,
                             local_secondary_indexes=local_secondary_indexes)
 
 
-class Tx():
-    def __init__(self, tx_name, isolation_level, tx_table_name=TX_TABLE_NAME, tx_data_table_name=TX_DATA_TABLE_NAME,
-                 aws_credential=None):
+def _bootstrapped(backend):
+    if backend is None:
+        return _bootstrapped_tables
+    with _bootstrap_lock:
+        tables = _bootstrapped_backend_tables.get(backend)
+        if tables is None:
+            tables = set()
+            _bootstrapped_backend_tables[backend] = tables
+        return tables
+
+
+def ensure_tables(connection=None, tx_table_name=TX_TABLE_NAME, tx_data_table_name=TX_DATA_TABLE_NAME):
+    """
+
+    Check or create tx-info and tx-data tables once per process for every (region, table name), later calls for
+    the same tables return without any DynamoDB request. Deploy scripts may call it before the first transaction.
+
+    @param connection: AWSDynamoDB2Connection instance, default connection if None
+    @param tx_table_name: Transactions info table name
+    @param tx_data_table_name: Transactions data (log) table name
+    """
+    if connection is None:
+        connection = AWSDynamoDB2Connection()
+    for table_name, check_or_create in [(tx_table_name, _check_or_create_tx_table),
+                                        (tx_data_table_name, _check_or_create_tx_data_table)]:
+        bootstrapped = _bootstrapped(connection.backend)
+        bootstrap_key = (connection.region, table_name)
+        if bootstrap_key in bootstrapped:
+            continue
+        with _bootstrap_lock:
+            if bootstrap_key in bootstrapped:
+                continue
+            check_or_create(connection.connection, table_name)
+            bootstrapped.add(bootstrap_key)
+
+
+def stat_from_calls(calls):
+    """
+
+    @param calls: {(category, operation): count}
+    @return: Old Tx.stat dict: data requests as PUT/GET/UPDATE/DELETE, lock and bookkeeping requests as
+    PUT1/GET1/UPDATE1/DELETE1/BATCH_WRITE1
+    """
+    stat = {'PUT': 0, 'GET': 0, 'UPDATE': 0, 'DELETE': 0,
+            'PUT1': 0, 'GET1': 0, 'UPDATE1': 0, 'DELETE1': 0, 'BATCH_WRITE1': 0}
+    for (category, operation), count in calls.items():
+        name = _STAT_NAMES.get(operation, operation.upper())
+        if category != CATEGORY_DATA:
+            name += '1'
+        stat[name] = stat.get(name, 0) + count
+    return stat
+
+
+def reset_ensured_tables():
+    with _bootstrap_lock:
+        _bootstrapped_tables.clear()
+        _bootstrapped_backend_tables.clear()
+
+
+class TxBase():
+    def __init__(self, tx_name, isolation_level, tx_table_name, tx_data_table_name, tx_record_flush_policy,
+                 wait_strategy, priority, mode=TX_MODE_LOCK):
+        """
+
+        State and request steps (see steps module) of a transaction, shared by Tx and aio.AsyncTx. Subclasses set
+        self.connection and implement _call.
+
+        """
         self.tx_uuid = uuid.uuid1()
         self.tx_name = tx_name
         self.isolation_level = isolation_level
-        self.creation_date = datetime.now().isoformat()
-        if aws_credential is None:
-            self.connection = AWSDynamoDB2Connection()
+        self.mode = mode
+        self.optimistic = mode == TX_MODE_OPTIMISTIC
+        if self.optimistic:
+            self.read_mode = READ_COMMITTED
+            use_item_versions(True)
         else:
-            self.connection = AWSDynamoDB2Connection(
-                aws_credential.access_key,
-                aws_credential.secret_key,
-                aws_credential.region)
+            self.read_mode = _READ_MODES.get(isolation_level, READ_LOCK)
+        self.creation_date = datetime.now().isoformat()
+        self.start_time = time()
+        self.wait_strategy = wait_strategy
+        self.priority = priority
+        self.lock_waits = []
         self.tx_table_name = tx_table_name
         self.tx_data_table_name = tx_data_table_name
-        _check_or_create_tx_table(self.connection.connection, self.tx_table_name)
-        _check_or_create_tx_data_table(self.connection.connection, self.tx_data_table_name)
         self.tx_items = []
+        # Item images of locked items, see TxItem.get
+        self.item_images = {}
         self.key = dict(tx_uuid=dict(S=str(self.tx_uuid)))
         self.tx_log = []
+        # Undo records written by bulk_put are dropped from tx_log, rollback reads them back, see _undo_records_steps
+        self.tx_log_dropped = False
+        # log_uuids of items which have a before-image in the undo log
+        self.logged_items = set()
+        self.log_writer = TxLogWriter(self)
+        self.tx_record_flush_policy = tx_record_flush_policy
+        self.tx_record_lock = threading.Lock()
+        self.pending_recs = []
+        self.pending_logs = []
+        # recs/logs appended to the tx record, see TX_RECORD_MAX_REFS
+        self.tx_record_refs = 0
+        # Data tables in 'tables' set of the tx record and Once of the update adding each, see _before_lock_steps
+        self.locked_tables = set()
+        self.table_updates = {}
+        self.tables_lock = threading.Lock()
+        self.mutated = False
+        self.first_mutation = Once()
+        self.tx_record_written = False
+        # Lock mode tx record is created by the first lock, with the tables locked so far
+        self.tx_record_created = Once()
+        self.record_tables = set()
+        self.recorded_tables = set()
+        self.calls = {}
+        self.stat_lock = threading.Lock()
+        self.trace = None
+
+    def _start_trace(self):
+        self.trace = tracing.start_trace('tx', {'tx_uuid': str(self.tx_uuid), 'tx_name': self.tx_name,
+                                                'isolation_level': self.isolation_level, 'mode': self.mode})
+
+    def _finish_trace(self, status, error=None):
+        trace = self.trace
+        if not trace is None:
+            self.trace = None
+            trace.finish(error, {'status': status, 'round_trips': self.round_trips(),
+                                 'lock_waits': len(self.lock_waits)})
+
+    def age(self):
+        return time() - self.start_time
+
+    def round_trips(self):
+        with self.stat_lock:
+            return sum(self.calls.values())
+
+    @property
+    def stat(self):
+        """
+
+        Request counters in the old format, see stat_from_calls()
+
+        """
+        with self.stat_lock:
+            return stat_from_calls(self.calls)
+
+    def _put_tx_record_steps(self, status):
+        """
+
+        Create the tx record with pending recs/logs appends and the tables of items to be locked
+
+        """
+        with self.tx_record_lock:
+            recs, self.pending_recs = self.pending_recs, []
+            logs, self.pending_logs = self.pending_logs, []
         expected = {
             'tx_uuid': {'Exists': 'false'}
         }
@@ -131,14 +342,47 @@ class Tx():
             'tx_name': {'S': self.tx_name},
             'isolation_level': {'S': self.isolation_level},
             'creation_date': {'S': self.creation_date},
-            'status': {'S': 'START'}
+            'status': {'S': status}
         }
-        self.connection.connection.put_item(self.tx_table_name, tx_record, expected=expected)
-        self.stat = {'PUT': 0, 'GET': 0, 'UPDATE': 0, 'DELETE': 0,
-                     'PUT1': 1, 'GET1': 0, 'UPDATE1': 0, 'DELETE1': 0}
+        if len(recs) > 0:
+            tx_record['recs'] = {'SS': recs}
+        if len(logs) > 0:
+            tx_record['logs'] = {'SS': logs}
+        with self.tables_lock:
+            tables = self.locked_tables | self.record_tables
+        if len(tables) > 0:
+            tx_record['tables'] = {'SS': sorted(tables)}
+        yield Call(CATEGORY_TX, 'put_item', self.tx_table_name, tx_record, expected=expected)
+        self.recorded_tables = tables
+        self.tx_record_written = True
 
+    def _add_rec_uuid_steps(self, tx_item):
+        with self.tx_record_lock:
+            if self.tx_record_refs >= TX_RECORD_MAX_REFS:
+                return
+            self.tx_record_refs += 1
+            self.pending_recs.append(str(tx_item.rec_uuid))
+        if self.tx_record_flush_policy == TX_RECORD_FLUSH_IMMEDIATE and self.tx_record_written:
+            yield self._flush_tx_record_steps()
 
-    def __add_rec_uuid_to_tx(self, tx_item):
+    def _add_log_uuid_steps(self, log_uuid):
+        with self.tx_record_lock:
+            if self.tx_record_refs >= TX_RECORD_MAX_REFS:
+                return
+            self.tx_record_refs += 1
+            self.pending_logs.append(str(log_uuid))
+        if self.tx_record_flush_policy == TX_RECORD_FLUSH_IMMEDIATE:
+            yield self._flush_tx_record_steps()
+
+    def _flush_tx_record_steps(self, status='IN-FLIGHT'):
+        """
+
+        Write pending recs/logs appends and status with one update of the tx record
+
+        """
+        with self.tx_record_lock:
+            recs, self.pending_recs = self.pending_recs, []
+            logs, self.pending_logs = self.pending_logs, []
         expected = {
             'tx_uuid': {
                 'Exists': 'true',
@@ -146,59 +390,208 @@ class Tx():
             }
         }
         update_rec = {
-            'recs': {
-                'Action': 'ADD',
-                'Value': {'SS': [str(tx_item.rec_uuid)]}
-            },
             'status': {
                 'Action': 'PUT',
-                'Value': {'S': 'IN-FLIGHT'}
+                'Value': {'S': status}
             }
         }
-        self.connection.connection.update_item(self.tx_table_name, self.key, update_rec, expected=expected)
-        self.stat['UPDATE1'] += 1
-
-    def __add_log_uuid_to_tx(self, log_uuid):
-        expected = {
-            'tx_uuid': {
-                'Exists': 'true',
-                'Value': {'S': str(self.tx_uuid)}
+        if len(recs) > 0:
+            update_rec['recs'] = {
+                'Action': 'ADD',
+                'Value': {'SS': recs}
             }
-        }
-        update_rec = {
-            'logs': {
+        if len(logs) > 0:
+            update_rec['logs'] = {
                 'Action': 'ADD',
-                'Value': {'SS': [str(log_uuid)]}
-            },
-            'status': {
-                'Action': 'PUT',
-                'Value': {'S': 'IN-FLIGHT'}
+                'Value': {'SS': logs}
             }
-        }
-        self.connection.connection.update_item(self.tx_table_name, self.key, update_rec, expected=expected)
-        self.stat['UPDATE1'] += 1
+        yield Call(CATEGORY_TX, 'update_item', self.tx_table_name, self.key, update_rec, expected=expected)
 
-    def get_item(self, table_name, hash_key_value, range_key_value=None):
+    def _set_tx_status_steps(self, status):
+        if self.tx_record_written:
+            yield self._flush_tx_record_steps(status)
+
+    def _before_lock_steps(self, table_name):
         """
 
-        Put item information into inner transaction structures and return item descriptor
+        Run by TxItem before every lock request: the first lock of an item of table_name is preceded by the
+        update adding the table to 'tables' set of the tx record, so recovery finds every lock of the transaction,
+        also of one which never writes. The first lock of lock mode transaction creates the tx record (START) with
+        the table instead, a transaction which takes no lock writes no record. Concurrent locks of a new table wait
+        for one request.
 
-        @rtype : TxItem
-        @param table_name: DynamoDB table name
-        @param hash_key_value: Hash value
-        @param range_key_value: Range value (if present)
-        @return: TxItem instance
         """
-        tx_item = TxItem(table_name, hash_key_value, range_key_value, self)
-        self.__add_rec_uuid_to_tx(tx_item)
-        self.tx_items.append(tx_item)
-        return tx_item
+        if table_name in self.locked_tables:
+            return
+        with self.tables_lock:
+            once = self.table_updates.setdefault(table_name, Once())
+        yield Shared(once, self.__add_table_steps(table_name))
 
-    def _put_tx_log(self, tx_item, data, operation):
-        log_uuid = uuid.uuid1()
+    def __add_table_steps(self, table_name):
+        if not self.tx_record_written and not self.optimistic:
+            with self.tables_lock:
+                self.record_tables.add(table_name)
+            yield Shared(self.tx_record_created, self._put_tx_record_steps('START'))
+        if self.tx_record_written and not table_name in self.recorded_tables:
+            expected = {'tx_uuid': {'Exists': 'true', 'Value': {'S': str(self.tx_uuid)}}}
+            yield Call(CATEGORY_TX, 'update_item', self.tx_table_name, self.key,
+                       {'tables': {'Action': 'ADD', 'Value': {'SS': [table_name]}}}, expected=expected)
+        with self.tables_lock:
+            self.locked_tables.add(table_name)
+
+    def _before_write_steps(self):
+        """
+
+        Run by TxItem before every data write of a logged item: the queued undo records and the tx record appends
+        due by the flush policy are independent, both are made durable with concurrent requests
+
+        """
+        steps = []
+        if len(self.log_writer.pending) > 0:
+            steps.append(self._flush_tx_log_steps())
+        if self.tx_record_flush_policy != TX_RECORD_FLUSH_IMMEDIATE and (
+                not self.mutated or self.tx_record_flush_policy == TX_RECORD_FLUSH_EVERY_MUTATION):
+            steps.append(self._before_data_mutation_steps())
+        if len(steps) == 1:
+            yield steps[0]
+        elif len(steps) > 1:
+            yield all_steps(steps)
+
+    def _before_data_mutation_steps(self):
+        """
+
+        Run by TxItem before every data write: makes pending tx record appends durable according to the flush
+        policy, so recovery always finds the tx IN-FLIGHT with its records before any data is changed. Concurrent
+        first writes wait for one update.
+
+        """
+        if self.tx_record_flush_policy == TX_RECORD_FLUSH_IMMEDIATE:
+            return
+        if not self.mutated:
+            yield Shared(self.first_mutation, self._flush_tx_record_steps())
+            self.mutated = True
+        elif self.tx_record_flush_policy == TX_RECORD_FLUSH_EVERY_MUTATION and \
+                len(self.pending_recs) + len(self.pending_logs) > 0:
+            yield self._flush_tx_record_steps()
+
+    def _lock_all_steps(self, tx_items, lock_state, max_wait_time=1, missing=None):
+        """
+
+        See Tx.lock_all
+
+        """
+        yield self.__lock_all_steps(tx_items, lock_state, max_wait_time, missing)
+        if lock_state == LOCK_EXCLUSIVE:
+            yield self.__queue_before_images_steps(tx_items)
+        yield Result(True)
+
+    def __queue_before_images_steps(self, tx_items):
+        """
+
+        Queue undo records of X locked items with images known from their locks, so the first write of any of them
+        makes all of them durable with one request and later writes need none
+
+        """
+        for tx_item in tx_items:
+            if tx_item.lock_state == LOCK_EXCLUSIVE and not tx_item._image() is None and not self._is_logged(tx_item):
+                image = yield tx_item._undo_image_steps()
+                yield self._put_tx_log_steps(tx_item, {'Attributes': image}, 'PUT')
+
+    def __lock_all_steps(self, tx_items, lock_state, max_wait_time, missing):
+        pending = []
+        for tx_item in sorted(set(tx_items), key=lambda i: i.lock_order_key()):
+            if not tx_item.has_lock(lock_state):
+                pending.append(tx_item)
+        # Items S locked before the call: on error only the X lock of their upgrade is given up
+        upgrades = set(i for i in pending if i.lock_state == LOCK_SHARED)
+        acquired = []
+        results = yield Parallel([i._lock_steps(lock_state) for i in pending])
+        not_existing = []
+        busy = None
+        error = None
+        for n, (tx_item, (success, result)) in enumerate(zip(pending, results)):
+            if success and result:
+                acquired.append(tx_item)
+                continue
+            if not success and not missing is None and isinstance(result, NotExistingItem):
+                not_existing.append(tx_item)
+                continue
+            if busy is None:
+                busy = n
+            if not success and error is None:
+                error = result
+        if not error is None:
+            yield self._release_steps(acquired, upgrades)
+            raise error
+        if busy is None:
+            if not missing is None:
+                missing.extend(not_existing)
+            yield Result(True)
+        tail = pending[busy:]
+        # S locks in the tail are given up too, they were taken out of (table, key) order. The images read under
+        # them must be unchanged when the items are locked again.
+        given_up = dict((i, i._image()) for i in tail if i in upgrades)
+        upgrades.difference_update(given_up)
+        yield self._release_steps([i for i in tail if i in acquired or i in given_up])
+        acquired = [i for i in acquired if not i in tail]
+        if not missing is None:
+            missing.extend(i for i in not_existing if not i in tail)
+        for tx_item in tail:
+            try:
+                yield tx_item._wait_lock_steps(lock_state, max_wait_time=max_wait_time)
+            except NotExistingItem as e:
+                if missing is None:
+                    error = e
+                else:
+                    missing.append(tx_item)
+                    continue
+            except Exception as e:
+                error = e
+            if error is None:
+                acquired.append(tx_item)
+                if tx_item in given_up and tx_item._image() != given_up[tx_item]:
+                    error = TxConflict('Item with key {} in table "{}" was changed while its S lock was given up'.
+                                       format(tx_item.key, tx_item.table_name))
+            if not error is None:
+                # Python 2 generators lose the exception being handled at yield, it is raised after the release
+                yield self._release_steps(acquired, upgrades)
+                raise error
+        yield Result(True)
+
+    @staticmethod
+    def _release_steps(tx_items, upgrades=()):
+        """
+
+        Unlock items, items in upgrades are turned back to S lock instead
+
+        """
+        yield all_steps([i._downgrade_steps() if i in upgrades else i._unlock_steps() for i in tx_items])
+
+    def _is_logged(self, tx_item):
+        """
+
+        @return: True if the before-image of tx_item is in the undo log of this transaction
+        """
+        return str(undo_log_uuid(tx_item.table_name, tx_item.key)) in self.logged_items
+
+    def _put_tx_log_steps(self, tx_item, data, operation):
+        """
+
+        Queue undo record of tx_item, the log is flushed when 25 records are queued. Only the earliest before-image
+        restores an item, so writes of an item which already has one in the undo log of this transaction are not
+        logged. The record of an item has the same log_uuid (see log.undo_log_uuid), a record without before-image
+        is replaced by the later one.
+
+        @return: Steps with result log record or None if not logged
+        """
+        log_uuid = str(undo_log_uuid(tx_item.table_name, tx_item.key))
+        if log_uuid in self.logged_items:
+            yield Result(None)
+        if operation == 'DELETE' or (not data is None and 'Attributes' in data):
+            self.logged_items.add(log_uuid)
         log_record = {
             'tx_uuid': {'S': str(self.tx_uuid)},
-            'log_uuid': {'S': str(log_uuid)},
+            'log_uuid': {'S': log_uuid},
             'rec_uuid': {'S': str(tx_item.rec_uuid)},
             'creation_date': {'S': datetime.now().isoformat()},
             'table': {'S': tx_item.table_name},
@@ -207,60 +600,646 @@ class Tx():
         }
         if not data is None:
             log_record['data'] = {'S': json.dumps(data)}
-        expected = {
-            'tx_uuid': {'Exists': 'false'},
-            'log_uuid': {'Exists': 'false'}
-        }
-        logger.debug('Log record: {}'.format(log_record))
-        logger.debug('Expected: {}'.format(expected))
+        logger.debug('Log record: %s', log_record)
         self.tx_log.append(log_record)
-        result = self.connection.connection.put_item(
-            self.tx_data_table_name,
-            log_record,
-            expected=expected,
-            return_values='ALL_OLD')
-        self.stat['PUT1'] += 1
-        self.__add_log_uuid_to_tx(log_uuid)
+        full = self.log_writer.add(log_record)
+        yield self._add_log_uuid_steps(log_uuid)
+        if full:
+            yield self.log_writer.flush_steps()
+        yield Result(log_record)
+
+    def _flush_tx_log_steps(self):
+        yield self.log_writer.flush_steps()
+
+    def _retract_tx_log_steps(self, tx_item):
+        """
+
+        Delete undo records of tx_item, used when its lock by create failed and the item was created by others
+
+        """
+        log_uuid = str(undo_log_uuid(tx_item.table_name, tx_item.key))
+        for log_record in [r for r in self.tx_log if r['log_uuid']['S'] == log_uuid]:
+            yield Call(CATEGORY_TX, 'delete_item', self.tx_data_table_name,
+                       {'tx_uuid': log_record['tx_uuid'], 'log_uuid': log_record['log_uuid']})
+            self.tx_log.remove(log_record)
+        self.logged_items.discard(log_uuid)
+
+    def _before_image_steps(self, holder_tx_uuid, table_name, key):
+        """
+
+        Find the before-image of item in undo log of other transaction, used by READ_COMMITTED reads of items X
+        locked by that transaction. The undo record of the item is read by its key with one consistent GetItem.
+
+        @param holder_tx_uuid: Lock holder transaction uuid string
+        @return: Steps with result (found, item), item is None if it did not exist before the holder transaction;
+        not found if the holder has not written the item
+        """
+        result = yield Call(CATEGORY_TX, 'get_item', self.tx_data_table_name,
+                            {'tx_uuid': {'S': holder_tx_uuid}, 'log_uuid': {'S': str(undo_log_uuid(table_name, key))}},
+                            consistent_read=True)
+        log_record = result.get('Item')
+        if log_record is None:
+            yield Result((False, None))
+        if log_record['operation']['S'] == 'DELETE':
+            yield Result((True, None))
+        if 'data' in log_record:
+            data = json.loads(log_record['data']['S'])
+            if 'Attributes' in data:
+                yield Result((True, data['Attributes']))
+        yield Result((False, None))
+
+    def _undo_records_steps(self):
+        """
+
+        Read every undo record written by this transaction with consistent Query of tx-data table by tx_uuid
+
+        @return: Steps with result list of undo records
+        """
+        key_conditions = {'tx_uuid': {'AttributeValueList': [{'S': str(self.tx_uuid)}], 'ComparisonOperator': 'EQ'}}
+        records = []
+        exclusive_start_key = None
+        while True:
+            result = yield Call(CATEGORY_TX, 'query', self.tx_data_table_name, key_conditions, consistent_read=True,
+                                exclusive_start_key=exclusive_start_key)
+            records.extend(result.get('Items', []))
+            exclusive_start_key = result.get('LastEvaluatedKey')
+            if exclusive_start_key is None:
+                yield Result(records)
+
+    def _commit_steps(self):
+        """
+
+        Commit of lock mode transaction: items deleted by the transaction are deleted, locks of other items are
+        released, then the status is written. Undo records still queued belong to items not written, they are
+        dropped.
+
+        """
+        self.log_writer.discard()
+        yield all_steps([i._release_write_steps() for i in self.tx_items])
+        yield self._set_tx_status_steps('COMMIT')
+
+    def _rollback_steps(self):
+        """
+
+        Rollback of lock mode transaction: items are restored from the undo log, then locks are released. Undo
+        records still queued belong to items not written, they are dropped.
+
+        """
+        unwritten = set(id(r) for r in self.log_writer.discard())
+        if self.tx_log_dropped:
+            log_records = yield self._undo_records_steps()
+        else:
+            log_records = [r for r in self.tx_log if not id(r) in unwritten]
+        steps = plan_rollback(log_records)
+        logger.debug('Rollback of %s undo records restores %s items', len(log_records), len(steps))
+        yield rollback_steps(steps, holder_expected(str(self.tx_uuid)))
+        self.tx_log = []
+        yield self._set_tx_status_steps('ROLLBACK')
+        yield self._release_steps(self.tx_items)
+
+
+class Tx(TxBase):
+    def __init__(self, tx_name, isolation_level, tx_table_name=TX_TABLE_NAME, tx_data_table_name=TX_DATA_TABLE_NAME,
+                 aws_credential=None, connection=None, pool=connection_pool,
+                 tx_record_flush_policy=TX_RECORD_FLUSH_FIRST_MUTATION, wait_strategy=DEFAULT_WAIT_STRATEGY,
+                 priority=0, backend=None, mode=TX_MODE_LOCK):
+        """
+
+        @param connection: AWSDynamoDB2Connection instance owned by caller, pool is not used if present
+        @param pool: ConnectionPool to borrow connection from, None means new connection for every transaction
+        @param tx_record_flush_policy: When recs/logs appends are written into tx record, one of TX_RECORD_FLUSH_*
+        @param wait_strategy: WaitStrategy used by lock waits of this transaction
+        @param priority: Lock wait priority, used by AgeFairBackoff
+        @param backend: Low level DynamoDB backend (e.g. dynamodb2.backend.memory.MemoryBackend) used instead of AWS
+        @param mode: TX_MODE_LOCK or TX_MODE_OPTIMISTIC. Optimistic transaction takes no locks while it runs: reads
+        remember item versions, writes are buffered, commit writes them only if the items were not changed (raises
+        TxConflict otherwise). Tx record and undo log are written only by commits of many items. Lock mode writes
+        of other processes must keep item versions, see item.use_item_versions.
+        """
+        TxBase.__init__(self, tx_name, isolation_level, tx_table_name, tx_data_table_name, tx_record_flush_policy,
+                        wait_strategy, priority, mode)
+        self.pool = None
+        if not connection is None:
+            self.connection = connection
+        elif not backend is None:
+            self.connection = AWSDynamoDB2Connection(backend=backend)
+        elif aws_credential is None:
+            if pool is None:
+                self.connection = AWSDynamoDB2Connection()
+            else:
+                self.connection = pool.acquire()
+                self.pool = pool
+        else:
+            if pool is None:
+                self.connection = AWSDynamoDB2Connection(
+                    aws_credential.access_key,
+                    aws_credential.secret_key,
+                    aws_credential.region)
+            else:
+                self.connection = pool.acquire(
+                    aws_credential.access_key,
+                    aws_credential.secret_key,
+                    aws_credential.region)
+                self.pool = pool
+        ensure_tables(self.connection, self.tx_table_name, self.tx_data_table_name)
+        self._start_trace()
+
+    def _call(self, category, operation, *args, **kwargs):
+        """
+
+        Make one low level DynamoDB request. Every request of the transaction goes through here: it is counted in
+        self.calls, timed and reported if any metrics sink is registered, and traced if the transaction is sampled
+
+        @param category: metrics.CATEGORY_DATA, CATEGORY_LOCK or CATEGORY_TX
+        @param operation: Low level connection method name, e.g. 'update_item'
+        @return: Request result
+        """
+        calls_key = (category, operation)
+        with self.stat_lock:
+            self.calls[calls_key] = self.calls.get(calls_key, 0) + 1
+        func = getattr(self.connection.connection, operation)
+        trace = self.trace
+        if trace is None:
+            if not metrics.sinks:
+                return func(*args, **kwargs)
+            return metrics.timed_call(category, operation, func, args, kwargs)
+        span = trace.start_span(operation, {'category': category,
+                                            'table': lambda: metrics.table_label(operation, args)})
+        try:
+            if metrics.sinks:
+                result = metrics.timed_call(category, operation, func, args, kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except Exception as e:
+            span.finish(e)
+            raise
+        span.finish()
         return result
 
+    def __put_tx_record(self, status):
+        run(self._call, self._put_tx_record_steps(status))
+
+    def __add_rec_uuid_to_tx(self, tx_item):
+        run(self._call, self._add_rec_uuid_steps(tx_item))
+
+    def __flush_tx_record(self, status='IN-FLIGHT'):
+        run(self._call, self._flush_tx_record_steps(status))
+
     def __set_tx_status(self, status):
-        expected = {
-            'tx_uuid': {
-                'Exists': 'true',
-                'Value': {'S': str(self.tx_uuid)}
-            }
-        }
-        update_rec = {
-            'status': {
-                'Action': 'PUT',
-                'Value': {'S': status}
-            }
-        }
-        self.connection.connection.update_item(self.tx_table_name, self.key, update_rec, expected=expected)
-        self.stat['UPDATE1'] += 1
+        run(self._call, self._set_tx_status_steps(status))
+
+    def _before_lock(self, table_name):
+        """
+
+        See _before_lock_steps
+
+        """
+        run(self._call, self._before_lock_steps(table_name))
+
+    def get_item(self, table_name, hash_key_value, range_key_value=None):
+        """
+
+        Put item information into inner transaction structures and return item descriptor
+
+        @rtype : TxItem
+        @param table_name: DynamoDB table name
+        @param hash_key_value: Hash value
+        @param range_key_value: Range value (if present)
+        @return: TxItem instance
+        """
+        tx_item = TxItem(table_name, hash_key_value, range_key_value, self)
+        self.__add_rec_uuid_to_tx(tx_item)
+        self.tx_items.append(tx_item)
+        return tx_item
+
+    @tracing.traced('lock_all', lambda tx: tx.trace, lambda tx, tx_items, lock_state, *args: {
+        'items': len(tx_items), 'lock': lock_state})
+    def lock_all(self, tx_items, lock_state, max_wait_time=1, missing=None):
+        """
+
+        Lock many items at once. All locks are tried concurrently without waiting; if some of them are busy, locks
+        taken after the first busy item in (table, key) order are released and the rest are waited for one by one
+        in that order, so transactions using lock_all cannot deadlock each other. S->X upgrades of items already S
+        locked are ordered the same way: S locks after the first busy item are released too, and TxConflict is
+        raised if such item is changed before it is locked again. On error every lock taken by this call is
+        released (an upgrade falls back to its S lock unless the S lock was given up) and the exception is
+        re-raised. Before-images of X locked items are queued in the undo log, the first write of any of them makes
+        them durable with one request.
+
+        @param tx_items: List of TxItem instances of this transaction
+        @param lock_state: LOCK_SHARED or LOCK_EXCLUSIVE
+        @param max_wait_time: Max wait time (sec.) for every busy item
+        @param missing: List which items that do not exist are appended to, NotExistingItem is raised if None
+        @return: True
+        """
+        return run(self._call, self._lock_all_steps(tx_items, lock_state, max_wait_time, missing))
+
+    @tracing.traced('get_many', lambda tx: tx.trace, lambda tx, keys, *args: {'items': len(keys)})
+    def get_many(self, keys, attributes_to_get=None, max_wait_time=1, decoded=False):
+        """
+
+        Read many items under S locks. All locks are taken with lock_all; every lock update returns the whole
+        item, so most items come from the transaction item images, the rest is read with consistent BatchGetItem,
+        up to 100 keys per request. An item of this transaction with the same key is reused, not duplicated.
+        With READ_COMMITTED and READ_UNCOMMITTED isolation levels and in optimistic mode no S locks are taken,
+        items not locked by the transaction are read with BatchGetItem without lock (see TxItem._committed_item).
+
+        @param keys: List of (table name, hash key value) or (table name, hash key value, range key value)
+        @param attributes_to_get: Attributes to return, all if None
+        @param max_wait_time: Max wait time (sec.) for every busy item
+        @param decoded: Return item_view() of every result, None for items not found
+        @return: {TxItem: {'Item': {...}}}, {} for items not found (with every isolation level, missing items are
+        not locked)
+        """
+        known = dict((i.image_key, i) for i in self.tx_items)
+        tx_items = []
+        for key in keys:
+            tx_item = TxItem(key[0], key[1], key[2] if len(key) > 2 else None, self)
+            if tx_item.image_key in known:
+                tx_item = known[tx_item.image_key]
+            else:
+                self.__add_rec_uuid_to_tx(tx_item)
+                self.tx_items.append(tx_item)
+                known[tx_item.image_key] = tx_item
+            tx_items.append(tx_item)
+        absent = []
+        if self.read_mode == READ_LOCK:
+            self.lock_all(tx_items, LOCK_SHARED, max_wait_time, absent)
+        missing = [i for i in set(tx_items) if i._needs_read() and not i in absent]
+        unlocked = {}
+        for n in range(0, len(missing), BATCH_GET_MAX_KEYS):
+            chunk = missing[n:n + BATCH_GET_MAX_KEYS]
+            found = self.__batch_get(chunk)
+            for tx_item in chunk:
+                item = found.get(tx_item)
+                if self.optimistic:
+                    tx_item._observe(None if item is None else tx_item._committed_item(item))
+                elif item is None:
+                    continue
+                elif tx_item.lock_state is None:
+                    item = tx_item._committed_item(item)
+                    unlocked[tx_item] = None if item is None else make_image(item, HIDDEN_DATA_FIELDS)
+                else:
+                    tx_item._set_image(make_image(item, HIDDEN_DATA_FIELDS))
+        results = {}
+        for tx_item in tx_items:
+            if tx_item in unlocked:
+                image = unlocked[tx_item]
+            else:
+                image = tx_item._image()
+            if image is None:
+                results[tx_item] = {}
+            else:
+                results[tx_item] = {'Item': project(image, attributes_to_get)}
+            if decoded:
+                results[tx_item] = item_view(results[tx_item])
+        return results
+
+    def __batch_get(self, tx_items, max_retries=8, first_delay=0.05, max_delay=2):
+        """
+
+        Read up to 100 items with consistent BatchGetItem, retrying unprocessed keys
+
+        @return: {TxItem: item}, items not found are left out
+        """
+        found = {}
+        by_key = {}
+        request_items = {}
+        for tx_item in tx_items:
+            by_key[tx_item.image_key] = tx_item
+            request = request_items.setdefault(tx_item.table_name, {'Keys': [], 'ConsistentRead': True})
+            request['Keys'].append(tx_item.key)
+        delay = first_delay
+        retries = 0
+        while True:
+            result = self._call(CATEGORY_DATA, 'batch_get_item', request_items)
+            for table_name, items in result.get('Responses', {}).items():
+                key_names = self.connection.get_key_schema(table_name).key_names
+                for item in items:
+                    key = dict((k, item[k]) for k in key_names)
+                    tx_item = by_key.get((table_name, json.dumps(key, sort_keys=True)))
+                    if not tx_item is None:
+                        found[tx_item] = item
+            request_items = result.get('UnprocessedKeys') or {}
+            if len(request_items) == 0:
+                return found
+            retries += 1
+            if retries > max_retries:
+                raise TxReadNotCompleted('Unprocessed keys after {} retries: {}'.format(max_retries, request_items))
+            if metrics.sinks:
+                metrics.report_retry(CATEGORY_DATA, 'batch_get_item', ','.join(sorted(request_items.keys())),
+                                     'UnprocessedKeys')
+            sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    @tracing.traced('bulk_put', lambda tx: tx.trace, lambda tx, table_name, *args: {'table': table_name})
+    def bulk_put(self, table_name, items, chunk_size=BULK_CHUNK_SIZE, max_wait_time=1):
+        """
+
+        Put many items. The iterable is consumed lazily by chunks; existing items of every chunk are X locked with
+        lock_all, before-images and DELETE undo records of items found missing by BatchGetItem are written to the
+        undo log with BatchWriteItem, then the data is written with BatchWriteItem, 25 items per request, requests
+        of a chunk run concurrently. Missing items are written X locked with the chunk, except items which exist
+        when they are checked again after their undo records are durable (created by other transactions) or which
+        were deleted while the chunk was locked: they are locked by conditional create. An item created by other
+        transaction between that check and the write is overwritten. Unprocessed items are retried with
+        exponential backoff, and every chunk written with retries halves the next chunk (it grows back after
+        chunks written without them). Only the TxItem (the lock) of every item is kept: item images and undo
+        records written are dropped, rollback reads the undo records back from tx-data table. Locks of earlier
+        chunks are held while a chunk waits, so bulk_put calls of transactions writing the same keys in different
+        order time out (max_wait_time) rather than deadlock. In optimistic mode items are buffered by TxItem.put
+        until commit.
+
+        @param items: Iterable of items in wire format, key attributes included; of items with the same key the
+        last one is written
+        @param chunk_size: Max items per chunk
+        @param max_wait_time: Max wait time (sec.) for every busy item
+        @return: Number of items written
+        """
+        known = dict((i.image_key, i) for i in self.tx_items)
+        key_schema = self.connection.get_key_schema(table_name)
+        iterator = iter(items)
+        size = chunk_size
+        written = 0
+        while True:
+            chunk = self.__bulk_tx_items(table_name, key_schema, islice(iterator, size), known)
+            if len(chunk) == 0:
+                return written
+            if self.optimistic:
+                for tx_item, item in chunk:
+                    tx_item.put(item)
+                retries = 0
+            else:
+                retries = self.__bulk_put_chunk(table_name, chunk, max_wait_time)
+            written += len(chunk)
+            if retries > 0:
+                size = max(1, size // 2)
+            else:
+                size = min(chunk_size, size * 2)
+
+    def __bulk_tx_items(self, table_name, key_schema, items, known):
+        """
+
+        @return: [(TxItem, item)] in order of first occurrence, one per key
+        """
+        chunk = []
+        by_key = {}
+        for item in items:
+            key_values = []
+            for key_name in key_schema.key_names:
+                if not key_name in item:
+                    raise KeyAttributeError('Key attribute {} is not in item {}'.format(key_name, item))
+                key_values.append(list(item[key_name].values())[0])
+            tx_item = TxItem(table_name, key_values[0], key_values[1] if len(key_values) > 1 else None, self)
+            if tx_item.image_key in by_key:
+                chunk[by_key[tx_item.image_key]] = (chunk[by_key[tx_item.image_key]][0], item)
+                continue
+            if tx_item.image_key in known:
+                tx_item = known[tx_item.image_key]
+            else:
+                self.__add_rec_uuid_to_tx(tx_item)
+                self.tx_items.append(tx_item)
+                known[tx_item.image_key] = tx_item
+            by_key[tx_item.image_key] = len(chunk)
+            chunk.append((tx_item, item))
+        return chunk
+
+    def __log_before_images(self, tx_items):
+        """
+
+        Queue PUT undo records of X locked items from their images, items without image are read by BatchGetItem
+
+        """
+        tx_items = [i for i in tx_items if not self._is_logged(i)]
+        unread = [i for i in tx_items if i._image() is None]
+        for n in range(0, len(unread), BATCH_GET_MAX_KEYS):
+            chunk = unread[n:n + BATCH_GET_MAX_KEYS]
+            found = self.__batch_get(chunk)
+            for tx_item in chunk:
+                if tx_item in found:
+                    tx_item.version = found[tx_item].get(VERSION_DATA_FIELD, {}).get('S')
+                    tx_item._set_image(make_image(found[tx_item], HIDDEN_DATA_FIELDS))
+        for tx_item in tx_items:
+            if not tx_item._image() is None:
+                self._put_tx_log(tx_item, {'Attributes': tx_item._undo_image()}, 'PUT')
+
+    def _retract_tx_log(self, tx_item):
+        run(self._call, self._retract_tx_log_steps(tx_item))
 
-    def __unlock_all_items(self):
+    def __bulk_put_chunk(self, table_name, chunk, max_wait_time):
+        """
+
+        @return: Number of BatchWriteItem retries
+        """
+        # The table is in the tx record before any item is locked, also if every item is created
+        self._before_lock(table_name)
+        # Existence of items not locked yet is checked by BatchGetItem, missing ones are not tried by lock update
+        absent = []
+        unlocked = [tx_item for tx_item, _ in chunk if tx_item.lock_state is None]
+        for n in range(0, len(unlocked), BATCH_GET_MAX_KEYS):
+            found = self.__batch_get(unlocked[n:n + BATCH_GET_MAX_KEYS])
+            absent.extend(i for i in unlocked[n:n + BATCH_GET_MAX_KEYS] if not i in found)
+        missing = list(absent)
+        self.lock_all([tx_item for tx_item, _ in chunk if not tx_item in absent], LOCK_EXCLUSIVE, max_wait_time,
+                      missing)
+        self.__log_before_images([tx_item for tx_item, _ in chunk if not tx_item in missing])
+        for tx_item in missing:
+            self._put_tx_log(tx_item, None, 'DELETE')
+        self.flush_tx_log()
+        if self.tx_record_flush_policy != TX_RECORD_FLUSH_IMMEDIATE:
+            self.__flush_tx_record()
+            self.mutated = True
+        # Absent items are checked again now that their DELETE undo records are durable: items created by other
+        # transactions meanwhile (X locked by them until they end) and items deleted by others while this chunk was
+        # locked are locked by conditional create, the others are written with the chunk
+        appeared = set()
+        for n in range(0, len(absent), BATCH_GET_MAX_KEYS):
+            appeared.update(self.__batch_get(absent[n:n + BATCH_GET_MAX_KEYS]))
+        absent = set(i for i in absent if not i in appeared)
+        items = dict(chunk)
+        creates = [i for i in missing if not i in absent]
+        created = set(i for i, r in zip(creates, parallel_map(lambda i: i._create(items[i]), creates))
+                      if not r is None)
+        lost = [i for i in creates if not i in created]
+        if len(lost) > 0:
+            # Created by other transactions meanwhile: lock them as existing items and log their before-images
+            for tx_item in lost:
+                self._retract_tx_log(tx_item)
+            deleted = []
+            self.lock_all(lost, LOCK_EXCLUSIVE, max_wait_time, deleted)
+            if len(deleted) > 0:
+                raise TxWriteNotCompleted('Items created and deleted by other transactions meanwhile: {}'.format(
+                    ', '.join('{} {}'.format(i.table_name, json.dumps(i.key, sort_keys=True)) for i in deleted)))
+            self.__log_before_images(lost)
+            self.flush_tx_log()
+        requests = []
+        for tx_item, item in chunk:
+            if tx_item in created:
+                continue
+            item = tx_item._locked_item(item)
+            if tx_item in absent:
+                # Locked by the write, as by conditional create
+                tx_item.lock_state = LOCK_EXCLUSIVE
+                tx_item.version = item.get(VERSION_DATA_FIELD, {}).get('S')
+            requests.append(dict(PutRequest=dict(Item=item)))
+        results = parallel_try_map(
+            lambda r: batch_write(self._call, table_name, r, CATEGORY_DATA, error=TxWriteNotCompleted),
+            [requests[n:n + BATCH_WRITE_MAX_ITEMS] for n in range(0, len(requests), BATCH_WRITE_MAX_ITEMS)])
+        # Only the locks are kept: images are dropped and so are the undo records, which are durable, rollback
+        # reads them back
+        for tx_item, _ in chunk:
+            tx_item._set_image(None)
+        self.tx_log = []
+        self.tx_log_dropped = True
+        for success, result in results:
+            if not success:
+                raise result
+        return sum(result for _, result in results)
+
+    def _put_tx_log(self, tx_item, data, operation):
+        """
+
+        See _put_tx_log_steps
+
+        @return: Log record or None if not logged
+        """
+        return run(self._call, self._put_tx_log_steps(tx_item, data, operation))
+
+    def __release_connection(self):
+        if not self.pool is None:
+            self.pool.release(self.connection)
+            self.pool = None
+
+    def flush_tx_log(self):
+        self.log_writer.flush()
+
+    def __observe(self, tx_items):
+        """
+
+        Read committed state of items of optimistic transaction by BatchGetItem
+
+        """
+        for n in range(0, len(tx_items), BATCH_GET_MAX_KEYS):
+            chunk = tx_items[n:n + BATCH_GET_MAX_KEYS]
+            found = self.__batch_get(chunk)
+            for tx_item in chunk:
+                item = found.get(tx_item)
+                tx_item._observe(None if item is None else tx_item._committed_item(item))
+
+    def __changed(self, tx_items):
+        """
+
+        @return: Items of optimistic transaction changed since they were read, checked by BatchGetItem
+        """
+        changed = []
+        for n in range(0, len(tx_items), BATCH_GET_MAX_KEYS):
+            chunk = tx_items[n:n + BATCH_GET_MAX_KEYS]
+            found = self.__batch_get(chunk)
+            changed.extend(i for i in chunk if not i._is_unchanged(found.get(i)))
+        return changed
+
+    @staticmethod
+    def __conflict(tx_items):
+        return TxConflict('Items changed or locked by other transactions: {}'.format(
+            ', '.join('{} {}'.format(i.table_name, json.dumps(i.key, sort_keys=True)) for i in tx_items)))
+
+    def __optimistic_commit(self):
+        """
+
+        Validate and write buffered writes of optimistic transaction, raise TxConflict if an item read or written
+        was changed or is locked by other transaction.
+
+        One written item and no other item read: the write is validated by its own condition, one request (the
+        item is read first if it was updated without being read).
+        Otherwise items written without being read are read by BatchGetItem, the tx record and the before-images
+        of written items are written, then every item is validated and written with X lock by one conditional
+        request, other items read are validated by BatchGetItem, and X locks are released after COMMIT status, so
+        the commit of many items is atomic the same way as in lock mode. On conflict written items are restored.
+        A transaction without writes validates its reads only if it read more than one item.
+
+        """
+        written = []
+        read = []
         for tx_item in self.tx_items:
-            tx_item.unlock()
+            if tx_item.write is None or (tx_item.write == WRITE_DELETE and tx_item.observed and tx_item.not_exist):
+                if tx_item.observed:
+                    read.append(tx_item)
+            else:
+                written.append(tx_item)
+        if len(written) == 0:
+            if len(read) > 1:
+                changed = self.__changed(read)
+                if len(changed) > 0:
+                    raise self.__conflict(changed)
+            return
+        if len(written) == 1 and len(read) == 0:
+            # Updates of an item not read are applied to its committed image
+            self.__observe([i for i in written if i._needs_read()])
+            if not written[0]._commit_write(False):
+                raise self.__conflict(written)
+            return
+        try:
+            self.__observe([i for i in written if not i.observed])
+            for tx_item in written:
+                self._before_lock(tx_item.table_name)
+            self.__put_tx_record('IN-FLIGHT')
+            self.mutated = True
+            for tx_item in written:
+                if tx_item.before_image is None:
+                    self._put_tx_log(tx_item, None, 'DELETE')
+                else:
+                    self._put_tx_log(tx_item, {'Attributes': tx_item.before_image}, 'PUT')
+            self.flush_tx_log()
+            results = parallel_try_map(lambda i: i._commit_write(True), written)
+            for success, result in results:
+                if not success:
+                    raise result
+            changed = [i for i, (_, result) in zip(written, results) if not result]
+            if len(changed) == 0:
+                changed = self.__changed(read)
+            if len(changed) > 0:
+                raise self.__conflict(changed)
+        except Exception:
+            parallel_map(lambda i: i._undo_write(), written)
+            self.__set_tx_status('ROLLBACK')
+            raise
+        self.__set_tx_status('COMMIT')
+        parallel_map(lambda i: i._release_write(), written)
 
     def commit(self):
-        self.__unlock_all_items()
-        self.__set_tx_status('COMMIT')
+        try:
+            self.__commit()
+        except Exception as e:
+            self._finish_trace('COMMIT', e)
+            raise
+        self._finish_trace('COMMIT')
+
+    @tracing.traced('commit', lambda tx: tx.trace)
+    def __commit(self):
+        if self.optimistic:
+            try:
+                self.__optimistic_commit()
+            finally:
+                self.__release_connection()
+        else:
+            run(self._call, self._commit_steps())
+            self.__release_connection()
 
     def rollback(self):
-        while len(self.tx_log) > 0:
-            log_record = self.tx_log.pop()
-            table_name = log_record['table']['S']
-            operation = log_record['operation']['S']
-            if operation == 'PUT':
-                data = json.loads(log_record['data']['S'])['Attributes']
-                logger.debug('PUT Table: {}, data: {}'.format(table_name, data))
-                self.connection.connection.put_item(table_name, data)
-                self.stat['PUT1'] += 1
-            elif operation == 'DELETE':
-                key = json.loads(log_record['key']['S'])
-                logger.debug('DELETE Table: {}, key: {}'.format(table_name, key))
-                self.connection.connection.delete_item(table_name, key)
-                self.stat['DELETE1'] += 1
-        self.__set_tx_status('ROLLBACK')
-        self.__unlock_all_items()
+        try:
+            self.__rollback()
+        except Exception as e:
+            self._finish_trace('ROLLBACK', e)
+            raise
+        self._finish_trace('ROLLBACK')
+
+    @tracing.traced('rollback', lambda tx: tx.trace)
+    def __rollback(self):
+        if self.optimistic:
+            # Nothing is written before commit, and a failed commit has restored its writes
+            for tx_item in self.tx_items:
+                tx_item._discard()
+            self.__release_connection()
+            return
+        run(self._call, self._rollback_steps())
+        self.__release_connection()
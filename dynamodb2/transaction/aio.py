@@ -0,0 +1,325 @@
+import asyncio
+import functools
+from time import time
+
+from dynamodb2 import AWSDynamoDB2Connection, gen_key, metrics
+from dynamodb2.transaction import TX_DATA_TABLE_NAME, TX_MODE_LOCK, TX_RECORD_FLUSH_FIRST_MUTATION, TX_TABLE_NAME, \
+    TxBase, ensure_tables
+from dynamodb2.transaction.item import TxItemBase, item_view, parse_locks
+from dynamodb2.transaction.steps import Call, Parallel, Result, Shared, Sleep
+from dynamodb2.transaction.wait import DEFAULT_WAIT_STRATEGY
+
+__author__ = 'drblez'
+
+"""
+
+    asyncio variant of Tx/TxItem (Python 3.7+).
+
+    AsyncTx and AsyncTxItem run the request steps of Tx and TxItem (see steps module) with the asyncio driver run(),
+    so both kinds of transactions follow the same lock protocol, isolation levels, tx record and undo log formats and
+    may work on the same tables. Requests go to AsyncDynamoDB2Connection.connection, an object whose methods
+    (get_item, put_item, update_item, delete_item, batch_write_item) are coroutines: either a native non-blocking
+    client, or ExecutorClient which runs a blocking boto (or any other backend) connection on an executor. Lock
+    waits are asyncio sleeps, independent item operations may run together with asyncio.gather. Only lock mode
+    transactions are supported, optimistic mode (TX_MODE_OPTIMISTIC) is rejected.
+
+        tx = await AsyncTx.start('Add into shopping cart', ISOLATION_LEVEL_READ_COMMITTED)
+        user, cart = await asyncio.gather(tx.get_item('user', user_name), tx.get_item('cart', user_name))
+        await asyncio.gather(
+            user.update({'items_counter': {'Action': 'ADD', 'Value': {'N': '1'}}}),
+            cart.put({'item': {'S': item_name}}))
+        await tx.commit()
+
+"""
+
+
+class TxModeNotSupported(Exception):
+    pass
+
+
+class ExecutorClient():
+    def __init__(self, client, executor=None):
+        """
+
+        @param client: Blocking low level connection (boto DynamoDBConnection or backend)
+        @param executor: concurrent.futures executor, event loop default executor if None
+        """
+        self.client = client
+        self.executor = executor
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(method, *args, **kwargs))
+
+        return call
+
+
+class AsyncDynamoDB2Connection():
+    def __init__(self, connection=None, client=None, executor=None):
+        """
+
+        @param connection: AWSDynamoDB2Connection used for table schemas and, if client is None, for requests
+        @param client: Non-blocking client with coroutine methods, used instead of connection.connection
+        @param executor: concurrent.futures executor for blocking calls, event loop default executor if None
+        """
+        if connection is None:
+            connection = AWSDynamoDB2Connection()
+        self.sync = connection
+        self.region = connection.region
+        self.executor = executor
+        if client is None:
+            client = ExecutorClient(connection.connection, executor)
+        self.connection = client
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def get_key_schema(self, table_name):
+        key_schema = self.sync.cached_key_schema(table_name)
+        if key_schema is None:
+            key_schema = await self.run(self.sync.get_key_schema, table_name)
+        return key_schema
+
+    async def gen_key_attribute(self, table_name, hash_key_value, range_key_value=None):
+        return gen_key(await self.get_key_schema(table_name), hash_key_value, range_key_value)
+
+
+async def timed_call(category, operation, func, args, kwargs):
+    if not metrics.return_consumed_capacity is None and operation in metrics.CAPACITY_OPERATIONS and \
+            kwargs.get('return_consumed_capacity') is None:
+        kwargs['return_consumed_capacity'] = metrics.return_consumed_capacity
+    table_name = metrics.table_label(operation, args)
+    started = time()
+    try:
+        result = await func(*args, **kwargs)
+    except Exception as e:
+        outcome = getattr(e, 'error_code', None) or e.__class__.__name__
+        metrics.report_call(category, operation, table_name, time() - started, outcome, None)
+        raise
+    metrics.report_call(category, operation, table_name, time() - started, metrics.OUTCOME_OK,
+                        metrics.capacity_units(result))
+    return result
+
+
+async def run(call, steps):
+    """
+
+    asyncio driver of steps, see steps module. Parallel steps run together with asyncio.gather.
+
+    @param call: Request coroutine function with AsyncTx._call signature
+    @param steps: Step generator
+    @return: Value of its Result, None if it ends without one
+    """
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                request = steps.send(value)
+            else:
+                request = steps.throw(error)
+        except StopIteration:
+            return None
+        if isinstance(request, Result):
+            steps.close()
+            return request.value
+        value = None
+        error = None
+        try:
+            if isinstance(request, Call):
+                value = await call(request.category, request.operation, *request.args, **request.kwargs)
+            elif isinstance(request, Sleep):
+                await asyncio.sleep(request.delay)
+            elif isinstance(request, Parallel):
+                results = await asyncio.gather(*[run(call, s) for s in request.steps], return_exceptions=True)
+                value = [(not isinstance(r, BaseException), r) for r in results]
+            elif isinstance(request, Shared):
+                await _run_shared(call, request)
+            else:
+                value = await run(call, request)
+        except Exception as e:
+            error = e
+
+
+async def _run_shared(call, request):
+    once = request.once
+    if once.done:
+        return
+    if once.future is None:
+        once.future = asyncio.ensure_future(run(call, request.steps))
+    future = once.future
+    try:
+        await asyncio.shield(future)
+    except Exception:
+        if once.future is future:
+            once.future = None
+        raise
+    once.done = True
+
+
+class AsyncTxItem(TxItemBase):
+    def __init__(self, table_name, hash_key_value, range_key_value, key, tx):
+        TxItemBase.__init__(self, table_name, hash_key_value, range_key_value, tx, key)
+
+    async def _get_locks(self):
+        return parse_locks(await run(self.tx._call, self._read_lock_tokens_steps()), self.tx_uuid_str)
+
+    async def lock(self, requested_lock_state):
+        """
+
+        See TxItem.lock
+
+        """
+        return await run(self.tx._call, self._lock_steps(requested_lock_state))
+
+    async def wait_lock(self, requested_lock_state, wait_time=None, max_wait_time=1, generate_exception=True,
+                        wait_strategy=None):
+        """
+
+        See TxItem.wait_lock, waits are asyncio sleeps
+
+        """
+        return await run(self.tx._call, self._wait_lock_steps(requested_lock_state, wait_time, max_wait_time,
+                                                              generate_exception, wait_strategy))
+
+    async def unlock(self):
+        await run(self.tx._call, self._unlock_steps())
+
+    async def get(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None, decoded=False):
+        """
+
+        See TxItem.get
+
+        """
+        result = await run(self.tx._call, self._get_steps(attributes_to_get, consistent_read,
+                                                          return_consumed_capacity))
+        if decoded:
+            return item_view(result)
+        return result
+
+    async def put(self, item, expected=None, return_consumed_capacity=None, return_item_collection_metrics=None):
+        """
+
+        See TxItem.put
+
+        """
+        return await run(self.tx._call, self._put_steps(item, expected, return_consumed_capacity,
+                                                        return_item_collection_metrics))
+
+    async def update(self, update_data, expected=None, return_consumed_capacity=None,
+                     return_item_collection_metrics=None):
+        """
+
+        See TxItem.update
+
+        """
+        return await run(self.tx._call, self._update_steps(update_data, expected, return_consumed_capacity,
+                                                           return_item_collection_metrics))
+
+    async def delete(self, expected=None, return_consumed_capacity=None, return_item_collection_metrics=None):
+        """
+
+        See TxItem.delete
+
+        """
+        return await run(self.tx._call, self._delete_steps())
+
+
+class AsyncTx(TxBase):
+    def __init__(self, tx_name, isolation_level, tx_table_name=TX_TABLE_NAME, tx_data_table_name=TX_DATA_TABLE_NAME,
+                 connection=None, tx_record_flush_policy=TX_RECORD_FLUSH_FIRST_MUTATION,
+                 wait_strategy=DEFAULT_WAIT_STRATEGY, priority=0, mode=TX_MODE_LOCK):
+        """
+
+        Use AsyncTx.start(...) to create and begin transaction
+
+        @param connection: AsyncDynamoDB2Connection instance, new one over default AWSDynamoDB2Connection if None
+        @param mode: TX_MODE_LOCK only, TxModeNotSupported is raised for other modes
+        """
+        if mode != TX_MODE_LOCK:
+            raise TxModeNotSupported('AsyncTx supports lock mode only, mode {} requested'.format(mode))
+        TxBase.__init__(self, tx_name, isolation_level, tx_table_name, tx_data_table_name, tx_record_flush_policy,
+                        wait_strategy, priority)
+        if connection is None:
+            connection = AsyncDynamoDB2Connection()
+        self.connection = connection
+        # Coroutines share one thread, so spans are not nested: every request span is a child of the tx span
+        self._start_trace()
+
+    @classmethod
+    async def start(cls, *args, **kwargs):
+        """
+
+        @rtype : AsyncTx
+        """
+        tx = cls(*args, **kwargs)
+        await tx.begin()
+        return tx
+
+    async def begin(self):
+        await self.connection.run(ensure_tables, self.connection.sync, self.tx_table_name, self.tx_data_table_name)
+
+    async def _call(self, category, operation, *args, **kwargs):
+        calls_key = (category, operation)
+        with self.stat_lock:
+            self.calls[calls_key] = self.calls.get(calls_key, 0) + 1
+        func = getattr(self.connection.connection, operation)
+        trace = self.trace
+        if trace is None:
+            if not metrics.sinks:
+                return await func(*args, **kwargs)
+            return await timed_call(category, operation, func, args, kwargs)
+        span = trace.start_span(operation, {'category': category,
+                                            'table': lambda: metrics.table_label(operation, args)}, push=False)
+        try:
+            if metrics.sinks:
+                result = await timed_call(category, operation, func, args, kwargs)
+            else:
+                result = await func(*args, **kwargs)
+        except Exception as e:
+            span.finish(e)
+            raise
+        span.finish()
+        return result
+
+    async def get_item(self, table_name, hash_key_value, range_key_value=None):
+        """
+
+        @rtype : AsyncTxItem
+        """
+        key = await self.connection.gen_key_attribute(table_name, hash_key_value, range_key_value)
+        tx_item = AsyncTxItem(table_name, hash_key_value, range_key_value, key, self)
+        await run(self._call, self._add_rec_uuid_steps(tx_item))
+        self.tx_items.append(tx_item)
+        return tx_item
+
+    async def lock_all(self, tx_items, lock_state, max_wait_time=1, missing=None):
+        """
+
+        See Tx.lock_all, locks are tried together with asyncio.gather
+
+        """
+        return await run(self._call, self._lock_all_steps(tx_items, lock_state, max_wait_time, missing))
+
+    async def flush_tx_log(self):
+        await run(self._call, self._flush_tx_log_steps())
+
+    async def commit(self):
+        try:
+            await run(self._call, self._commit_steps())
+        except Exception as e:
+            self._finish_trace('COMMIT', e)
+            raise
+        self._finish_trace('COMMIT')
+
+    async def rollback(self):
+        try:
+            await run(self._call, self._rollback_steps())
+        except Exception as e:
+            self._finish_trace('ROLLBACK', e)
+            raise
+        self._finish_trace('ROLLBACK')
@@ -0,0 +1,101 @@
+import decimal
+
+from dynamodb2.codec import copy_value, format_number
+
+__author__ = 'drblez'
+
+"""
+
+    Transaction-local item images.
+
+    While a transaction holds a lock on an item nobody else can change it, so the last image the transaction has
+    seen (returned by the lock update, a read, or computed from its own put/update) is the current one and reads
+    can be served from memory. Images are kept in wire format without lock attributes.
+
+"""
+
+_SET_TYPES = ('SS', 'NS', 'BS')
+
+
+def make_image(item, hidden_fields):
+    """
+
+    @param item: Item in wire format
+    @param hidden_fields: Attribute names left out of the image (lock attributes)
+    @return: Copy of item without hidden_fields
+    """
+    return dict((k, copy_value(v)) for k, v in item.items() if not k in hidden_fields)
+
+
+def project(image, attributes_to_get=None):
+    """
+
+    @return: Copy of image, only attributes_to_get if given
+    """
+    if attributes_to_get is None:
+        return dict((k, copy_value(v)) for k, v in image.items())
+    return dict((k, copy_value(image[k])) for k in attributes_to_get if k in image)
+
+
+def _set_members(t, values):
+    if t == 'NS':
+        return [decimal.Decimal(str(i)) for i in values]
+    return list(values)
+
+
+def apply_updates(image, attribute_updates):
+    """
+
+    Apply AttributeUpdates to a copy of image the way DynamoDB does
+
+    @return: New image, or None if the result cannot be computed locally (unknown action or type mismatch)
+    """
+    image = project(image)
+    for name, update in attribute_updates.items():
+        action = update.get('Action', 'PUT')
+        value = update.get('Value')
+        current = image.get(name)
+        if action == 'PUT':
+            image[name] = copy_value(value)
+        elif action == 'DELETE':
+            if value is None:
+                image.pop(name, None)
+                continue
+            t = list(value.keys())[0]
+            if not t in _SET_TYPES or (not current is None and not t in current):
+                return None
+            if current is None:
+                continue
+            removed = _set_members(t, value[t])
+            left = [i for i, n in zip(current[t], _set_members(t, current[t])) if not n in removed]
+            if len(left) == 0:
+                del image[name]
+            else:
+                image[name] = {t: left}
+        elif action == 'ADD':
+            t = list(value.keys())[0]
+            if not current is None and not t in current:
+                return None
+            if t == 'N':
+                if current is None:
+                    image[name] = copy_value(value)
+                else:
+                    total = decimal.Decimal(current['N']) + decimal.Decimal(str(value['N']))
+                    image[name] = {'N': format_number(total)}
+            elif t in _SET_TYPES:
+                added = copy_value(value)[t]
+                if current is None:
+                    image[name] = {t: added}
+                else:
+                    merged = list(current[t])
+                    present = _set_members(t, merged)
+                    for i, n in zip(added, _set_members(t, added)):
+                        if not n in present:
+                            merged.append(i)
+                            present.append(n)
+                    image[name] = {t: merged}
+            else:
+                return None
+        else:
+            return None
+    return image
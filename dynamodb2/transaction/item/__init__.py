@@ -1,9 +1,16 @@
 # coding=utf-8
 import logging
-from time import sleep
+from time import time
 import uuid
 from boto.dynamodb2.exceptions import ConditionalCheckFailedException
 import simplejson as json
+from dynamodb2 import metrics
+from dynamodb2.codec import ItemView
+from dynamodb2.metrics import CATEGORY_DATA, CATEGORY_LOCK
+from dynamodb2.tracing import traced
+from dynamodb2.transaction.image import apply_updates, make_image, project
+from dynamodb2.transaction.steps import Call, Result, Sleep, run
+from dynamodb2.transaction.wait import FixedWait, LockWait, notify_lock_wait
 
 __author__ = 'drblez'
 
@@ -26,13 +33,21 @@ __author__ = 'drblez'
     ------------------+----------------+---------------
 
 
-    Операции накладывают блокировки в аттрибуте tx_manager_data типа SS
+    Операции накладывают блокировки в аттрибуте tx_manager_locks типа SS,
+    lock mode followed by tx_uuid hex
 
     [
-        '{ "tx_uuid": <tx_uuid>, "lock": "S"|"X" }',
+        'S<tx_uuid hex>' | 'X<tx_uuid hex>',
         ...
     ]
 
+    JSON tokens written by older versions, '{ "tx_uuid": <tx_uuid>, "lock": "S"|"X" }', are still parsed, and
+    unlock removes own tokens of both formats.
+
+    Every write puts a new uuid string into tx_manager_version attribute in the same request. Optimistic
+    transactions remember the version of every item they read and commit their buffered writes only if the
+    versions are unchanged and the items are not locked.
+
 """
 
 LOCK_EXCLUSIVE = 'X'
@@ -40,9 +55,21 @@ LOCK_SHARED = 'S'
 
 LOCKS_DATA_FIELD = 'tx_manager_locks'
 X_LOCK_DATA_FIELD = 'tx_manager_x_lock'
+LOCK_DATA_FIELDS = (LOCKS_DATA_FIELD, X_LOCK_DATA_FIELD)
+VERSION_DATA_FIELD = 'tx_manager_version'
+# Attributes of transaction manager, not returned by reads
+HIDDEN_DATA_FIELDS = LOCK_DATA_FIELDS + (VERSION_DATA_FIELD,)
+
+# How TxItem.get reads an item not locked by the transaction, chosen by Tx from its isolation level
+READ_LOCK = 'lock'
+READ_COMMITTED = 'committed'
+READ_UNCOMMITTED = 'uncommitted'
+
+# Write buffered by optimistic transaction until commit
+WRITE_PUT = 'PUT'
+WRITE_DELETE = 'DELETE'
 
 logger = logging.getLogger('item')
-logger.setLevel(logging.DEBUG)
 
 
 class BadLockType(Exception):
@@ -57,239 +84,932 @@ class NotExistingItem(Exception):
     pass
 
 
-class TxItem():
-    def __init__(self, table_name, hash_key_value, range_key_value=None, tx=None):
+class UpdateNotApplicable(Exception):
+    pass
+
+
+# Write JSON lock tokens, for rolling upgrade while older versions still read the locks
+_legacy_lock_tokens = False
+
+
+def use_legacy_lock_tokens(enabled):
+    global _legacy_lock_tokens
+    _legacy_lock_tokens = enabled
+
+
+def legacy_lock_token(tx_uuid_str, lock_state):
+    return json.dumps(dict(tx_uuid=tx_uuid_str, lock=lock_state))
+
+
+def lock_token(tx_uuid_str, lock_state):
+    """
+
+    @return: Lock mode followed by 32 hex digits of tx uuid, e.g. 'X6f1c...'
+    """
+    if _legacy_lock_tokens:
+        return legacy_lock_token(tx_uuid_str, lock_state)
+    return lock_state + tx_uuid_str.replace('-', '')
+
+
+def own_lock_tokens(tx_uuid_str, lock_state):
+    """
+
+    @return: Every token of both formats tx may hold for lock_state
+    """
+    return [lock_state + tx_uuid_str.replace('-', ''), legacy_lock_token(tx_uuid_str, lock_state)]
+
+
+def parse_lock_token(token):
+    """
+
+    @return: (tx_uuid_str, lock_state)
+    """
+    if token[0] == '{':
+        item = json.loads(token)
+        return item['tx_uuid'], item['lock']
+    h = token[1:]
+    return '-'.join((h[:8], h[8:12], h[12:16], h[16:20], h[20:])), token[0]
+
+
+def parse_locks(tokens, tx_uuid_str):
+    """
+
+    @return: Locks of other transactions, list of {'tx_uuid': ..., 'lock': 'S'|'X'}
+    """
+    own_hex = tx_uuid_str.replace('-', '')
+    locks = []
+    for token in tokens:
+        if token[0] == '{':
+            tx_uuid, lock_state = parse_lock_token(token)
+            if tx_uuid != tx_uuid_str:
+                locks.append(dict(tx_uuid=tx_uuid, lock=lock_state))
+        elif token[1:] != own_hex:
+            tx_uuid, lock_state = parse_lock_token(token)
+            locks.append(dict(tx_uuid=tx_uuid, lock=lock_state))
+    return locks
+
+
+# Write VERSION_DATA_FIELD with lock mode writes, see use_item_versions
+_item_versions = False
+
+
+def use_item_versions(enabled):
+    """
+
+    Lock mode writes keep VERSION_DATA_FIELD of items up to date only when enabled. Optimistic transactions detect
+    changes of the items they read by this version, so it must be enabled in every process writing items which
+    optimistic transactions may read; a Tx in optimistic mode enables it in its own process. The cost is one more
+    attribute of about 50 bytes in every item written, which may take the write over the next 1 KB write unit.
+
+    """
+    global _item_versions
+    _item_versions = enabled
+
+
+def new_version():
+    return str(uuid.uuid4())
+
+
+def item_view(result, datetimes=False):
+    """
+
+    @param result: Result of TxItem.get ('Item') or put/update ('Attributes', old item)
+    @param datetimes: See codec.decode_item()
+    @return: Lazily decoded codec.ItemView of the item without attributes of transaction manager, None if no item
+    """
+    item = result.get('Item', result.get('Attributes'))
+    if item is None:
+        return None
+    return ItemView(item, datetimes, HIDDEN_DATA_FIELDS)
+
+
+def is_lock_conflict(locks, requested_lock_state):
+    for lock in locks:
+        if requested_lock_state == LOCK_EXCLUSIVE or lock['lock'] == LOCK_EXCLUSIVE:
+            return True
+    return False
+
+
+def lock_request(key, tx_uuid_str, requested_lock_state, lock_state=None, tokens=None):
+    """
+
+    Build conditional update taking requested lock in one request. The item must exist and must not be X locked,
+    for X lock the lock set must be empty, or contain only own S token (lock_state is S), or be equal to tokens
+    observed by previous read.
+
+    @return: (attribute_updates, expected)
+    """
+    expected = {X_LOCK_DATA_FIELD: dict(Exists='false')}
+    if requested_lock_state == LOCK_EXCLUSIVE:
+        if tokens is None and lock_state == LOCK_SHARED:
+            tokens = [lock_token(tx_uuid_str, LOCK_SHARED)]
+        if tokens:
+            expected[LOCKS_DATA_FIELD] = dict(Value=dict(SS=tokens), Exists='true')
+        else:
+            expected[LOCKS_DATA_FIELD] = dict(Exists='false')
+    for k in key.keys():
+        expected[k] = dict(Value=key[k], Exists='true')
+    attribute_updates = {
+        LOCKS_DATA_FIELD: dict(Action='ADD', Value=dict(SS=[lock_token(tx_uuid_str, requested_lock_state)]))
+    }
+    if requested_lock_state == LOCK_EXCLUSIVE:
+        attribute_updates[X_LOCK_DATA_FIELD] = dict(Action='PUT', Value=dict(S=tx_uuid_str))
+    return attribute_updates, expected
+
+
+def unlock_request(tx_uuid_str, lock_state):
+    """
+
+    Build update releasing lock_state held by tx, X release is conditioned on owning the X lock
+
+    @return: (attribute_updates, expected)
+    """
+    if lock_state == LOCK_EXCLUSIVE:
+        expected = {X_LOCK_DATA_FIELD: dict(Value=dict(S=tx_uuid_str), Exists='true')}
+        attribute_updates = {
+            X_LOCK_DATA_FIELD: dict(Action='DELETE'),
+            LOCKS_DATA_FIELD: dict(Action='DELETE', Value=dict(SS=own_lock_tokens(tx_uuid_str, LOCK_EXCLUSIVE) +
+                                                                   own_lock_tokens(tx_uuid_str, LOCK_SHARED)))
+        }
+    else:
+        expected = None
+        attribute_updates = {
+            LOCKS_DATA_FIELD: dict(Action='DELETE', Value=dict(SS=own_lock_tokens(tx_uuid_str, LOCK_SHARED)))
+        }
+    return attribute_updates, expected
+
+
+def downgrade_request(tx_uuid_str):
+    """
+
+    Build update turning X lock taken by S->X upgrade back into the S lock, conditioned on owning the X lock
+
+    @return: (attribute_updates, expected)
+    """
+    expected = {X_LOCK_DATA_FIELD: dict(Value=dict(S=tx_uuid_str), Exists='true')}
+    attribute_updates = {
+        X_LOCK_DATA_FIELD: dict(Action='DELETE'),
+        LOCKS_DATA_FIELD: dict(Action='DELETE', Value=dict(SS=own_lock_tokens(tx_uuid_str, LOCK_EXCLUSIVE)))
+    }
+    return attribute_updates, expected
+
+
+def _item_trace(tx_item):
+    return tx_item.tx.trace
+
+
+def _item_attributes(tx_item, *args):
+    return {'table': tx_item.table_name, 'key': lambda: json.dumps(tx_item.key, sort_keys=True)}
+
+
+def _lock_attributes(tx_item, requested_lock_state=None, *args):
+    attributes = _item_attributes(tx_item)
+    attributes['lock'] = requested_lock_state
+    attributes['lock_state'] = tx_item.lock_state
+    return attributes
+
+
+class TxItemBase():
+    def __init__(self, table_name, hash_key_value, range_key_value=None, tx=None, key=None):
+        """
+
+        State and request steps (see steps module) of a transaction item, shared by TxItem and aio.AsyncTxItem
+
+        @param key: Key in wire format, built with the table key schema if None
+        """
         self.request = None
         self.tx = tx
         self.tx_uuid_str = str(tx.tx_uuid)
         self.table_name = table_name
         self.hash_key_value = hash_key_value
         self.range_key_value = range_key_value
-        self.key = self.tx.connection.gen_key_attribute(self.table_name, self.hash_key_value, self.range_key_value)
+        if key is None:
+            key = self.tx.connection.gen_key_attribute(self.table_name, self.hash_key_value, self.range_key_value)
+        self.key = key
         self.lock_state = None
+        self.locks = []
         self.not_exist = None
         self.rec_uuid = uuid.uuid1()
+        self.image_key = self.lock_order_key()
+        # Optimistic transaction state: committed version and before-image read, buffered write
+        self.observed = False
+        self.version = None
+        self.before_image = None
+        self.write = None
+        self.pending_updates = []
+        self.expected = {}
+
+    def lock_order_key(self):
+        return self.table_name, json.dumps(self.key, sort_keys=True)
+
+    def _image(self):
+        """
+
+        @return: Item image cached by the transaction (valid only while a lock is held) or None
+        """
+        return self.tx.item_images.get(self.image_key)
+
+    def _set_image(self, image):
+        if image is None:
+            self.tx.item_images.pop(self.image_key, None)
+        else:
+            self.tx.item_images[self.image_key] = image
 
-    def _get_locks(self):
-        attribute_to_get = [LOCKS_DATA_FIELD]
-        consistent_read = True
-        items = self.tx.connection.connection.get_item(self.table_name, self.key, attribute_to_get, consistent_read)
-        self.tx.stat['GET1'] += 1
-        if items == {}:
+    def has_lock(self, requested_lock_state):
+        return self.lock_state == requested_lock_state or self.lock_state == LOCK_EXCLUSIVE
+
+    def _add_tx_fields_to_item(self, item, versioned=False):
+        """
+
+        @param versioned: Write new version even if item versions are not enabled, see use_item_versions
+        """
+        item[X_LOCK_DATA_FIELD] = dict(S=self.tx_uuid_str)
+        item[LOCKS_DATA_FIELD] = dict(SS=[lock_token(self.tx_uuid_str, LOCK_EXCLUSIVE)])
+        if versioned or _item_versions:
+            item[VERSION_DATA_FIELD] = dict(S=new_version())
+
+    def _locked_item(self, item):
+        """
+
+        @return: Copy of item with key and X lock of the transaction, written by Tx.bulk_put with BatchWriteItem
+        """
+        item = dict(item)
+        for k in self.key.keys():
+            item[k] = self.key[k]
+        self._add_tx_fields_to_item(item)
+        return item
+
+    def _read_lock_tokens_steps(self):
+        result = yield Call(CATEGORY_LOCK, 'get_item', self.table_name, self.key, [LOCKS_DATA_FIELD], True)
+        if result == {}:
             raise NotExistingItem('Item with key {} not exist'.format(str(self.key)))
-        items = items['Item']
-        if items == {}:
-            return []
-        items = items[LOCKS_DATA_FIELD]['SS']
-        locks = []
-        logger.debug('Tx ID: {}'.format(self.tx_uuid_str))
-        for item in items:
-            item = json.loads(item)
-            logger.debug('Item: {}'.format(item))
-            if item['tx_uuid'] != self.tx_uuid_str:
-                locks.append(item)
-        return locks
-
-    def __x_lock(self):
-        expected = {X_LOCK_DATA_FIELD: dict(Exists='false')}
-        data_value = self.tx_uuid_str
-        attribute_updates = {X_LOCK_DATA_FIELD: dict(Action='PUT', Value=dict(S=data_value))}
-        self.tx.connection.connection.update_item(self.table_name, self.key, attribute_updates, expected)
-        self.tx.stat['UPDATE1'] += 1
-
-    def __lock(self, lock_state, after_x_lock=False):
-        if after_x_lock:
-            expected = None
-        else:
-            expected = {X_LOCK_DATA_FIELD: dict(Exists='false')}
-        data_value = dict(tx_uuid=self.tx_uuid_str, lock=lock_state)
-        attribute_updates = {
-            LOCKS_DATA_FIELD: dict(Action='ADD', Value=dict(SS=[json.dumps(data_value)]))
-        }
-        self.tx.connection.connection.update_item(self.table_name, self.key, attribute_updates, expected)
-        self.tx.stat['UPDATE1'] += 1
+        item = result['Item']
+        if item == {}:
+            yield Result([])
+        yield Result(item[LOCKS_DATA_FIELD]['SS'])
+
+    def _try_lock_steps(self, requested_lock_state, tokens=None):
+        """
+
+        Take lock with one conditional update. The whole item is returned by ReturnValues: lock tokens are kept in
+        self.locks, the rest seeds the item image, so get() under this lock needs no read.
+
+        @return: Steps with result True if lock is taken, False if condition failed
+        """
+        yield self.tx._before_lock_steps(self.table_name)
+        attribute_updates, expected = lock_request(self.key, self.tx_uuid_str, requested_lock_state,
+                                                   self.lock_state, tokens)
+        try:
+            result = yield Call(CATEGORY_LOCK, 'update_item', self.table_name, self.key, attribute_updates,
+                                expected, return_values='ALL_NEW')
+        except ConditionalCheckFailedException:
+            yield Result(False)
+        self.locks = parse_locks(result['Attributes'][LOCKS_DATA_FIELD]['SS'], self.tx_uuid_str)
+        self.lock_state = requested_lock_state
+        self.version = result['Attributes'].get(VERSION_DATA_FIELD, {}).get('S')
+        self._set_image(make_image(result['Attributes'], HIDDEN_DATA_FIELDS))
+        yield Result(True)
+
+    def _lock_steps(self, requested_lock_state):
+        """
+
+        Uncontended S lock, X lock or S->X upgrade costs one conditional update. Only when the condition fails,
+        lock tokens are read to tell a busy item from a missing one (NotExistingItem) and to find the holders.
+
+        @param requested_lock_state: LOCK_SHARED or LOCK_EXCLUSIVE
+        @return: Steps with result True if lock is taken, False if item is locked by other transaction
+        """
+        logger.debug('Current lock state is %s, requested lock state is %s', self.lock_state, requested_lock_state)
+        if requested_lock_state not in (LOCK_SHARED, LOCK_EXCLUSIVE):
+            raise BadLockType('Lock type is ' + requested_lock_state)
+        if self.has_lock(requested_lock_state):
+            yield Result(True)
+        locked = yield self._try_lock_steps(requested_lock_state)
+        if locked:
+            yield Result(True)
+        tokens = yield self._read_lock_tokens_steps()
+        self.locks = parse_locks(tokens, self.tx_uuid_str)
+        if is_lock_conflict(self.locks, requested_lock_state):
+            logger.debug('Item locked by %s', self.locks)
+            yield Result(False)
+        # Only own tokens (or none) are left on the item: retry once against the observed lock set
+        if metrics.sinks:
+            metrics.report_retry(CATEGORY_LOCK, 'update_item', self.table_name, 'lock set changed')
+        locked = yield self._try_lock_steps(requested_lock_state, tokens)
+        yield Result(locked)
+
+    def _wait_lock_steps(self, requested_lock_state, wait_time=None, max_wait_time=1, generate_exception=True,
+                         wait_strategy=None):
+        """
+
+        Retry lock until it succeeds or max_wait_time deadline passes
+
+        @param wait_time: Fixed sleep between attempts, if None wait_strategy is used
+        @param max_wait_time: Wait budget (sec.)
+        @param wait_strategy: WaitStrategy instance, Tx wait strategy if None
+        """
+        locked = yield self._lock_steps(requested_lock_state)
+        if locked:
+            yield Result(True)
+        if not wait_time is None:
+            wait_strategy = FixedWait(wait_time)
+        elif wait_strategy is None:
+            wait_strategy = self.tx.wait_strategy
+        started = time()
+        deadline = started + max_wait_time
+        attempts = 1
+        while True:
+            remaining = deadline - time()
+            if remaining <= 0:
+                self._lock_wait(requested_lock_state, attempts, started, False)
+                if generate_exception:
+                    raise LockWaitTime('Lock time for item with key {} in table "{}" exceed {} sec., holders {}'.
+                                       format(self.key, self.table_name, max_wait_time,
+                                              [lock['tx_uuid'] for lock in self.locks]))
+                yield Result(False)
+            yield Sleep(min(wait_strategy.delay(attempts, self), remaining))
+            attempts += 1
+            if metrics.sinks:
+                metrics.report_retry(CATEGORY_LOCK, 'update_item', self.table_name, 'lock busy')
+            locked = yield self._lock_steps(requested_lock_state)
+            if locked:
+                self._lock_wait(requested_lock_state, attempts, started, True)
+                yield Result(True)
+
+    def _lock_wait(self, requested_lock_state, attempts, started, acquired):
+        lock_wait = LockWait(self, requested_lock_state, attempts, time() - started,
+                             [lock['tx_uuid'] for lock in self.locks], acquired)
+        self.tx.lock_waits.append(lock_wait)
+        notify_lock_wait(lock_wait)
+        if metrics.sinks:
+            metrics.report_lock_wait(lock_wait)
+
+    def _unlock_steps(self):
+        """
+
+        Release held lock with one update which touches only the lock attributes this item holds, a delete not
+        committed yet is dropped
+
+        """
+        self._set_image(None)
+        self.write = None
+        if not self.lock_state is None:
+            attribute_updates, expected = unlock_request(self.tx_uuid_str, self.lock_state)
+            try:
+                yield Call(CATEGORY_LOCK, 'update_item', self.table_name, self.key, attribute_updates, expected)
+            except ConditionalCheckFailedException:
+                logger.debug('Item with key %s is not X locked by tx %s', self.key, self.tx_uuid_str)
+        self.lock_state = None
+
+    def _downgrade_steps(self):
+        """
 
-    def __unlock(self):
+        Give up X lock of S->X upgrade not used yet, the S lock is kept
+
+        """
+        attribute_updates, expected = downgrade_request(self.tx_uuid_str)
         try:
-            data_value = self.tx_uuid_str
-            expected = {X_LOCK_DATA_FIELD: dict(Value=dict(S=data_value), Exists='true')}
-            attribute_updates = {X_LOCK_DATA_FIELD: dict(Action='DELETE')}
-            self.tx.connection.connection.update_item(self.table_name, self.key, attribute_updates, expected)
-            self.tx.stat['UPDATE1'] += 1
+            yield Call(CATEGORY_LOCK, 'update_item', self.table_name, self.key, attribute_updates, expected)
         except ConditionalCheckFailedException:
-            pass
-        data_value_1 = dict(tx_uuid=self.tx_uuid_str, lock=LOCK_EXCLUSIVE)
-        data_value_2 = dict(tx_uuid=self.tx_uuid_str, lock=LOCK_SHARED)
-        attribute_updates = {
-            LOCKS_DATA_FIELD: dict(
-                Action='DELETE', Value=dict(SS=[json.dumps(data_value_1), json.dumps(data_value_2)]))
-        }
-        self.tx.connection.connection.update_item(self.table_name, self.key, attribute_updates)
-        self.tx.stat['UPDATE1'] += 1
+            logger.debug('Item with key %s is not X locked by tx %s', self.key, self.tx_uuid_str)
+        self.lock_state = LOCK_SHARED
+
+    def _read_steps(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None):
+        result = yield Call(CATEGORY_DATA, 'get_item', self.table_name, self.key,
+                            attributes_to_get=attributes_to_get,
+                            consistent_read=consistent_read,
+                            return_consumed_capacity=return_consumed_capacity)
+        yield Result(result)
+
+    def _committed_item_steps(self, item):
+        """
+
+        Committed state of item read without lock. READ_UNCOMMITTED returns item as is. Otherwise, if item is X
+        locked by other transaction, its before-image is taken from the holder undo log. Before-images are durable
+        before the data is written, so an X locked item without undo record is not modified by the holder yet.
+
+        @param item: Item read without lock
+        @return: Steps with result item (may contain lock attributes) or None if item does not exist for this
+        transaction
+        """
+        if self.tx.read_mode == READ_UNCOMMITTED:
+            yield Result(item)
+        holder = item.get(X_LOCK_DATA_FIELD, {}).get('S')
+        if holder is None or holder == self.tx_uuid_str:
+            yield Result(item)
+        found, before_image = yield self.tx._before_image_steps(holder, self.table_name, self.key)
+        yield Result(before_image if found else item)
+
+    def _get_steps(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None):
+        """
+
+        Read item under S (or own X) lock, or without lock with READ_COMMITTED and READ_UNCOMMITTED read modes. An
+        item deleted by the transaction is not returned.
+
+        """
+        if self.write == WRITE_DELETE:
+            yield Result({})
+        if self.lock_state is None and self.tx.read_mode != READ_LOCK:
+            result = yield self._read_steps(None, consistent_read, return_consumed_capacity)
+            if not 'Item' in result:
+                yield Result(result)
+            item = yield self._committed_item_steps(result['Item'])
+            if item is None:
+                yield Result({})
+            result['Item'] = project(make_image(item, HIDDEN_DATA_FIELDS), attributes_to_get)
+            yield Result(result)
+        yield self._wait_lock_steps(LOCK_SHARED)
+        image = self._image()
+        if image is None:
+            # Capacity is charged by item size, projection is applied to the cached full image
+            result = yield self._read_steps(None, consistent_read, return_consumed_capacity)
+            if not 'Item' in result:
+                yield Result(result)
+            image = make_image(result['Item'], HIDDEN_DATA_FIELDS)
+            self._set_image(image)
+            result['Item'] = project(image, attributes_to_get)
+            yield Result(result)
+        yield Result({'Item': project(image, attributes_to_get)})
+
+    def _put_item_steps(self, item, expected=None, return_values=None, return_consumed_capacity=None,
+                        return_item_collection_metrics=None):
+        for k in self.key.keys():
+            item[k] = self.key[k]
+        result = yield Call(CATEGORY_DATA, 'put_item', self.table_name, item, expected=expected,
+                            return_values=return_values, return_consumed_capacity=return_consumed_capacity,
+                            return_item_collection_metrics=return_item_collection_metrics)
+        yield Result(result)
+
+    def _undo_image_steps(self):
+        """
+
+        @return: Steps with result attributes restoring X locked item: its image with version, read if the image
+        is not cached
+        """
+        image = self._image()
+        if image is None:
+            result = yield self._read_steps(None, True)
+            if not 'Item' in result:
+                yield Result(None)
+            yield Result(make_image(result['Item'], LOCK_DATA_FIELDS))
+        image = project(image)
+        if not self.version is None:
+            image[VERSION_DATA_FIELD] = dict(S=self.version)
+        yield Result(image)
+
+    def _log_before_image_steps(self):
+        """
+
+        Make the before-image of X locked item durable in the undo log before the first write of the item
+
+        """
+        if not self.tx._is_logged(self):
+            image = yield self._undo_image_steps()
+            yield self.tx._put_tx_log_steps(self, {'Attributes': image}, 'PUT')
+        yield self.tx._before_write_steps()
+
+    def _create_steps(self, item, return_consumed_capacity=None, return_item_collection_metrics=None):
+        """
+
+        Lock by create: put item X locked by the transaction on condition that the key does not exist. The DELETE
+        undo record must be durable before, see Tx._put_tx_log.
+
+        @return: Steps with result of put_item, None if the item exists
+        """
+        yield self.tx._before_lock_steps(self.table_name)
+        expected = dict((k, dict(Exists='false')) for k in self.key.keys())
+        item = self._locked_item(item)
+        try:
+            result = yield self._put_item_steps(item, expected, 'ALL_OLD', return_consumed_capacity,
+                                                return_item_collection_metrics)
+        except ConditionalCheckFailedException:
+            yield Result(None)
+        self.lock_state = LOCK_EXCLUSIVE
+        self.version = item.get(VERSION_DATA_FIELD, {}).get('S')
+        yield Result(result)
 
-    def lock(self, requested_lock_state):
-        logger.debug('Current lock state is {}, requested lock state is {}'.format(self.lock_state,
-                                                                                   requested_lock_state))
-        if self.lock_state != requested_lock_state:
-            if requested_lock_state == LOCK_SHARED:
-                logger.debug('S lock state')
-                if self.lock_state == LOCK_EXCLUSIVE:
-                    logger.debug('Return True because self has X lock state')
-                    return True
-                locks = self._get_locks()
-                for lock in locks:
-                    if lock['lock'] == LOCK_EXCLUSIVE:
-                        logger.debug('Item already X locked')
-                        return False
-                logger.debug('Set S lock on item')
-                self.__lock(requested_lock_state)
-                self.lock_state = requested_lock_state
-                return True
-            elif requested_lock_state == LOCK_EXCLUSIVE:
-                logger.debug('X lock state')
-                locks = self._get_locks()
-                if len(locks) == 0:
-                    logger.debug('No any locks found')
-                    self.__x_lock()
-                    self.__lock(requested_lock_state, after_x_lock=True)
-                    data_value = dict(tx_uuid=self.tx_uuid_str, lock=LOCK_SHARED)
-                    attribute_updates = {
-                        LOCKS_DATA_FIELD: dict(Action='DELETE', Value={'SS': [json.dumps(data_value)]})
-                    }
-                    self.tx.connection.connection.update_item(self.table_name, self.key, attribute_updates)
-                    self.tx.stat['UPDATE1'] += 1
-                    self.lock_state = requested_lock_state
-                    return True
-                else:
-                    logger.debug('Any locks found')
-                    return False
+    def _put_steps(self, item, expected=None, return_consumed_capacity=None, return_item_collection_metrics=None):
+        """
+
+        Write item under X lock, the before-image is logged first. An item which does not exist is locked by
+        conditional create after its DELETE undo record is logged.
+
+        """
+        exists = True
+        try:
+            yield self._wait_lock_steps(LOCK_EXCLUSIVE)
+        except NotExistingItem:
+            exists = False
+        if not exists:
+            yield self.tx._put_tx_log_steps(self, None, 'DELETE')
+            yield self.tx._before_write_steps()
+            result = yield self._create_steps(item, return_consumed_capacity, return_item_collection_metrics)
+            if result is None:
+                # Created by other transaction meanwhile, the DELETE undo record must not restore it
+                yield self.tx._retract_tx_log_steps(self)
+                result = yield self._put_steps(item, expected, return_consumed_capacity,
+                                               return_item_collection_metrics)
+                yield Result(result)
+            self._set_image(make_image(item, HIDDEN_DATA_FIELDS))
+            yield Result(result)
+        expected = dict(expected or {})
+        expected[X_LOCK_DATA_FIELD] = dict(Value=dict(S=self.tx_uuid_str), Exists='true')
+        yield self._log_before_image_steps()
+        item = self._locked_item(item)
+        result = yield self._put_item_steps(item, expected, 'ALL_OLD', return_consumed_capacity,
+                                            return_item_collection_metrics)
+        self.version = item.get(VERSION_DATA_FIELD, {}).get('S')
+        self.write = None
+        self._set_image(make_image(item, HIDDEN_DATA_FIELDS))
+        yield Result(result)
+
+    def _update_steps(self, update_data, expected=None, return_consumed_capacity=None,
+                      return_item_collection_metrics=None):
+        """
+
+        Update item under X lock, the before-image is logged first. update_data is not changed.
+
+        """
+        try:
+            yield self._wait_lock_steps(LOCK_EXCLUSIVE)
+        except NotExistingItem:
+            raise NotExistingItem('Cannot update non existent item with key {}'.format(self.key))
+        if self.write == WRITE_DELETE:
+            raise NotExistingItem('Cannot update item with key {} deleted by the transaction'.format(self.key))
+        expected = dict(expected or {})
+        expected[X_LOCK_DATA_FIELD] = dict(Value=dict(S=self.tx_uuid_str), Exists='true')
+        attribute_updates = dict((k, v) for k, v in update_data.items() if not k in self.key)
+        version = None
+        if _item_versions:
+            version = new_version()
+            attribute_updates[VERSION_DATA_FIELD] = dict(Action='PUT', Value=dict(S=version))
+        yield self._log_before_image_steps()
+        logger.debug('Attribute updates: %s', attribute_updates)
+        logger.debug('Expected: %s', expected)
+        result = yield Call(CATEGORY_DATA, 'update_item', self.table_name, self.key,
+                            attribute_updates=attribute_updates, expected=expected, return_values='ALL_OLD',
+                            return_consumed_capacity=return_consumed_capacity,
+                            return_item_collection_metrics=return_item_collection_metrics)
+        if not version is None:
+            self.version = version
+        image = self._image()
+        if image is None and 'Attributes' in result:
+            image = make_image(result['Attributes'], HIDDEN_DATA_FIELDS)
+        if not image is None:
+            image = apply_updates(image, update_data)
+        self._set_image(image)
+        yield Result(result)
+
+    def _delete_steps(self):
+        """
+
+        X lock item for deletion. The item is deleted at commit by _release_write_steps, until then it is left in
+        place under the X lock (nothing to undo) and the transaction reads it as not existing.
+
+        """
+        try:
+            yield self._wait_lock_steps(LOCK_EXCLUSIVE)
+        except NotExistingItem:
+            raise NotExistingItem('Cannot delete non existent item with key {}'.format(self.key))
+        yield self.tx._before_data_mutation_steps()
+        self.write = WRITE_DELETE
+        self._set_image(None)
+        yield Result({})
+
+    def _commit_expected(self):
+        """
+
+        @return: Condition of optimistic commit write: item is not locked, is in the state read by the transaction
+        (if it was read) and satisfies expected conditions of buffered writes
+        """
+        expected = dict(self.expected)
+        expected[LOCKS_DATA_FIELD] = dict(Exists='false')
+        expected[X_LOCK_DATA_FIELD] = dict(Exists='false')
+        if not self.observed:
+            return expected
+        if self.not_exist:
+            for k in self.key.keys():
+                expected[k] = dict(Exists='false')
+        elif self.version is None:
+            expected[VERSION_DATA_FIELD] = dict(Exists='false')
+            for k in self.key.keys():
+                expected[k] = dict(Value=self.key[k], Exists='true')
+        else:
+            expected[VERSION_DATA_FIELD] = dict(Value=dict(S=self.version), Exists='true')
+        return expected
+
+    def _commit_write_steps(self, lock):
+        """
+
+        Validate and write buffered change of optimistic transaction with one conditional request. With lock the
+        item is left X locked until _release_write_steps or _undo_write_steps, delete then only takes the X lock.
+
+        @param lock: Leave X lock on the item
+        @return: Steps with result True, False if the item was changed or locked by other transaction
+        """
+        expected = self._commit_expected()
+        try:
+            if self.write == WRITE_DELETE and lock:
+                attribute_updates, _ = lock_request(self.key, self.tx_uuid_str, LOCK_EXCLUSIVE)
+                yield Call(CATEGORY_LOCK, 'update_item', self.table_name, self.key, attribute_updates, expected)
+            elif self.write == WRITE_DELETE:
+                yield Call(CATEGORY_DATA, 'delete_item', self.table_name, self.key, expected=expected)
             else:
-                raise BadLockType('Lock type is ' + requested_lock_state)
+                item = project(self._image())
+                if lock:
+                    self._add_tx_fields_to_item(item, True)
+                else:
+                    item[VERSION_DATA_FIELD] = dict(S=new_version())
+                yield self._put_item_steps(item, expected)
+        except ConditionalCheckFailedException:
+            yield Result(False)
+        if lock:
+            self.lock_state = LOCK_EXCLUSIVE
+        yield Result(True)
+
+    def _release_write_steps(self):
+        """
+
+        Finish write of committed transaction: delete the item deleted by the transaction, release the lock of
+        any other item
+
+        """
+        if self.write == WRITE_DELETE and self.lock_state == LOCK_EXCLUSIVE:
+            expected = {X_LOCK_DATA_FIELD: dict(Value=dict(S=self.tx_uuid_str), Exists='true')}
+            try:
+                yield Call(CATEGORY_DATA, 'delete_item', self.table_name, self.key, expected=expected)
+            except ConditionalCheckFailedException:
+                logger.debug('Item with key %s is not X locked by tx %s', self.key, self.tx_uuid_str)
+            self._set_image(None)
+            self.lock_state = None
         else:
-            return True
+            yield self._unlock_steps()
 
-    def wait_lock(self, requested_lock_state, wait_time=0.1, max_wait_time=1, generate_exception=True):
-        count = 0.0
-        while not self.lock(requested_lock_state):
-            count += wait_time
-            if count > max_wait_time:
-                if generate_exception:
-                    raise LockWaitTime('Lock time for item with key {} in table "{}" exceed {} sec.'.
-                    format(self.key, self.table_name, max_wait_time))
-                return False
-            sleep(wait_time)
-        return True
+    def _undo_write_steps(self):
+        """
 
+        Restore before-image of item written by _commit_write_steps, the X lock is released by the same request
+
+        """
+        if self.lock_state == LOCK_EXCLUSIVE:
+            expected = {X_LOCK_DATA_FIELD: dict(Value=dict(S=self.tx_uuid_str), Exists='true')}
+            try:
+                if self.before_image is None:
+                    yield Call(CATEGORY_DATA, 'delete_item', self.table_name, self.key, expected=expected)
+                else:
+                    yield self._put_item_steps(project(self.before_image), expected)
+            except ConditionalCheckFailedException:
+                logger.debug('Item with key %s is not X locked by tx %s', self.key, self.tx_uuid_str)
+            self.lock_state = None
+
+
+class TxItem(TxItemBase):
+    def __init__(self, table_name, hash_key_value, range_key_value=None, tx=None, key=None):
+        TxItemBase.__init__(self, table_name, hash_key_value, range_key_value, tx, key)
+
+    def _read_lock_tokens(self):
+        return run(self.tx._call, self._read_lock_tokens_steps())
+
+    def _get_locks(self):
+        """
+
+        Read lock tokens of other transactions with consistent read
+
+        @return: List of {'tx_uuid': ..., 'lock': 'S'|'X'}
+        """
+        logger.debug('Tx ID: %s', self.tx_uuid_str)
+        return parse_locks(self._read_lock_tokens(), self.tx_uuid_str)
+
+    @traced('lock', _item_trace, _lock_attributes)
+    def lock(self, requested_lock_state):
+        """
+
+        See _lock_steps
+
+        @return: True if lock is taken, False if item is locked by other transaction
+        """
+        return run(self.tx._call, self._lock_steps(requested_lock_state))
+
+    @traced('wait_lock', _item_trace, _lock_attributes)
+    def wait_lock(self, requested_lock_state, wait_time=None, max_wait_time=1, generate_exception=True,
+                  wait_strategy=None):
+        """
+
+        Retry lock() until it succeeds or max_wait_time deadline passes
+
+        @param wait_time: Fixed sleep between attempts, if None wait_strategy is used
+        @param max_wait_time: Wait budget (sec.)
+        @param wait_strategy: WaitStrategy instance, Tx wait strategy if None
+        """
+        return run(self.tx._call, self._wait_lock_steps(requested_lock_state, wait_time, max_wait_time,
+                                                        generate_exception, wait_strategy))
+
+    @traced('unlock', _item_trace, _lock_attributes)
     def unlock(self):
-        self.__unlock()
-        self.lock_state = None
+        run(self.tx._call, self._unlock_steps())
 
     def __get(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None):
-        result = self.tx.connection.connection.get_item(
-            self.table_name, self.key,
-            attributes_to_get=attributes_to_get,
-            consistent_read=consistent_read,
-            return_consumed_capacity=return_consumed_capacity)
-        self.tx.stat['GET'] += 1
+        return run(self.tx._call, self._read_steps(attributes_to_get, consistent_read, return_consumed_capacity))
+
+    def _committed_item(self, item):
+        """
+
+        See _committed_item_steps
+
+        """
+        return run(self.tx._call, self._committed_item_steps(item))
+
+    def _undo_image(self):
+        """
+
+        See _undo_image_steps
+
+        """
+        return run(self.tx._call, self._undo_image_steps())
+
+    def _needs_read(self):
+        return self._image() is None and not self.observed and self.write != WRITE_DELETE
+
+    def _observe(self, item):
+        """
+
+        Record committed state of item read by optimistic transaction: the version validated at commit, the
+        before-image logged for undo and the image buffered updates are applied to
+
+        @param item: Committed item or None if item does not exist
+        """
+        self.observed = True
+        self.not_exist = item is None
+        if item is None:
+            self.version = None
+            self.before_image = None
+            image = None
+        else:
+            self.version = item.get(VERSION_DATA_FIELD, {}).get('S')
+            self.before_image = make_image(item, LOCK_DATA_FIELDS)
+            image = make_image(item, HIDDEN_DATA_FIELDS)
+        if self.write is None:
+            self._set_image(image)
+            return
+        if len(self.pending_updates) == 0:
+            return
+        for update_data in self.pending_updates:
+            image = self.__apply_updates(image, update_data)
+        self.pending_updates = []
+        self._set_image(image)
+
+    def __apply_updates(self, image, update_data):
+        if image is None:
+            raise NotExistingItem('Cannot update non existent item with key {}'.format(self.key))
+        image = apply_updates(image, update_data)
+        if image is None:
+            raise UpdateNotApplicable('Updates {} cannot be applied to item with key {}'.format(
+                update_data, self.key))
+        return image
+
+    def __optimistic_get(self, attributes_to_get, consistent_read, return_consumed_capacity):
+        if self._needs_read():
+            result = self.__get(None, consistent_read, return_consumed_capacity)
+            if 'Item' in result:
+                self._observe(self._committed_item(result['Item']))
+            else:
+                self._observe(None)
+        image = self._image()
+        if image is None:
+            return {}
+        return {'Item': project(image, attributes_to_get)}
+
+    @traced('get', _item_trace, _item_attributes)
+    def get(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None, decoded=False):
+        """
+
+        Read item under S (or own X) lock. While the lock is held the item image cached by the transaction is
+        returned without a request; lock attributes are not returned. With READ_COMMITTED and READ_UNCOMMITTED
+        isolation levels an item not locked by the transaction is read without lock, see _committed_item.
+        Optimistic transaction reads the committed item once, later reads return its image with own buffered
+        writes applied.
+
+        @param decoded: Return item_view() of the result, None if no item
+        """
+        if self.tx.optimistic:
+            result = self.__optimistic_get(attributes_to_get, consistent_read, return_consumed_capacity)
+        else:
+            result = run(self.tx._call, self._get_steps(attributes_to_get, consistent_read, return_consumed_capacity))
+        if decoded:
+            return item_view(result)
         return result
 
-    def get(self, attributes_to_get=None, consistent_read=True, return_consumed_capacity=None):
-        self.wait_lock(LOCK_SHARED)
-        return self.__get(attributes_to_get, consistent_read, return_consumed_capacity)
+    def __buffer_expected(self, expected):
+        if not expected is None:
+            self.expected.update(expected)
 
-    def __put(self, item, expected=None, return_values=None, return_consumed_capacity=None,
-              return_item_collection_metrics=None):
+    def __buffer_put(self, item, expected):
+        image = make_image(item, HIDDEN_DATA_FIELDS)
         for k in self.key.keys():
-            item[k] = self.key[k]
-        result = self.tx.connection.connection.put_item(
-            self.table_name, item, expected=expected, return_values=return_values,
-            return_consumed_capacity=return_consumed_capacity,
-            return_item_collection_metrics=return_item_collection_metrics
-        )
-        self.tx.stat['PUT'] += 1
-        return result
+            image[k] = self.key[k]
+        self.write = WRITE_PUT
+        self.pending_updates = []
+        self._set_image(image)
+        self.__buffer_expected(expected)
+        return {}
 
-    def __add_x_lock_to_item(self, item):
-        data_value = dict(tx_uuid=self.tx_uuid_str, lock=LOCK_EXCLUSIVE)
-        item[X_LOCK_DATA_FIELD] = dict(S=self.tx_uuid_str)
-        item[LOCKS_DATA_FIELD] = dict(SS=[json.dumps(data_value)])
+    def __buffer_update(self, update_data, expected):
+        image = self._image()
+        if self.write == WRITE_DELETE or (self.observed and image is None):
+            raise NotExistingItem('Cannot update non existent item with key {}'.format(self.key))
+        if image is None:
+            self.pending_updates.append(dict(update_data))
+        else:
+            self._set_image(self.__apply_updates(image, update_data))
+        self.write = WRITE_PUT
+        self.__buffer_expected(expected)
+        return {}
+
+    def __buffer_delete(self, expected):
+        self.write = WRITE_DELETE
+        self.pending_updates = []
+        self._set_image(None)
+        self.__buffer_expected(expected)
+        return {}
+
+    def _commit_write(self, lock):
+        """
+
+        See _commit_write_steps
+
+        @return: True, False if the item was changed or locked by other transaction
+        """
+        return run(self.tx._call, self._commit_write_steps(lock))
+
+    def _release_write(self):
+        run(self.tx._call, self._release_write_steps())
+
+    def _undo_write(self):
+        run(self.tx._call, self._undo_write_steps())
+
+    def _is_unchanged(self, item):
+        """
+
+        @param item: Current item, None if it does not exist
+        @return: True if item is in the state read by optimistic transaction
+        """
+        if item is None or self.not_exist:
+            return item is None and self.not_exist
+        return item.get(VERSION_DATA_FIELD, {}).get('S') == self.version
 
+    def _discard(self):
+        self.observed = False
+        self.write = None
+        self.pending_updates = []
+        self.expected = {}
+        self._set_image(None)
+
+    def _create(self, item, return_consumed_capacity=None, return_item_collection_metrics=None):
+        """
+
+        See _create_steps
+
+        @return: put_item result, None if the item exists
+        """
+        return run(self.tx._call, self._create_steps(item, return_consumed_capacity, return_item_collection_metrics))
+
+    @traced('put', _item_trace, _item_attributes)
     def put(self, item, expected=None, return_consumed_capacity=None,
             return_item_collection_metrics=None):
-        return_values = 'ALL_OLD'
-        try:
-            self.wait_lock(LOCK_EXCLUSIVE)
-            if expected is None:
-                expected = {}
-            expected[X_LOCK_DATA_FIELD] = dict(Value=dict(S=self.tx_uuid_str), Exists='true')
-            self.__add_x_lock_to_item(item)
-            result = self.__put(item, expected=expected, return_values=return_values,
-                                return_consumed_capacity=return_consumed_capacity,
-                                return_item_collection_metrics=return_item_collection_metrics)
-            self.tx._put_tx_log(self, result, 'PUT')
-            return result
-        except NotExistingItem:
-            expected = self.key.copy()
-            for k in self.key.keys():
-                expected[k] = dict(Exists='false')
-                item[k] = self.key[k]
-            self.__add_x_lock_to_item(item)
-            logger.debug('Expected value: {}'.format(str(expected)))
-            logger.debug('Item value: {}'.format(str(item)))
-            result = self.__put(item, expected=expected, return_values=return_values,
-                                return_consumed_capacity=return_consumed_capacity,
-                                return_item_collection_metrics=return_item_collection_metrics)
-            self.tx._put_tx_log(self, None, 'DELETE')
-            return result
-
-    def __update(self, attribute_updates=None, expected=None, return_values=None, return_consumed_capacity=None,
-                 return_item_collection_metrics=None):
-        for k in self.key.keys():
-            try:
-                del attribute_updates[k]
-            except KeyError:
-                pass
-        logger.debug('Attribute updates: {}'.format(attribute_updates))
-        logger.debug('Expected: {}'.format(expected))
-        result = self.tx.connection.connection.update_item(
-            self.table_name, self.key, attribute_updates=attribute_updates, expected=expected,
-            return_values=return_values, return_consumed_capacity=return_consumed_capacity,
-            return_item_collection_metrics=return_item_collection_metrics)
-        self.tx.stat['UPDATE'] += 1
-        return result
+        """
+
+        Write item under X lock, the before-image is logged first. An item which does not exist is locked by
+        conditional create after its DELETE undo record is logged. Optimistic transaction only buffers the item
+        until commit and returns {}, expected conditions are checked at commit.
 
+        """
+        if self.tx.optimistic:
+            return self.__buffer_put(item, expected)
+        return run(self.tx._call, self._put_steps(item, expected, return_consumed_capacity,
+                                                  return_item_collection_metrics))
+
+    @traced('update', _item_trace, _item_attributes)
     def update(self, update_data, expected=None, return_consumed_capacity=None,
                return_item_collection_metrics=None):
-        return_values = 'ALL_OLD'
-        try:
-            self.wait_lock(LOCK_EXCLUSIVE)
-            if expected is None:
-                expected = {}
-            expected[X_LOCK_DATA_FIELD] = dict(Value=dict(S=self.tx_uuid_str), Exists='true')
-            result = self.__update(
-                attribute_updates=update_data, expected=expected, return_values=return_values,
-                return_consumed_capacity=return_consumed_capacity,
-                return_item_collection_metrics=return_item_collection_metrics)
-            self.tx._put_tx_log(self, result, 'PUT')
-            return result
-        except NotExistingItem:
-            raise NotExistingItem('Cannot update non existent item with key {}'.format(self.key))
+        """
 
-    def __delete(self, expected=None, return_values=None, return_consumed_capacity=None,
-                 return_item_collection_metrics=None):
-        return {}
+        Update item under X lock. Optimistic transaction applies updates to the item image (read at commit if
+        the item was not read) and returns {}, expected conditions are checked at commit.
+
+        """
+        if self.tx.optimistic:
+            return self.__buffer_update(update_data, expected)
+        return run(self.tx._call, self._update_steps(update_data, expected, return_consumed_capacity,
+                                                     return_item_collection_metrics))
 
+    @traced('delete', _item_trace, _item_attributes)
     def delete(self, expected=None, return_consumed_capacity=None, return_item_collection_metrics=None):
-        return_values = 'ALL_OLD'
-        try:
-            self.wait_lock(LOCK_EXCLUSIVE)
-            if expected is None:
-                expected = {}
-            expected[X_LOCK_DATA_FIELD] = dict(Value=dict(S=self.tx_uuid_str), Exists='true')
-            result = self.__delete(
-                expected=expected, return_values=return_values, return_consumed_capacity=return_consumed_capacity,
-                return_item_collection_metrics=return_item_collection_metrics)
-            self.tx._put_tx_log(self, result, 'PUT')
-            return result
-        except NotExistingItem:
-            raise NotExistingItem('Cannot delete non existent item with key {}'.format(self.key))
+        """
+
+        X lock item for deletion, the item is deleted at commit. Optimistic transaction takes no lock, it deletes
+        the item at commit and returns {}.
+
+        """
+        if self.tx.optimistic:
+            return self.__buffer_delete(expected)
+        return run(self.tx._call, self._delete_steps())
@@ -0,0 +1,132 @@
+import threading
+import uuid
+
+import simplejson as json
+
+from dynamodb2 import metrics
+from dynamodb2.metrics import CATEGORY_TX
+from dynamodb2.transaction.steps import Call, Result, Sleep, run
+
+__author__ = 'drblez'
+
+"""
+
+    Batched writer of undo (before-image) records into tx-data table.
+
+    Records are queued by Tx._put_tx_log and written with BatchWriteItem, up to 25 records per request; a single
+    queued record is written with PutItem. TxItem flushes the writer before the first write of an item, so the
+    before-image is durable before the data it restores is changed and a transaction which crashes after any write
+    can be rolled back (e.g. by recovery.Janitor).
+
+    An item has one undo record per transaction, its log_uuid is derived from the table name and the key
+    (undo_log_uuid), so a READ_COMMITTED reader finds the before-image of an item X locked by other transaction with
+    one consistent GetItem; no record means the holder has not written the item yet.
+
+"""
+
+BATCH_WRITE_MAX_ITEMS = 25
+
+UNDO_LOG_NAMESPACE = uuid.UUID('141104a6-25ad-483e-9531-32f6ef41a1d4')
+
+
+class TxLogNotWritten(Exception):
+    pass
+
+
+def undo_log_uuid(table_name, key):
+    """
+
+    @param key: Key in wire format
+    @return: log_uuid of the undo record of item in tx-data table
+    """
+    return uuid.uuid5(UNDO_LOG_NAMESPACE, json.dumps([table_name, key], sort_keys=True))
+
+
+def batch_write_steps(table_name, requests, category=CATEGORY_TX, max_retries=8, first_delay=0.05, max_delay=2,
+                      error=TxLogNotWritten):
+    """
+
+    Write requests with BatchWriteItem by chunks of 25, retrying unprocessed items with exponential backoff
+
+    @param table_name: DynamoDB table name
+    @param requests: List of {'PutRequest': ...} or {'DeleteRequest': ...}
+    @param category: Metrics category of the requests
+    @param error: Exception class raised when unprocessed items are left after max_retries
+    @return: Steps (see steps module) with result number of retries made, a measure of throttling
+    """
+    total_retries = 0
+    for n in range(0, len(requests), BATCH_WRITE_MAX_ITEMS):
+        request_items = {table_name: requests[n:n + BATCH_WRITE_MAX_ITEMS]}
+        delay = first_delay
+        retries = 0
+        while True:
+            result = yield Call(category, 'batch_write_item', request_items)
+            request_items = result.get('UnprocessedItems') or {}
+            if len(request_items) == 0:
+                break
+            retries += 1
+            total_retries += 1
+            if retries > max_retries:
+                raise error('Unprocessed items in table {} after {} retries: {}'.format(
+                    table_name, max_retries, request_items))
+            if metrics.sinks:
+                metrics.report_retry(category, 'batch_write_item', table_name, 'UnprocessedItems')
+            yield Sleep(delay)
+            delay = min(delay * 2, max_delay)
+    yield Result(total_retries)
+
+
+def batch_write(call, table_name, requests, category=CATEGORY_TX, max_retries=8, first_delay=0.05, max_delay=2,
+                error=TxLogNotWritten):
+    """
+
+    See batch_write_steps
+
+    @param call: Request function with Tx._call signature
+    @return: Number of retries made
+    """
+    return run(call, batch_write_steps(table_name, requests, category, max_retries, first_delay, max_delay, error))
+
+
+class TxLogWriter():
+    def __init__(self, tx, batch_size=BATCH_WRITE_MAX_ITEMS):
+        """
+
+        @param tx: Tx or aio.AsyncTx instance
+        @param batch_size: Queued records count which triggers flush
+        """
+        self.tx = tx
+        self.batch_size = batch_size
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, log_record):
+        """
+
+        @return: True if batch_size records are queued and the writer should be flushed
+        """
+        with self.lock:
+            self.pending.append(log_record)
+            return len(self.pending) >= self.batch_size
+
+    def flush_steps(self):
+        with self.lock:
+            records, self.pending = self.pending, []
+        if len(records) == 1:
+            yield Call(CATEGORY_TX, 'put_item', self.tx.tx_data_table_name, records[0])
+        elif len(records) > 1:
+            yield batch_write_steps(self.tx.tx_data_table_name, [dict(PutRequest=dict(Item=r)) for r in records])
+
+    def flush(self):
+        run(self.tx._call, self.flush_steps())
+
+    def discard(self):
+        """
+
+        Drop queued records, used when they are not needed any more (commit) or their items were not written
+
+        @return: List of dropped records
+        """
+        with self.lock:
+            records, self.pending = self.pending, []
+        return records
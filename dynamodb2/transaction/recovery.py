@@ -0,0 +1,354 @@
+from __future__ import print_function
+import argparse
+from datetime import datetime, timedelta
+import logging
+import sys
+import threading
+
+from boto.dynamodb2.exceptions import ConditionalCheckFailedException
+import simplejson as json
+
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.parallel import parallel_map
+from dynamodb2.transaction import TX_TABLE_NAME, TX_DATA_TABLE_NAME
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED, LOCKS_DATA_FIELD, parse_lock_token, \
+    unlock_request
+from dynamodb2.transaction.rollback import holder_expected, plan_rollback, rollback
+
+__author__ = 'drblez'
+
+"""
+
+    Recovery of abandoned transactions.
+
+    A transaction whose process died keeps its tx record START or IN-FLIGHT and its lock tokens on data items.
+    Janitor finds such records older than max_age with parallel segmented scan of tx-info table and for each of
+    them: claims the record (status RECOVERING), restores the earliest before-image of every item from the undo
+    records in tx-data table (see rollback.plan_rollback), strips the transaction lock tokens (both formats) from
+    every item of the undo log and every item of the 'tables' set of the tx record which holds them (a table is
+    added to the set before the transaction locks its first item; each table is scanned once per pass and the
+    tokens found are grouped by transaction), and marks the record ROLLBACK. Every step is conditional on the dead
+    transaction still holding the item, so a pass interrupted at any point is safely repeated by the next one.
+
+    Data tables given to Janitor are also swept for orphaned lock tokens: tokens of transactions which are
+    finished or have no tx record are removed.
+
+    creation_date is local time of the host which started the transaction, max_age must exceed the longest
+    transaction and the clock difference between hosts.
+
+        python -m dynamodb2.transaction.recovery --max-age 300 --table orders
+        python -m dynamodb2.transaction.recovery --interval 60
+
+"""
+
+STALE_STATUSES = ('START', 'IN-FLIGHT', 'RECOVERING')
+FINAL_STATUSES = ('COMMIT', 'ROLLBACK')
+DEFAULT_MAX_AGE = 300
+DEFAULT_SEGMENTS = 4
+
+logger = logging.getLogger('recovery')
+logger.addHandler(logging.NullHandler())
+
+
+class Janitor():
+    def __init__(self, connection=None, tx_table_name=TX_TABLE_NAME, tx_data_table_name=TX_DATA_TABLE_NAME,
+                 max_age=DEFAULT_MAX_AGE, segments=DEFAULT_SEGMENTS, tables=None, backend=None):
+        """
+
+        @param connection: AWSDynamoDB2Connection instance, new one if None
+        @param max_age: Age (sec.) of a START/IN-FLIGHT transaction considered abandoned
+        @param segments: Parallel scan segments
+        @param tables: Data table names swept for orphaned lock tokens, none if None
+        @param backend: Low level DynamoDB backend used instead of AWS if connection is None
+        """
+        if connection is None:
+            connection = AWSDynamoDB2Connection(backend=backend)
+        self.connection = connection
+        self.tx_table_name = tx_table_name
+        self.tx_data_table_name = tx_data_table_name
+        self.max_age = max_age
+        self.segments = segments
+        self.tables = [] if tables is None else list(tables)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __cutoff(self):
+        return (datetime.now() - timedelta(seconds=self.max_age)).isoformat()
+
+    def __scan(self, table_name, scan_filter):
+        """
+
+        Parallel segmented scan
+
+        @return: List of items
+        """
+        def scan_segment(segment):
+            items = []
+            exclusive_start_key = None
+            while True:
+                result = self.connection.connection.scan(table_name, scan_filter=scan_filter,
+                                                         total_segments=self.segments, segment=segment,
+                                                         exclusive_start_key=exclusive_start_key)
+                items.extend(result.get('Items', []))
+                exclusive_start_key = result.get('LastEvaluatedKey')
+                if exclusive_start_key is None:
+                    return items
+        items = []
+        for segment_items in parallel_map(scan_segment, range(self.segments)):
+            items.extend(segment_items)
+        return items
+
+    def find_stale(self):
+        """
+
+        @return: Tx records START, IN-FLIGHT or RECOVERING created more than max_age ago
+        """
+        scan_filter = {
+            'status': {'AttributeValueList': [{'S': s} for s in STALE_STATUSES], 'ComparisonOperator': 'IN'},
+            'creation_date': {'AttributeValueList': [{'S': self.__cutoff()}], 'ComparisonOperator': 'LT'}
+        }
+        return self.__scan(self.tx_table_name, scan_filter)
+
+    def __set_status(self, tx_uuid, status, expected_status=None):
+        expected = {'tx_uuid': {'Value': {'S': tx_uuid}, 'Exists': 'true'}}
+        if not expected_status is None:
+            expected['status'] = {'Value': {'S': expected_status}, 'Exists': 'true'}
+        try:
+            self.connection.connection.update_item(self.tx_table_name, {'tx_uuid': {'S': tx_uuid}},
+                                                   {'status': {'Action': 'PUT', 'Value': {'S': status}}},
+                                                   expected=expected)
+        except ConditionalCheckFailedException:
+            return False
+        return True
+
+    def undo_records(self, tx_uuid):
+        """
+
+        @return: Undo records of transaction, oldest first
+        """
+        key_conditions = {'tx_uuid': {'AttributeValueList': [{'S': tx_uuid}], 'ComparisonOperator': 'EQ'}}
+        records = []
+        exclusive_start_key = None
+        while True:
+            result = self.connection.connection.query(self.tx_data_table_name, key_conditions,
+                                                      index_name='creation_date-index', consistent_read=True,
+                                                      exclusive_start_key=exclusive_start_key)
+            records.extend(result.get('Items', []))
+            exclusive_start_key = result.get('LastEvaluatedKey')
+            if exclusive_start_key is None:
+                return records
+
+    def __call(self, category, operation, *args, **kwargs):
+        return getattr(self.connection.connection, operation)(*args, **kwargs)
+
+    def strip_locks(self, table_name, key, tx_uuid):
+        """
+
+        Remove lock tokens of transaction from item: X lock if the transaction holds it, S tokens otherwise
+
+        @return: True if tokens were removed
+        """
+        for lock_state in (LOCK_EXCLUSIVE, LOCK_SHARED):
+            attribute_updates, expected = unlock_request(tx_uuid, lock_state)
+            if expected is None:
+                expected = dict((k, dict(Value=v, Exists='true')) for k, v in key.items())
+            try:
+                self.connection.connection.update_item(table_name, key, attribute_updates, expected=expected)
+                return True
+            except ConditionalCheckFailedException:
+                pass
+        return False
+
+    def lock_holders(self, table_name):
+        """
+
+        @return: {tx_uuid: [key, ...]} keys of items of table_name with lock tokens of every transaction, found by
+        one parallel scan
+        """
+        scan_filter = {LOCKS_DATA_FIELD: {'ComparisonOperator': 'NOT_NULL'}}
+        key_names = self.connection.get_key_schema(table_name).key_names
+        holders = {}
+        for item in self.__scan(table_name, scan_filter):
+            key = dict((k, item[k]) for k in key_names)
+            for tx_uuid in set(parse_lock_token(token)[0] for token in item[LOCKS_DATA_FIELD]['SS']):
+                holders.setdefault(tx_uuid, []).append(key)
+        return holders
+
+    def claim(self, tx_record):
+        """
+
+        Mark abandoned transaction RECOVERING
+
+        @param tx_record: Tx record found by find_stale()
+        @return: Current tx record (the scanned one may miss the last 'tables' appends), None if the transaction
+        changed status meanwhile
+        """
+        tx_uuid = tx_record['tx_uuid']['S']
+        status = tx_record['status']['S']
+        if status != 'RECOVERING' and not self.__set_status(tx_uuid, 'RECOVERING', status):
+            return None
+        logger.info('Recover transaction %s (%s), status %s', tx_uuid, tx_record.get('tx_name', {}).get('S'), status)
+        result = self.connection.connection.get_item(self.tx_table_name, {'tx_uuid': {'S': tx_uuid}},
+                                                     consistent_read=True)
+        return result.get('Item', tx_record)
+
+    def recover(self, tx_record, holders=None):
+        """
+
+        Roll back abandoned transaction and release its locks
+
+        @param tx_record: Tx record found by find_stale()
+        @param holders: {table name: lock_holders(table name)} of tables already scanned, other tables of the tx
+        record are scanned
+        @return: True if the transaction was rolled back, False if it changed status meanwhile
+        """
+        tx_record = self.claim(tx_record)
+        if tx_record is None:
+            return False
+        self.__roll_back(tx_record, holders)
+        return True
+
+    def __roll_back(self, tx_record, holders=None):
+        """
+
+        Restore items of claimed transaction from its undo records, strip its lock tokens, mark it ROLLBACK
+
+        """
+        tx_uuid = tx_record['tx_uuid']['S']
+        records = self.undo_records(tx_uuid)
+        rollback(self.__call, plan_rollback(records), holder_expected(tx_uuid))
+        items = set()
+        for log_record in records:
+            items.add((log_record['table']['S'], json.dumps(json.loads(log_record['key']['S']), sort_keys=True)))
+        for table_name in tx_record.get('tables', {}).get('SS', []):
+            if holders is None or not table_name in holders:
+                table_holders = self.lock_holders(table_name)
+            else:
+                table_holders = holders[table_name]
+            for key in table_holders.get(tx_uuid, []):
+                items.add((table_name, json.dumps(key, sort_keys=True)))
+        parallel_map(lambda i: self.strip_locks(i[0], json.loads(i[1]), tx_uuid), sorted(items))
+        self.__set_status(tx_uuid, 'ROLLBACK')
+
+    def __holder_status(self, tx_uuid, statuses):
+        if not tx_uuid in statuses:
+            result = self.connection.connection.get_item(self.tx_table_name, {'tx_uuid': {'S': tx_uuid}},
+                                                         consistent_read=True)
+            statuses[tx_uuid] = result.get('Item')
+        return statuses[tx_uuid]
+
+    def sweep(self, table_name):
+        """
+
+        Remove lock tokens of transactions created more than max_age ago which are finished or have no tx record
+
+        @return: Number of items unlocked
+        """
+        scan_filter = {LOCKS_DATA_FIELD: {'ComparisonOperator': 'NOT_NULL'}}
+        key_names = self.connection.get_key_schema(table_name).key_names
+        cutoff = self.__cutoff()
+        statuses = {}
+        unlocked = 0
+        for item in self.__scan(table_name, scan_filter):
+            key = dict((k, item[k]) for k in key_names)
+            holders = set(parse_lock_token(token)[0] for token in item[LOCKS_DATA_FIELD]['SS'])
+            for tx_uuid in sorted(holders):
+                tx_record = self.__holder_status(tx_uuid, statuses)
+                if not tx_record is None and (not tx_record['status']['S'] in FINAL_STATUSES or
+                                              tx_record['creation_date']['S'] >= cutoff):
+                    continue
+                logger.info('Remove orphaned lock of transaction %s from %s %s', tx_uuid, table_name, key)
+                if self.strip_locks(table_name, key, tx_uuid):
+                    unlocked += 1
+        return unlocked
+
+    def run_once(self):
+        """
+
+        One recovery pass: claim stale transactions, scan every table they locked once, roll them back, then sweep
+        data tables
+
+        @return: {'recovered': number of transactions rolled back, 'unlocked': number of orphaned locks removed}
+        """
+        claimed = [r for r in parallel_map(self.__try_claim, self.find_stale()) if not r is None]
+        holders = {}
+        for tx_record in claimed:
+            for table_name in tx_record.get('tables', {}).get('SS', []):
+                if not table_name in holders:
+                    holders[table_name] = self.lock_holders(table_name)
+        recovered = sum(1 for r in parallel_map(lambda r: self.__try_roll_back(r, holders), claimed) if r)
+        unlocked = 0
+        for table_name in self.tables:
+            unlocked += self.sweep(table_name)
+        return {'recovered': recovered, 'unlocked': unlocked}
+
+    def __try_claim(self, tx_record):
+        try:
+            return self.claim(tx_record)
+        except Exception:
+            logger.exception('Recovery of transaction %s failed', tx_record['tx_uuid']['S'])
+            return None
+
+    def __try_roll_back(self, tx_record, holders):
+        try:
+            self.__roll_back(tx_record, holders)
+            return True
+        except Exception:
+            logger.exception('Recovery of transaction %s failed', tx_record['tx_uuid']['S'])
+            return False
+
+    def start(self, interval=60):
+        """
+
+        Run recovery passes every interval sec. in a background daemon thread until stop()
+
+        """
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.__loop, args=(interval,), name='tx-recovery')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if not self.thread is None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def __loop(self, interval):
+        while not self.stopped.is_set():
+            try:
+                result = self.run_once()
+                logger.info('Recovery pass: %s', result)
+            except Exception:
+                logger.exception('Recovery pass failed')
+            self.stopped.wait(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m dynamodb2.transaction.recovery',
+                                     description='Roll back abandoned transactions and remove their locks')
+    parser.add_argument('--max-age', type=float, default=DEFAULT_MAX_AGE,
+                        help='Age (sec.) of unfinished transaction considered abandoned')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS, help='Parallel scan segments')
+    parser.add_argument('--tx-table', default=TX_TABLE_NAME, help='Transactions info table name')
+    parser.add_argument('--tx-data-table', default=TX_DATA_TABLE_NAME, help='Transactions data table name')
+    parser.add_argument('--table', action='append', help='Data table swept for orphaned locks, may be repeated')
+    parser.add_argument('--interval', type=float, help='Repeat every interval sec. instead of one pass')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    janitor = Janitor(tx_table_name=args.tx_table, tx_data_table_name=args.tx_data_table, max_age=args.max_age,
+                      segments=args.segments, tables=args.table)
+    if args.interval is None:
+        print(janitor.run_once())
+        return 0
+    janitor.start(args.interval)
+    try:
+        while janitor.thread.is_alive():
+            janitor.thread.join(1)
+    except KeyboardInterrupt:
+        janitor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
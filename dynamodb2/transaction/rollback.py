@@ -0,0 +1,145 @@
+from boto.dynamodb2.exceptions import ConditionalCheckFailedException
+from boto.exception import JSONResponseError
+import simplejson as json
+
+from dynamodb2 import metrics
+from dynamodb2.metrics import CATEGORY_DATA
+from dynamodb2.transaction.item import X_LOCK_DATA_FIELD
+from dynamodb2.transaction.steps import Call, Result, Sleep, all_steps, run
+
+__author__ = 'drblez'
+
+"""
+
+    Rollback planner.
+
+    The undo log keeps a before-image for every write, but only the earliest before-image of an item is its state
+    before the transaction. plan_rollback() groups undo records by (table, key) and keeps one restore step per
+    item; rollback() applies the steps concurrently on the shared thread pool. Every restore is conditional on
+    the transaction still holding the X lock of the item, so a rollback interrupted by a crash can be repeated
+    (e.g. by recovery.Janitor) without touching items released meanwhile. Throttled requests are retried with
+    exponential backoff.
+
+"""
+
+RESTORE_PUT = 'PUT'
+RESTORE_DELETE = 'DELETE'
+
+RETRYABLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'InternalServerError',
+                    'ServiceUnavailable')
+
+
+class RollbackStep():
+    def __init__(self, table_name, key, operation, item=None):
+        """
+
+        @param operation: RESTORE_PUT (put item) or RESTORE_DELETE (delete key)
+        @param item: Before-image for RESTORE_PUT
+        """
+        self.table_name = table_name
+        self.key = key
+        self.operation = operation
+        self.item = item
+
+
+def plan_rollback(log_records):
+    """
+
+    @param log_records: Undo records of one transaction in any order, e.g. Tx.tx_log or records queried from
+    tx-data table
+    @return: List of RollbackStep, one per item, restoring the earliest before-image. Records of writes which did
+    not change the item (PUT without 'Attributes') are skipped.
+    """
+    ordered = sorted(enumerate(log_records), key=lambda r: (r[1]['creation_date']['S'], r[0]))
+    steps = {}
+    order = []
+    for _, log_record in ordered:
+        table_name = log_record['table']['S']
+        key = json.loads(log_record['key']['S'])
+        item_key = (table_name, json.dumps(key, sort_keys=True))
+        if item_key in steps:
+            continue
+        operation = log_record['operation']['S']
+        if operation == 'DELETE':
+            steps[item_key] = RollbackStep(table_name, key, RESTORE_DELETE)
+        elif operation == 'PUT' and 'data' in log_record:
+            attributes = json.loads(log_record['data']['S']).get('Attributes')
+            if attributes is None:
+                continue
+            steps[item_key] = RollbackStep(table_name, key, RESTORE_PUT, attributes)
+        else:
+            continue
+        order.append(item_key)
+    return [steps[k] for k in order]
+
+
+def holder_expected(tx_uuid_str):
+    """
+
+    @return: Expected condition of restore requests: the item is X locked by the transaction
+    """
+    return {X_LOCK_DATA_FIELD: {'Value': {'S': tx_uuid_str}, 'Exists': 'true'}}
+
+
+def restore_steps(step, expected, max_retries=8, first_delay=0.05, max_delay=2):
+    """
+
+    Apply one RollbackStep, retrying throttled requests
+
+    @return: Steps (see steps module) with result True if restored, False if the condition failed (the item is not
+    held any more)
+    """
+    delay = first_delay
+    retries = 0
+    while True:
+        try:
+            if step.operation == RESTORE_PUT:
+                yield Call(CATEGORY_DATA, 'put_item', step.table_name, step.item, expected=expected)
+            else:
+                yield Call(CATEGORY_DATA, 'delete_item', step.table_name, step.key, expected=expected)
+            yield Result(True)
+        except ConditionalCheckFailedException:
+            yield Result(False)
+        except JSONResponseError as e:
+            retries += 1
+            if not e.error_code in RETRYABLE_ERRORS or retries > max_retries:
+                raise
+            if metrics.sinks:
+                operation = 'put_item' if step.operation == RESTORE_PUT else 'delete_item'
+                metrics.report_retry(CATEGORY_DATA, operation, step.table_name, e.error_code)
+        yield Sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+def restore(call, step, expected, max_retries=8, first_delay=0.05, max_delay=2):
+    """
+
+    See restore_steps
+
+    @param call: Request function with Tx._call signature
+    """
+    return run(call, restore_steps(step, expected, max_retries, first_delay, max_delay))
+
+
+def rollback_steps(steps, expected=None, max_retries=8):
+    """
+
+    Apply steps concurrently. The first error is raised after every step is tried.
+
+    @param steps: List of RollbackStep
+    @param expected: Condition of every restore request, see holder_expected()
+    @return: Steps (see steps module) with result number of items restored
+    """
+    results = yield all_steps([restore_steps(s, expected, max_retries) for s in steps])
+    yield Result(sum(1 for result in results if result))
+
+
+def rollback(call, steps, expected=None, max_retries=8):
+    """
+
+    See rollback_steps
+
+    @param call: Request function with Tx._call signature
+    @return: Number of items restored
+    """
+    return run(call, rollback_steps(steps, expected, max_retries))
@@ -0,0 +1,142 @@
+import threading
+from time import sleep
+
+from dynamodb2.parallel import parallel_try_map
+
+__author__ = 'drblez'
+
+"""
+
+    Request steps shared by Tx/TxItem and their asyncio variants (see aio).
+
+    Protocol logic (lock requests, undo log, tx record, rollback) is written once, as generators which yield what
+    they need instead of doing it: Call (one low level request, its result is sent back), Sleep, Parallel (step
+    generators run concurrently, [(success, result)] is sent back as by parallel_try_map), Shared (steps run once
+    for concurrent callers) or another step generator (run to its end, its result is sent back). Errors are raised
+    inside the generator at the yield. A generator ends with Result(value) (Python 2 generators cannot return a
+    value), or without one for None.
+
+        def read_steps(table_name, key):
+            result = yield Call(CATEGORY_DATA, 'get_item', table_name, key, consistent_read=True)
+            yield Result(result.get('Item'))
+
+        item = run(tx._call, read_steps('users', key))
+
+    run() is the blocking driver, Parallel runs on the shared thread pool; aio.run() is the asyncio driver.
+
+"""
+
+
+class Call():
+    def __init__(self, category, operation, *args, **kwargs):
+        """
+
+        @param category: metrics.CATEGORY_DATA, CATEGORY_LOCK or CATEGORY_TX
+        @param operation: Low level connection method name, e.g. 'update_item'
+        """
+        self.category = category
+        self.operation = operation
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Sleep():
+    def __init__(self, delay):
+        self.delay = delay
+
+
+class Parallel():
+    def __init__(self, steps):
+        """
+
+        @param steps: List of step generators
+        """
+        self.steps = steps
+
+
+class Once():
+    def __init__(self):
+        """
+
+        Marker of steps which must run once, see Shared. Drivers keep here the lock (run) or the future (aio.run)
+        of the first run.
+
+        """
+        self.lock = threading.Lock()
+        self.future = None
+        self.done = False
+
+
+class Shared():
+    def __init__(self, once, steps):
+        """
+
+        Run steps unless they are done for once. Concurrent requests wait for the first one, which shares its
+        error, and the next request runs the steps again. None is sent back.
+
+        @param once: Once instance
+        @param steps: Step generator, left unused if steps are done
+        """
+        self.once = once
+        self.steps = steps
+
+
+class Result():
+    def __init__(self, value):
+        self.value = value
+
+
+def all_steps(steps):
+    """
+
+    Run steps concurrently, the first error is raised after every step is finished
+
+    @return: List of results
+    """
+    results = yield Parallel(steps)
+    for success, result in results:
+        if not success:
+            raise result
+    yield Result([result for _, result in results])
+
+
+def run(call, steps):
+    """
+
+    Blocking driver
+
+    @param call: Request function with Tx._call signature
+    @param steps: Step generator
+    @return: Value of its Result, None if it ends without one
+    """
+    value = None
+    error = None
+    while True:
+        try:
+            if error is None:
+                request = steps.send(value)
+            else:
+                request = steps.throw(error)
+        except StopIteration:
+            return None
+        if isinstance(request, Result):
+            steps.close()
+            return request.value
+        value = None
+        error = None
+        try:
+            if isinstance(request, Call):
+                value = call(request.category, request.operation, *request.args, **request.kwargs)
+            elif isinstance(request, Sleep):
+                sleep(request.delay)
+            elif isinstance(request, Parallel):
+                value = parallel_try_map(lambda s: run(call, s), request.steps)
+            elif isinstance(request, Shared):
+                with request.once.lock:
+                    if not request.once.done:
+                        run(call, request.steps)
+                        request.once.done = True
+            else:
+                value = run(call, request)
+        except Exception as e:
+            error = e
@@ -0,0 +1,113 @@
+import random
+import threading
+
+__author__ = 'drblez'
+
+"""
+
+    Lock wait strategies for TxItem.wait_lock.
+
+    A strategy only tells how long to sleep before the next lock attempt; the wait budget is a deadline owned by
+    wait_lock. Every contended wait is described by LockWait and passed to registered listeners, so hot keys and
+    their holders can be found.
+
+"""
+
+
+class WaitStrategy():
+    def delay(self, attempt, tx_item):
+        """
+
+        @param attempt: Number of failed lock attempts, starting from 1
+        @param tx_item: TxItem waiting for lock
+        @return: Seconds to sleep before next attempt
+        """
+        raise NotImplementedError()
+
+
+class FixedWait(WaitStrategy):
+    def __init__(self, wait_time=0.1):
+        self.wait_time = wait_time
+
+    def delay(self, attempt, tx_item):
+        return self.wait_time
+
+
+class ExponentialBackoff(WaitStrategy):
+    def __init__(self, base=0.01, cap=0.5, jitter=True):
+        """
+
+        Exponential backoff with full jitter: sleep is uniform in [0, min(cap, base * 2 ** attempt)]
+
+        """
+        self.base = base
+        self.cap = cap
+        self.jitter = jitter
+
+    def _cap(self, tx_item):
+        return self.cap
+
+    def delay(self, attempt, tx_item):
+        delay = min(self._cap(tx_item), self.base * 2 ** min(attempt, 32))
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+
+class AgeFairBackoff(ExponentialBackoff):
+    def __init__(self, base=0.01, cap=0.5, jitter=True, age_horizon=1.0):
+        """
+
+        Older transactions and transactions with higher Tx.priority back off for shorter time, so under contention
+        a lock tends to go to the transaction waiting longest
+
+        @param age_horizon: Tx age (sec.) which halves the backoff cap
+        """
+        ExponentialBackoff.__init__(self, base, cap, jitter)
+        self.age_horizon = age_horizon
+
+    def _cap(self, tx_item):
+        tx = tx_item.tx
+        return self.cap / (1.0 + tx.age() / self.age_horizon + max(tx.priority, 0))
+
+
+class LockWait():
+    def __init__(self, tx_item, lock_state, attempts, wait_time, holders, acquired):
+        self.tx_uuid = tx_item.tx_uuid_str
+        self.table_name = tx_item.table_name
+        self.key = tx_item.key
+        self.lock_state = lock_state
+        self.attempts = attempts
+        self.wait_time = wait_time
+        self.holders = holders
+        self.acquired = acquired
+
+    def __repr__(self):
+        return 'LockWait(table={}, key={}, lock={}, attempts={}, wait_time={:.3f}, holders={}, acquired={})'.format(
+            self.table_name, self.key, self.lock_state, self.attempts, self.wait_time, self.holders, self.acquired)
+
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+def add_lock_wait_listener(listener):
+    """
+
+    @param listener: Callable(LockWait) called after every contended lock wait
+    """
+    with _listeners_lock:
+        _listeners.append(listener)
+
+
+def remove_lock_wait_listener(listener):
+    with _listeners_lock:
+        _listeners.remove(listener)
+
+
+def notify_lock_wait(lock_wait):
+    for listener in list(_listeners):
+        listener(lock_wait)
+
+
+DEFAULT_WAIT_STRATEGY = ExponentialBackoff()
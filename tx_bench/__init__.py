@@ -0,0 +1,365 @@
+from __future__ import print_function
+import random
+import threading
+from time import sleep, time
+
+from dynamodb2.backend.memory import MemoryBackend
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import Tx, TxConflict, ISOLATION_LEVEL_FULL_LOCK, TX_MODE_OPTIMISTIC
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED
+
+__author__ = 'drblez'
+
+"""
+
+    Transaction throughput and latency benchmark.
+
+    Workloads drive Tx/TxItem against MemoryBackend with simulated round trip time (rtt) and report transactions
+    per second, latency percentiles, round trips per transaction (tx.calls) and lock wait time (tx.lock_waits).
+    Results are plain dicts saved as JSON; compare() finds round trip regressions against a saved baseline.
+    run_contention() compares lock and optimistic modes on the same update workload over shrinking key spaces.
+
+        python -m tx_bench --rtt 0.002 --output results.json --baseline baseline.json
+        python -m tx_bench --contention
+
+"""
+
+BENCH_TABLE_NAME = 'tx-bench'
+HOT_KEY = 'hot'
+MAX_LOCK_WAIT = 60
+MAX_CONFLICTS = 100
+# (level name, key space size) of run_contention, every transaction updates 2 random keys of the key space
+CONTENTION_LEVELS = (('low', 1000), ('medium', 16), ('high', 2))
+
+
+def make_backend(rtt=0.0, items=100, seed=None):
+    """
+
+    @param rtt: Simulated round trip time (sec.) of every DynamoDB call
+    @param items: Number of items preloaded into bench table, keys are '0' .. str(items - 1) and HOT_KEY
+    @return: MemoryBackend instance
+    """
+    backend = MemoryBackend(seed=seed)
+    backend.create_table([dict(AttributeName='id', AttributeType='S')], BENCH_TABLE_NAME,
+                         [dict(AttributeName='id', KeyType='HASH')],
+                         dict(ReadCapacityUnits=5, WriteCapacityUnits=5))
+    for n in range(items):
+        backend.put_item(BENCH_TABLE_NAME, Field('id', str(n)).field('counter', 0).dict())
+    backend.put_item(BENCH_TABLE_NAME, Field('id', HOT_KEY).field('counter', 0).dict())
+    # Tables are created without latency, every call made by transactions pays rtt
+    backend.latency = rtt
+    return backend
+
+
+def _key(worker, n, items):
+    return str((worker * 7919 + n) % items)
+
+
+def single_put(backend, worker, n, items):
+    tx = Tx('bench single put', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, _key(worker, n, items))
+    tx_item.put(Field('counter', n).field('worker', worker).dict())
+    tx.commit()
+    return tx
+
+
+def read_modify_write(backend, worker, n, items):
+    tx = Tx('bench read modify write', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, _key(worker, n * 3 + i, items)) for i in range(3)]
+    tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=MAX_LOCK_WAIT)
+    for tx_item in tx_items:
+        tx_item.get()
+        tx_item.update(Update('counter').add(1).dict())
+    tx.commit()
+    return tx
+
+
+def shared_read(backend, worker, n, items):
+    tx = Tx('bench shared read', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, str(i)) for i in range(3)]
+    tx.lock_all(tx_items, LOCK_SHARED, max_wait_time=MAX_LOCK_WAIT)
+    for tx_item in tx_items:
+        tx_item.get()
+    tx.commit()
+    return tx
+
+
+def hot_key(backend, worker, n, items):
+    tx = Tx('bench hot key', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, HOT_KEY)
+    tx_item.wait_lock(LOCK_EXCLUSIVE, max_wait_time=MAX_LOCK_WAIT)
+    tx_item.update(Update('counter').add(1).dict())
+    tx.commit()
+    return tx
+
+
+def rollback_heavy(backend, worker, n, items):
+    tx = Tx('bench rollback', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, _key(worker, n * 2 + i, items)) for i in range(2)]
+    tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=MAX_LOCK_WAIT)
+    for tx_item in tx_items:
+        tx_item.update(Update('counter').add(1).dict())
+    tx.rollback()
+    return tx
+
+
+def _optimistic(name, backend, body):
+    """
+
+    Run body(tx) in optimistic transactions until commit succeeds, with jittered backoff after conflicts
+
+    @return: (committed Tx, list of conflicted Tx)
+    """
+    conflicted = []
+    while True:
+        tx = Tx(name, ISOLATION_LEVEL_FULL_LOCK, backend=backend, mode=TX_MODE_OPTIMISTIC)
+        body(tx)
+        try:
+            tx.commit()
+            return tx, conflicted
+        except TxConflict:
+            conflicted.append(tx)
+            if len(conflicted) >= MAX_CONFLICTS:
+                raise
+            sleep(random.uniform(0, min(0.5, 0.002 * 2 ** len(conflicted))))
+
+
+def optimistic_single_put(backend, worker, n, items):
+    def body(tx):
+        tx.get_item(BENCH_TABLE_NAME, _key(worker, n, items)).put(Field('counter', n).field('worker', worker).dict())
+    return _optimistic('bench optimistic single put', backend, body)
+
+
+def optimistic_read_modify_write(backend, worker, n, items):
+    def body(tx):
+        for i in range(3):
+            tx_item = tx.get_item(BENCH_TABLE_NAME, _key(worker, n * 3 + i, items))
+            tx_item.get()
+            tx_item.update(Update('counter').add(1).dict())
+    return _optimistic('bench optimistic read modify write', backend, body)
+
+
+def optimistic_hot_key(backend, worker, n, items):
+    def body(tx):
+        tx_item = tx.get_item(BENCH_TABLE_NAME, HOT_KEY)
+        tx_item.get()
+        tx_item.update(Update('counter').add(1).dict())
+    return _optimistic('bench optimistic hot key', backend, body)
+
+
+def _contended_keys(items):
+    return random.sample(range(items), 2)
+
+
+def contended_update_lock(backend, worker, n, items):
+    tx = Tx('bench contended update', ISOLATION_LEVEL_FULL_LOCK, backend=backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, str(k)) for k in _contended_keys(items)]
+    tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=MAX_LOCK_WAIT)
+    for tx_item in tx_items:
+        tx_item.get()
+        tx_item.update(Update('counter').add(1).dict())
+    tx.commit()
+    return tx
+
+
+def contended_update_optimistic(backend, worker, n, items):
+    keys = _contended_keys(items)
+
+    def body(tx):
+        for k in keys:
+            tx_item = tx.get_item(BENCH_TABLE_NAME, str(k))
+            tx_item.get()
+            tx_item.update(Update('counter').add(1).dict())
+    return _optimistic('bench contended update', backend, body)
+
+
+WORKLOADS = [
+    ('single_put', single_put),
+    ('read_modify_write', read_modify_write),
+    ('shared_read', shared_read),
+    ('hot_key', hot_key),
+    ('rollback_heavy', rollback_heavy),
+    ('optimistic_single_put', optimistic_single_put),
+    ('optimistic_read_modify_write', optimistic_read_modify_write),
+    ('optimistic_hot_key', optimistic_hot_key)
+]
+
+CONTENTION_WORKLOADS = [
+    ('lock', contended_update_lock),
+    ('optimistic', contended_update_optimistic)
+]
+
+
+def percentile(values, p):
+    """
+
+    @param values: Sorted list of numbers
+    @param p: Percentile, 0 .. 100
+    @return: Nearest rank percentile, 0 for empty list
+    """
+    if len(values) == 0:
+        return 0
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+def run_workload(name, workload, rtt=0.0, transactions=100, concurrency=4, items=100):
+    """
+
+    Run workload in concurrency threads, every thread runs transactions / concurrency transactions on own
+    fresh backend copy shared by all threads of this workload. Requests of conflicted attempts are counted in
+    the round trips of the transaction.
+
+    @param workload: Callable(backend, worker, n, items) -> finished Tx or (committed Tx, list of conflicted Tx)
+    @return: Result dict
+    """
+    backend = make_backend(rtt, items)
+    per_worker = max(1, transactions // concurrency)
+    samples = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(w):
+        for n in range(per_worker):
+            started = time()
+            try:
+                tx = workload(backend, w, n, items)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            latency = time() - started
+            conflicted = []
+            if isinstance(tx, tuple):
+                tx, conflicted = tx
+            calls = dict(tx.calls)
+            for c in conflicted:
+                for k, v in c.calls.items():
+                    calls[k] = calls.get(k, 0) + v
+            with lock:
+                samples.append((latency, calls, sum(lw.wait_time for lw in tx.lock_waits), len(conflicted)))
+
+    backend.reset_calls()
+    threads = [threading.Thread(target=worker, args=(w,)) for w in range(concurrency)]
+    started = time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time() - started
+    count = len(samples)
+    latencies = sorted(s[0] for s in samples)
+    round_trips = [sum(s[1].values()) for s in samples]
+    calls = {}
+    for s in samples:
+        for (category, operation), v in s[1].items():
+            label = category + ':' + operation
+            calls[label] = calls.get(label, 0) + v
+    lock_wait_time = sum(s[2] for s in samples)
+    conflicts = sum(s[3] for s in samples)
+    return {
+        'workload': name,
+        'rtt': rtt,
+        'concurrency': concurrency,
+        'transactions': count,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'elapsed': elapsed,
+        'tps': count / elapsed if elapsed > 0 else 0,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_p99': percentile(latencies, 99),
+        'round_trips_per_tx': float(sum(round_trips)) / count if count > 0 else 0,
+        'round_trips_min': min(round_trips) if count > 0 else 0,
+        'backend_calls_per_tx': float(sum(backend.calls.values())) / count if count > 0 else 0,
+        'calls_per_tx': dict((k, float(v) / count) for k, v in calls.items()) if count > 0 else {},
+        'lock_wait_time': lock_wait_time,
+        'lock_wait_per_tx': lock_wait_time / count if count > 0 else 0,
+        'conflicts': conflicts,
+        'conflicts_per_tx': float(conflicts) / count if count > 0 else 0
+    }
+
+
+def run(names=None, rtt=0.0, transactions=100, concurrency=4, items=100):
+    """
+
+    @param names: Workload names to run, all WORKLOADS if None
+    @return: {workload name: result dict}
+    """
+    results = {}
+    for name, workload in WORKLOADS:
+        if names is None or name in names:
+            results[name] = run_workload(name, workload, rtt, transactions, concurrency, items)
+    return results
+
+
+def run_contention(rtt=0.0, transactions=100, concurrency=4, levels=CONTENTION_LEVELS):
+    """
+
+    Run CONTENTION_WORKLOADS (the same 2 item update in lock and optimistic mode) at every contention level
+
+    @param levels: List of (level name, key space size)
+    @return: {level name: {mode: result dict}}
+    """
+    results = {}
+    for level, items in levels:
+        results[level] = dict((mode, run_workload(mode, workload, rtt, transactions, concurrency, items))
+                              for mode, workload in CONTENTION_WORKLOADS)
+    return results
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+
+    Round trip regression check. Uncontended cost (round_trips_min) must not grow at all, mean round trips per
+    transaction may grow by tolerance because contended workloads retry locks.
+
+    @param results: run() result
+    @param baseline: run() result saved earlier
+    @param tolerance: Allowed relative growth of round_trips_per_tx
+    @return: List of regression descriptions, empty if none
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['round_trips_min'] > base['round_trips_min']:
+            regressions.append('{}: round_trips_min {} > baseline {}'.format(
+                name, result['round_trips_min'], base['round_trips_min']))
+        if result['round_trips_per_tx'] > base['round_trips_per_tx'] * (1 + tolerance):
+            regressions.append('{}: round_trips_per_tx {:.2f} > baseline {:.2f} (+{:.0%})'.format(
+                name, result['round_trips_per_tx'], base['round_trips_per_tx'], tolerance))
+        if result['errors'] > 0:
+            regressions.append('{}: {} failed transactions'.format(name, result['errors']))
+    return regressions
+
+
+def format_results(results):
+    lines = [_RESULT_HEADER.format('workload', 'tps', 'p50 ms', 'p95 ms', 'p99 ms', 'rt/tx', 'rt min',
+                                   'wait ms/tx', 'cfl/tx')]
+    for name, _ in WORKLOADS:
+        r = results.get(name)
+        if r is not None:
+            lines.append(_format_result(name, r))
+    return '\n'.join(lines)
+
+
+def format_contention(results):
+    lines = [_RESULT_HEADER.format('level / mode', 'tps', 'p50 ms', 'p95 ms', 'p99 ms', 'rt/tx', 'rt min',
+                                   'wait ms/tx', 'cfl/tx')]
+    for level, items in CONTENTION_LEVELS:
+        for mode, _ in CONTENTION_WORKLOADS:
+            r = results.get(level, {}).get(mode)
+            if r is not None:
+                lines.append(_format_result('{} ({}) {}'.format(level, items, mode), r))
+    return '\n'.join(lines)
+
+
+_RESULT_HEADER = '{:<28} {:>8} {:>9} {:>9} {:>9} {:>8} {:>6} {:>10} {:>7}'
+
+
+def _format_result(name, r):
+    return '{:<28} {:>8.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8.2f} {:>6} {:>10.2f} {:>7.2f}'.format(
+        name, r['tps'], r['latency_p50'] * 1000, r['latency_p95'] * 1000, r['latency_p99'] * 1000,
+        r['round_trips_per_tx'], r['round_trips_min'], r['lock_wait_per_tx'] * 1000, r.get('conflicts_per_tx', 0))
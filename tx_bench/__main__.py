@@ -0,0 +1,51 @@
+from __future__ import print_function
+import argparse
+import sys
+
+import simplejson as json
+
+from tx_bench import WORKLOADS, compare, format_contention, format_results, run, run_contention
+
+__author__ = 'drblez'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tx_bench', description='Transaction benchmark')
+    parser.add_argument('--rtt', type=float, default=0.001, help='Simulated round trip time, sec.')
+    parser.add_argument('--transactions', type=int, default=200, help='Transactions per workload')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client threads per workload')
+    parser.add_argument('--items', type=int, default=100, help='Items in bench table')
+    parser.add_argument('--workload', action='append', choices=[name for name, _ in WORKLOADS],
+                        help='Workload to run, may be repeated, all by default')
+    parser.add_argument('--output', help='Save results as JSON')
+    parser.add_argument('--baseline', help='Fail if round trips per tx regress against this JSON')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative growth of mean round trips per tx')
+    parser.add_argument('--contention', action='store_true',
+                        help='Compare lock and optimistic modes at several contention levels instead')
+    args = parser.parse_args(argv)
+    if args.contention:
+        results = run_contention(args.rtt, args.transactions, args.concurrency)
+        print(format_contention(results))
+        if not args.output is None:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+    results = run(args.workload, args.rtt, args.transactions, args.concurrency, args.items)
+    print(format_results(results))
+    if not args.output is None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if not args.baseline is None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if len(regressions) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
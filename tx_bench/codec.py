@@ -0,0 +1,180 @@
+from __future__ import print_function
+import argparse
+from datetime import datetime
+import decimal
+import sys
+import timeit
+
+from dynamodb2.codec import AttributeSchema, encode_item, encode_updates
+from dynamodb2.constructor import Field, Update
+
+__author__ = 'drblez'
+
+"""
+
+    Attribute encoding microbenchmark.
+
+    Builds the same item and AttributeUpdates with the builders as they were before dynamodb2.codec (type chain per
+    value and a throwaway Field per Update value, kept here as reference), with constructor builders on top of the
+    codec, and with codec bulk functions with and without AttributeSchema. Reports microseconds per build.
+
+        python -m tx_bench.codec --attributes 30 --number 2000
+
+"""
+
+
+def _legacy_type(value):
+    if type(value) == str:
+        return 'S'
+    elif type(value) == int:
+        return 'N'
+    elif type(value) == float:
+        return 'N'
+    elif type(value) == decimal.Decimal:
+        return 'N'
+    elif type(value) == datetime:
+        return 'D'
+    elif type(value) == list:
+        return _legacy_type(value[0]) + 'S'
+
+
+class _LegacyField():
+    def __init__(self, name, value):
+        self.name = name
+        self.type = _legacy_type(value)
+        if self.type in ['SS', 'NS']:
+            t = []
+            for v in value:
+                t.append(str(v))
+            self.value = t
+        elif self.type == 'D':
+            self.type = 'S'
+            self.value = value.isoformat()
+        elif self.type == 'DS':
+            self.type = 'SS'
+            t = []
+            for v in value:
+                t.append(v.isoformat())
+            self.value = t
+        else:
+            self.value = str(value)
+        self.items = [self]
+
+    def field(self, name, value):
+        self.items.append(_LegacyField(name, value))
+        return self
+
+    def dict(self):
+        d = {}
+        for i in self.items:
+            d[i.name] = {i.type: i.value}
+        return d
+
+
+class _LegacyUpdate():
+    def __init__(self, field):
+        self.field = field
+        self.action = None
+        self.value = None
+        self.items = []
+
+    def put(self, value):
+        self.value = _LegacyField('Value', value).dict()
+        self.action = 'PUT'
+        self.items.append(self)
+        return self
+
+    def also(self, update):
+        self.items.append(update)
+        return self
+
+    def dict(self):
+        d = {}
+        for i in self.items:
+            if not i.value is None:
+                t = i.value
+            else:
+                t = {}
+            t['Action'] = i.action
+            d[i.field] = t
+        return d
+
+
+def make_item(attributes=30):
+    """
+
+    @return: Item of attributes attributes cycling through str, int, Decimal, datetime and set values
+    """
+    samples = ['value', 42, decimal.Decimal('3.14'), datetime(2015, 6, 1, 12, 30), ['a', 'b', 'c'], [1, 2, 3]]
+    return dict(('f{}'.format(n), samples[n % len(samples)]) for n in range(attributes))
+
+
+def item_schema(item):
+    types = {str: 'S', int: 'N', decimal.Decimal: 'N', datetime: 'D'}
+    return AttributeSchema(dict((k, types[type(v)] if type(v) != list else _legacy_type(v)) for k, v in item.items()))
+
+
+def _fields(cls, item):
+    names = sorted(item)
+    f = cls(names[0], item[names[0]])
+    for name in names[1:]:
+        f.field(name, item[name])
+    return f.dict()
+
+
+def _updates(cls, item):
+    names = sorted(item)
+    u = cls(names[0]).put(item[names[0]])
+    for name in names[1:]:
+        u.also(cls(name).put(item[name]))
+    return u.dict()
+
+
+def builders(item):
+    """
+
+    @return: [(name, function building the wire dict of item)]
+    """
+    schema = item_schema(item)
+    updates = dict((k, ('PUT', v)) for k, v in item.items())
+    return [
+        ('item legacy Field', lambda: _fields(_LegacyField, item)),
+        ('item Field', lambda: _fields(Field, item)),
+        ('item encode_item', lambda: encode_item(item)),
+        ('item encode_item schema', lambda: encode_item(item, schema)),
+        ('updates legacy Update', lambda: _updates(_LegacyUpdate, item)),
+        ('updates Update', lambda: _updates(Update, item)),
+        ('updates encode_updates', lambda: encode_updates(updates)),
+        ('updates encode_updates schema', lambda: encode_updates(updates, schema))
+    ]
+
+
+def run(attributes=30, number=2000, repeat=3):
+    """
+
+    @return: [(builder name, best microseconds per build)]
+    """
+    results = []
+    for name, f in builders(make_item(attributes)):
+        best = min(timeit.repeat(f, number=number, repeat=repeat))
+        results.append((name, best / number * 1e6))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m tx_bench.codec', description='Attribute encoding benchmark')
+    parser.add_argument('--attributes', type=int, default=30, help='Attributes per item')
+    parser.add_argument('--number', type=int, default=2000, help='Builds per measurement')
+    parser.add_argument('--repeat', type=int, default=3, help='Measurements, the best one is reported')
+    args = parser.parse_args(argv)
+    results = run(args.attributes, args.number, args.repeat)
+    baseline = dict(results)
+    print('{:<32} {:>10} {:>8}'.format('builder', 'usec', 'speedup'))
+    for name, usec in results:
+        legacy = baseline['item legacy Field'] if name.startswith('item') else baseline['updates legacy Update']
+        print('{:<32} {:>10.2f} {:>7.2f}x'.format(name, usec, legacy / usec))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,4 @@
+from __future__ import print_function
 from dynamodb2.constructor import Field
 from dynamodb2.transaction import Tx
 
@@ -11,9 +12,9 @@ def test():
     #agent.update(Update('balance').add(42).dict())
     #accounts.update(Update('field42').put(4242).dict())
     tx.commit()
-    print tx.stat
+    print(tx.stat)
     tx = Tx('Tx1', 'RC')
     accounts = tx.get_item('accounts-1', '55', 12345)
     accounts.put(Field('f42', 42).dict())
     tx.commit()
-    print tx.stat
\ No newline at end of file
+    print(tx.stat)
\ No newline at end of file
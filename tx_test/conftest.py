@@ -0,0 +1,13 @@
+import sys
+
+__author__ = 'drblez'
+
+"""
+
+    AsyncTx tests need Python 3.7+, as dynamodb2.transaction.aio does.
+
+"""
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_aio.py')
@@ -0,0 +1,109 @@
+import asyncio
+
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_MODE_OPTIMISTIC
+from dynamodb2.transaction.aio import AsyncDynamoDB2Connection, AsyncTx, TxModeNotSupported
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCKS_DATA_FIELD, X_LOCK_DATA_FIELD
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    AsyncTx/AsyncTxItem over MemoryBackend: commit, rollback and contending transactions.
+
+"""
+
+
+def _connection(backend):
+    return AsyncDynamoDB2Connection(AWSDynamoDB2Connection(backend=backend))
+
+
+def _items(backend):
+    return dict((k[0][1], v) for k, v in backend.tables[BENCH_TABLE_NAME].items.items())
+
+
+def _counters(backend):
+    return dict((k, v['counter']['N']) for k, v in _items(backend).items())
+
+
+def test_commit():
+    backend = make_backend(items=10)
+    connection = _connection(backend)
+
+    async def main():
+        tx = await AsyncTx.start('test aio', ISOLATION_LEVEL_FULL_LOCK, connection=connection)
+        one, two = await asyncio.gather(tx.get_item(BENCH_TABLE_NAME, '1'), tx.get_item(BENCH_TABLE_NAME, '2'))
+        await asyncio.gather(one.update(Update('counter').add(5).dict()), two.put(Field('counter', 7).dict()))
+        # Read-your-writes inside the transaction
+        assert (await one.get())['Item']['counter'] == {'N': '5'}
+        assert (await one.get(decoded=True))['counter'] == 5
+        await tx.commit()
+
+    asyncio.run(main())
+    assert _counters(backend)['1'] == '5'
+    assert _counters(backend)['2'] == '7'
+    assert not any(LOCKS_DATA_FIELD in v or X_LOCK_DATA_FIELD in v for v in _items(backend).values())
+
+
+def test_rollback():
+    backend = make_backend(items=10)
+    before = _items(backend)
+    connection = _connection(backend)
+
+    async def main():
+        tx = await AsyncTx.start('test aio', ISOLATION_LEVEL_FULL_LOCK, connection=connection)
+        tx_items = await asyncio.gather(*[tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(5)])
+        await tx.lock_all(tx_items, LOCK_EXCLUSIVE)
+        await asyncio.gather(*[i.update(Update('counter').add(1).dict()) for i in tx_items])
+        missing = await tx.get_item(BENCH_TABLE_NAME, 'new')
+        await missing.put(Field('counter', 1).dict())
+        await tx_items[0].delete()
+        await tx.rollback()
+
+    asyncio.run(main())
+    assert _items(backend) == before
+
+
+def test_contention():
+    backend = make_backend(rtt=0.001, items=10)
+    connection = _connection(backend)
+
+    async def one(n):
+        tx = await AsyncTx.start('test aio', ISOLATION_LEVEL_FULL_LOCK, connection=connection)
+        # Opposite lock order in every other transaction: lock_all backs off instead of dead locking
+        keys = ['hot', str(n % 3)] if n % 2 else [str(n % 3), 'hot']
+        tx_items = await asyncio.gather(*[tx.get_item(BENCH_TABLE_NAME, k) for k in keys])
+        await tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=30)
+        await asyncio.gather(*[i.update(Update('counter').add(1).dict()) for i in tx_items])
+        await tx.commit()
+
+    async def main():
+        await asyncio.gather(*[one(n) for n in range(12)])
+
+    asyncio.run(main())
+    counters = _counters(backend)
+    assert counters['hot'] == '12'
+    assert [counters[str(n)] for n in range(3)] == ['4', '4', '4']
+    assert not any(LOCKS_DATA_FIELD in v or X_LOCK_DATA_FIELD in v for v in _items(backend).values())
+
+
+def test_delete_and_modes():
+    backend = make_backend(items=10)
+    connection = _connection(backend)
+
+    async def main():
+        try:
+            await AsyncTx.start('test aio', ISOLATION_LEVEL_FULL_LOCK, connection=connection, mode=TX_MODE_OPTIMISTIC)
+            assert False
+        except TxModeNotSupported:
+            pass
+        tx = await AsyncTx.start('test aio', ISOLATION_LEVEL_FULL_LOCK, connection=connection)
+        tx_item = await tx.get_item(BENCH_TABLE_NAME, '1')
+        await tx_item.delete()
+        assert await tx_item.get() == {}
+        await tx.commit()
+
+    asyncio.run(main())
+    assert not '1' in _items(backend)
@@ -0,0 +1,84 @@
+from boto.dynamodb2.exceptions import ConditionalCheckFailedException
+
+from dynamodb2.backend.memory import MemoryBackend
+
+__author__ = 'drblez'
+
+"""
+
+    MemoryBackend conditions and AttributeUpdates, the semantics the transaction manager relies on.
+
+"""
+
+TABLE_NAME = 'users'
+KEY = {'id': {'S': '1'}}
+
+
+def _backend():
+    backend = MemoryBackend()
+    backend.create_table([dict(AttributeName='id', AttributeType='S')], TABLE_NAME,
+                         [dict(AttributeName='id', KeyType='HASH')], dict(ReadCapacityUnits=5, WriteCapacityUnits=5))
+    backend.put_item(TABLE_NAME, {'id': {'S': '1'}, 'n': {'N': '1'}, 'tags': {'SS': ['a', 'b']}})
+    return backend
+
+
+def _failed(call, *args, **kwargs):
+    try:
+        call(*args, **kwargs)
+    except ConditionalCheckFailedException:
+        return True
+    return False
+
+
+def test_expected_exists():
+    backend = _backend()
+    assert _failed(backend.put_item, TABLE_NAME, {'id': {'S': '1'}}, expected={'id': {'Exists': 'false'}})
+    backend.put_item(TABLE_NAME, {'id': {'S': '2'}}, expected={'id': {'Exists': 'false'}})
+    assert _failed(backend.delete_item, TABLE_NAME, {'id': {'S': '3'}}, expected={'id': {'Exists': 'true',
+                                                                                       'Value': {'S': '3'}}})
+    assert backend.get_item(TABLE_NAME, {'id': {'S': '2'}}) == {'Item': {'id': {'S': '2'}}}
+
+
+def test_expected_value():
+    backend = _backend()
+    assert _failed(backend.update_item, TABLE_NAME, KEY, {'n': {'Action': 'PUT', 'Value': {'N': '5'}}},
+                   expected={'n': {'Exists': 'true', 'Value': {'N': '2'}}})
+    backend.update_item(TABLE_NAME, KEY, {'n': {'Action': 'PUT', 'Value': {'N': '5'}}},
+                        expected={'n': {'Exists': 'true', 'Value': {'N': '1.0'}}})
+    assert backend.get_item(TABLE_NAME, KEY)['Item']['n'] == {'N': '5'}
+
+
+def test_add():
+    backend = _backend()
+    backend.update_item(TABLE_NAME, KEY, {'n': {'Action': 'ADD', 'Value': {'N': '2'}},
+                                          'm': {'Action': 'ADD', 'Value': {'N': '3'}},
+                                          'tags': {'Action': 'ADD', 'Value': {'SS': ['b', 'c']}}})
+    item = backend.get_item(TABLE_NAME, KEY)['Item']
+    assert item['n'] == {'N': '3'}
+    assert item['m'] == {'N': '3'}
+    assert sorted(item['tags']['SS']) == ['a', 'b', 'c']
+
+
+def test_delete():
+    backend = _backend()
+    backend.update_item(TABLE_NAME, KEY, {'tags': {'Action': 'DELETE', 'Value': {'SS': ['a', 'x']}},
+                                          'n': {'Action': 'DELETE'}})
+    assert backend.get_item(TABLE_NAME, KEY)['Item'] == {'id': {'S': '1'}, 'tags': {'SS': ['b']}}
+    backend.update_item(TABLE_NAME, KEY, {'tags': {'Action': 'DELETE', 'Value': {'SS': ['b']}}})
+    assert backend.get_item(TABLE_NAME, KEY)['Item'] == {'id': {'S': '1'}}
+
+
+def test_return_values():
+    backend = _backend()
+    result = backend.update_item(TABLE_NAME, KEY, {'n': {'Action': 'ADD', 'Value': {'N': '1'}}},
+                                 return_values='ALL_OLD')
+    assert result['Attributes']['n'] == {'N': '1'}
+    assert 'tags' in result['Attributes']
+    result = backend.update_item(TABLE_NAME, KEY, {'n': {'Action': 'ADD', 'Value': {'N': '1'}}},
+                                 return_values='UPDATED_NEW')
+    assert result['Attributes'] == {'n': {'N': '3'}}
+    result = backend.update_item(TABLE_NAME, KEY, {'n': {'Action': 'ADD', 'Value': {'N': '1'}}},
+                                 return_values='ALL_NEW')
+    assert result['Attributes']['n'] == {'N': '4'}
+    assert 'tags' in result['Attributes']
+    assert not 'Attributes' in backend.put_item(TABLE_NAME, {'id': {'S': '2'}}, return_values='ALL_OLD')
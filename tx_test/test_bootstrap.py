@@ -0,0 +1,51 @@
+import gc
+import weakref
+
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.backend.memory import MemoryBackend
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_DATA_TABLE_NAME, TX_TABLE_NAME, \
+    BadTxTableAttributes, Tx, _bootstrapped_backend_tables, ensure_tables, reset_ensured_tables
+
+__author__ = 'drblez'
+
+"""
+
+    Process wide bootstrap of tx-info and tx-data tables.
+
+"""
+
+
+def test_tables_are_created_once():
+    backend = MemoryBackend(table_create_time=0.01)
+    for _ in range(3):
+        Tx('test bootstrap', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None).commit()
+    assert sorted(backend.tables) == sorted([TX_TABLE_NAME, TX_DATA_TABLE_NAME])
+    assert backend.calls['CreateTable'] == 2
+    describes = backend.calls['DescribeTable']
+    ensure_tables(AWSDynamoDB2Connection(backend=backend))
+    assert backend.calls['DescribeTable'] == describes
+    # Existing tables are checked, not created again
+    reset_ensured_tables()
+    ensure_tables(AWSDynamoDB2Connection(backend=backend))
+    assert backend.calls['CreateTable'] == 2
+
+
+def test_bad_table():
+    backend = MemoryBackend()
+    backend.create_table([dict(AttributeName='id', AttributeType='S')], TX_TABLE_NAME,
+                         [dict(AttributeName='id', KeyType='HASH')], dict(ReadCapacityUnits=5, WriteCapacityUnits=5))
+    try:
+        ensure_tables(AWSDynamoDB2Connection(backend=backend))
+        assert False
+    except BadTxTableAttributes:
+        pass
+
+
+def test_backends_are_not_kept_alive():
+    backend = MemoryBackend()
+    ensure_tables(AWSDynamoDB2Connection(backend=backend))
+    assert backend in _bootstrapped_backend_tables
+    backend_ref = weakref.ref(backend)
+    del backend
+    gc.collect()
+    assert backend_ref() is None
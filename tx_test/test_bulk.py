@@ -0,0 +1,132 @@
+import threading
+
+from dynamodb2.constructor import Field
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_MODE_LOCK, TX_MODE_OPTIMISTIC, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCKS_DATA_FIELD, LockWaitTime
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Tx.bulk_put: chunked locking, undo logging and BatchWriteItem writes.
+
+"""
+
+
+def _tx(backend, mode=TX_MODE_LOCK):
+    return Tx('test bulk', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None, mode=mode)
+
+
+def _rows(keys, counter):
+    return (Field('id', str(k)).field('counter', counter).dict() for k in keys)
+
+
+def _items(backend):
+    return dict((k[0][1], v) for k, v in backend.tables[BENCH_TABLE_NAME].items.items())
+
+
+def test_bulk_put_commit():
+    backend = make_backend(items=100)
+    tx = _tx(backend)
+    assert tx.bulk_put(BENCH_TABLE_NAME, _rows(range(50, 300), 1), chunk_size=64) == 250
+    tx.commit()
+    items = _items(backend)
+    assert sorted(int(k) for k in items if k != 'hot') == list(range(300))
+    assert [items[str(k)]['counter'] for k in (0, 50, 299)] == [{'N': '0'}, {'N': '1'}, {'N': '1'}]
+    assert not any(LOCKS_DATA_FIELD in item for item in items.values())
+    # Existing and missing items are written together, 25 per BatchWriteItem, chunks of 64, 64, 64 and 58 items
+    assert tx.calls[('data', 'batch_write_item')] == 12
+    assert not ('data', 'put_item') in tx.calls
+
+
+def test_bulk_put_rollback():
+    backend = make_backend(items=100)
+    before = _items(backend)
+    tx = _tx(backend)
+    tx.bulk_put(BENCH_TABLE_NAME, _rows(range(50, 300), 1), chunk_size=64)
+    # Undo records are not kept, rollback reads them back
+    assert tx.tx_log == []
+    tx.rollback()
+    assert tx.calls[('tx', 'query')] == 1
+    assert _items(backend) == before
+
+
+def test_bulk_put_item_created_meanwhile():
+    backend = make_backend(items=10)
+    holder = _tx(backend)
+    assert holder.get_item(BENCH_TABLE_NAME, '5').lock(LOCK_EXCLUSIVE)
+
+    def create():
+        holder.get_item(BENCH_TABLE_NAME, 'new').put(Field('id', 'new').field('counter', 7).dict())
+        holder.commit()
+
+    # 'new' is missing when the chunk is checked, it is created while bulk_put waits for '5'
+    timer = threading.Timer(0.05, create)
+    timer.start()
+    tx = _tx(backend)
+    tx.bulk_put(BENCH_TABLE_NAME, _rows(['new', 5, 'other'], 1), max_wait_time=5)
+    timer.join()
+    # Only the item created meanwhile is tried by conditional create, then locked as existing item
+    assert tx.calls[('data', 'put_item')] == 1
+    assert _items(backend)['new']['counter'] == {'N': '1'}
+    tx.rollback()
+    items = _items(backend)
+    assert items['new']['counter'] == {'N': '7'}
+    assert not 'other' in items
+    assert not any(LOCKS_DATA_FIELD in item for item in items.values())
+
+
+def test_bulk_put_duplicate_keys():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    rows = [Field('id', '1').field('counter', n).dict() for n in range(3)]
+    assert tx.bulk_put(BENCH_TABLE_NAME, rows) == 1
+    tx.commit()
+    assert _items(backend)['1']['counter'] == {'N': '2'}
+
+
+def test_bulk_put_locked_item():
+    backend = make_backend(items=10)
+    holder = _tx(backend)
+    assert holder.get_item(BENCH_TABLE_NAME, '5').lock(LOCK_EXCLUSIVE)
+    tx = _tx(backend)
+    try:
+        tx.bulk_put(BENCH_TABLE_NAME, _rows(range(10), 1), max_wait_time=0.05)
+        assert False
+    except LockWaitTime:
+        pass
+    tx.rollback()
+    holder.commit()
+    assert all(v['counter'] == {'N': '0'} for v in _items(backend).values())
+
+
+def test_bulk_put_opposite_order():
+    backend = make_backend(rtt=0.001, items=10)
+    keys = list(range(40))
+    errors = []
+
+    def run(keys):
+        try:
+            tx = _tx(backend)
+            tx.bulk_put(BENCH_TABLE_NAME, _rows(keys, 1), chunk_size=100, max_wait_time=10)
+            tx.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in (keys, list(reversed(keys)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert not any(LOCKS_DATA_FIELD in item for item in _items(backend).values())
+
+
+def test_bulk_put_optimistic():
+    backend = make_backend(items=10)
+    tx = _tx(backend, TX_MODE_OPTIMISTIC)
+    tx.bulk_put(BENCH_TABLE_NAME, _rows(range(5, 15), 1))
+    assert _items(backend)['5']['counter'] == {'N': '0'}
+    tx.commit()
+    assert sorted(int(k) for k, v in _items(backend).items() if v['counter'] == {'N': '1'}) == list(range(5, 15))
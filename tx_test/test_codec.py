@@ -0,0 +1,88 @@
+from datetime import datetime
+import decimal
+
+from dynamodb2.codec import AttributeSchema, BadDynamoDBType, EmptyList, ItemView, decode, decode_item, encode, \
+    encode_item, encode_updates
+from dynamodb2.constructor import Expected, Field, Update
+
+__author__ = 'drblez'
+
+"""
+
+    Attribute codec: typed sets and lists, AttributeSchema, round trips and constructor builders.
+
+"""
+
+
+def _raises(exception, f, *args):
+    try:
+        f(*args)
+    except exception:
+        return True
+    return False
+
+
+def test_encode_scalars_and_sets():
+    assert encode('a') == {'S': 'a'}
+    assert encode(42) == {'N': '42'}
+    assert encode(decimal.Decimal('3.14')) == {'N': '3.14'}
+    assert encode(datetime(2015, 6, 1, 12, 30)) == {'S': '2015-06-01T12:30:00'}
+    assert encode([1, 2]) == {'NS': ['1', '2']}
+    assert encode(['a', 'b']) == {'SS': ['a', 'b']}
+    assert encode(set(['a'])) == {'SS': ['a']}
+    assert encode(frozenset([7])) == {'NS': ['7']}
+    # Numbers of different Python types fit one NS
+    assert encode([1, decimal.Decimal('1.5')]) == {'NS': ['1', '1.5']}
+
+
+def test_encode_lists_of_collections():
+    assert encode([['a'], set([1])]) == {'L': [{'SS': ['a']}, {'NS': ['1']}]}
+    assert encode([[['a']]]) == {'L': [{'L': [{'SS': ['a']}]}]}
+
+
+def test_bad_types():
+    assert _raises(BadDynamoDBType, encode, {'a': 1})
+    assert _raises(BadDynamoDBType, encode, True)
+    # Members are encoded by their own types, not stringified
+    assert _raises(BadDynamoDBType, encode, ['a', 1])
+    assert _raises(BadDynamoDBType, encode, [['a'], 'b'])
+    assert _raises(BadDynamoDBType, encode, [{'a': 1}])
+    assert _raises(EmptyList, encode, [])
+    assert _raises(EmptyList, encode, [['a'], []])
+
+
+def test_round_trip():
+    item = {'id': 'x', 'n': 42, 'price': decimal.Decimal('3.14'), 'tags': set(['a', 'b']), 'ids': set([1, 2]),
+            'created': datetime(2015, 6, 1, 12, 30), 'nested': [set(['a']), set([1])]}
+    wire = encode_item(item)
+    assert decode_item(wire, datetimes=['created']) == item
+    view = ItemView(wire, datetimes=['created'], hidden_fields=['id'])
+    assert not 'id' in view
+    assert view['created'] == item['created']
+    assert len(view) == len(item) - 1
+    assert decode({'N': '1E+2'}) == decimal.Decimal('1E+2')
+
+
+def test_schema():
+    schema = AttributeSchema({'counter': 'N', 'ids': 'SS', 'created': 'D'})
+    assert encode_item({'counter': '5', 'ids': [1, 2], 'other': 3}, schema) == \
+        {'counter': {'N': '5'}, 'ids': {'SS': ['1', '2']}, 'other': {'N': '3'}}
+    assert schema.encode('created', datetime(2015, 6, 1)) == {'S': '2015-06-01T00:00:00'}
+    assert encode_updates({'counter': ('ADD', '1'), 'old': ('DELETE', None)}, schema) == \
+        {'counter': {'Value': {'N': '1'}, 'Action': 'ADD'}, 'old': {'Action': 'DELETE'}}
+    assert _raises(BadDynamoDBType, AttributeSchema, {'counter': 'X'})
+
+
+def test_constructor_builders():
+    assert Field('f1', 'value1').field('f3', 42).field('f4', ['a', 'b']).dict() == \
+        {'f1': {'S': 'value1'}, 'f3': {'N': '42'}, 'f4': {'SS': ['a', 'b']}}
+    update = Update('f3').add(1).also(Update('f5').delete([2, 3])).also(Update('f6').delete())
+    expected = {'f3': {'Value': {'N': '1'}, 'Action': 'ADD'}, 'f5': {'Value': {'NS': ['2', '3']}, 'Action': 'DELETE'},
+                'f6': {'Action': 'DELETE'}}
+    assert update.dict() == expected
+    # dict() builds new dicts every time
+    update.dict()['f6']['Action'] = 'PUT'
+    assert update.dict() == expected
+    assert Expected('f1', True, 'value1').expected('f6', False).dict() == \
+        {'f1': {'Value': {'S': 'value1'}, 'Exists': 'true'}, 'f6': {'Exists': 'false'}}
+    assert encode_updates({'f3': ('ADD', 1), 'f5': ('DELETE', [2, 3]), 'f6': ('DELETE', None)}) == expected
@@ -0,0 +1,76 @@
+from dynamodb2.constructor import Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, ISOLATION_LEVEL_READ_COMMITTED, Tx
+from dynamodb2.transaction.item import LOCK_SHARED, LOCKS_DATA_FIELD
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Tx.get_many: S locks through lock_all, BatchGetItem reads, missing keys.
+
+"""
+
+
+def _tx(backend, isolation_level=ISOLATION_LEVEL_FULL_LOCK):
+    return Tx('test get many', isolation_level, backend=backend, pool=None)
+
+
+def _values(results):
+    return dict((i.hash_key_value, r['Item']['counter']['N'] if 'Item' in r else None) for i, r in results.items())
+
+
+def test_full_lock():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    known = tx.get_item(BENCH_TABLE_NAME, '1')
+    known.update(Update('counter').add(5).dict())
+    keys = [(BENCH_TABLE_NAME, str(n)) for n in range(5)] + [(BENCH_TABLE_NAME, '1'), (BENCH_TABLE_NAME, 'nope')]
+    results = tx.get_many(keys)
+    # Duplicate keys and items already in the transaction share one TxItem
+    assert len(results) == 6 and known in results
+    assert _values(results) == {'0': '0', '1': '5', '2': '0', '3': '0', '4': '0', 'nope': None}
+    assert results[known] == {'Item': {'id': {'S': '1'}, 'counter': {'N': '5'}}}
+    assert all(i.lock_state == LOCK_SHARED for i in results if i.hash_key_value in ('0', '2', '3', '4'))
+    # Lock updates return the items, nothing is left to read
+    assert not ('data', 'batch_get_item') in tx.calls
+    tx.commit()
+    assert not any(LOCKS_DATA_FIELD in v for v in backend.tables[BENCH_TABLE_NAME].items.values())
+
+
+def test_missing_keys_are_not_created():
+    backend = make_backend(items=10)
+    for isolation_level in (ISOLATION_LEVEL_FULL_LOCK, ISOLATION_LEVEL_READ_COMMITTED):
+        tx = _tx(backend, isolation_level)
+        results = tx.get_many([(BENCH_TABLE_NAME, 'a'), (BENCH_TABLE_NAME, 'b'), (BENCH_TABLE_NAME, '1')],
+                              attributes_to_get=['counter'])
+        assert _values(results) == {'a': None, 'b': None, '1': '0'}
+        assert [r for r in results.values() if 'Item' in r] == [{'Item': {'counter': {'N': '0'}}}]
+        assert all(i.lock_state is None for i in results if i.hash_key_value in ('a', 'b'))
+        tx.commit()
+    assert len(backend.tables[BENCH_TABLE_NAME].items) == 11
+
+
+def test_batch_get_chunks():
+    backend = make_backend(items=150)
+    tx = _tx(backend, ISOLATION_LEVEL_READ_COMMITTED)
+    results = tx.get_many([(BENCH_TABLE_NAME, str(n)) for n in range(160)])
+    assert sum(1 for r in results.values() if 'Item' in r) == 150
+    # No locks with READ_COMMITTED, up to 100 keys per BatchGetItem
+    assert tx.calls[('data', 'batch_get_item')] == 2
+    assert not ('lock', 'update_item') in tx.calls
+    tx.commit()
+
+
+def test_decoded():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    tx_item.update(Update('counter').add(5).dict())
+    view = tx_item.get(decoded=True)
+    assert dict(view) == {'id': '1', 'counter': 5}
+    results = tx.get_many([(BENCH_TABLE_NAME, '1'), (BENCH_TABLE_NAME, '2'), (BENCH_TABLE_NAME, 'nope')],
+                          decoded=True)
+    assert dict((i.hash_key_value, None if r is None else r['counter']) for i, r in results.items()) == \
+        {'1': 5, '2': 0, 'nope': None}
+    tx.commit()
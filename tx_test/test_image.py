@@ -0,0 +1,63 @@
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.image import apply_updates
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCKS_DATA_FIELD
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Transaction-local item images: reads of locked items are served from memory and see own writes.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test image', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def test_read_your_writes():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    assert tx_item.get()['Item'] == {'id': {'S': '1'}, 'counter': {'N': '0'}}
+    tx_item.update(Update('counter').add(2).dict())
+    tx_item.update({'tags': {'Action': 'PUT', 'Value': {'SS': ['a', 'b']}}})
+    item = tx_item.get()['Item']
+    assert item['counter'] == {'N': '2'}
+    assert sorted(item['tags']['SS']) == ['a', 'b']
+    assert tx_item.get(['counter'])['Item'] == {'counter': {'N': '2'}}
+    tx_item.put(Field('counter', 7).dict())
+    assert tx_item.get()['Item'] == {'id': {'S': '1'}, 'counter': {'N': '7'}}
+    # The S lock update returns the item, every read is served from the image
+    assert not ('data', 'get_item') in tx.calls
+    tx.commit()
+
+
+def test_image_from_lock_update():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '2')
+    assert tx_item.lock(LOCK_EXCLUSIVE)
+    assert tx_item.get()['Item']['counter'] == {'N': '0'}
+    assert not ('data', 'get_item') in tx.calls
+    # Results are copies, changing them does not change the image
+    tx_item.get()['Item']['counter']['N'] = '5'
+    assert tx_item.get()['Item']['counter'] == {'N': '0'}
+    assert not LOCKS_DATA_FIELD in tx_item.get()['Item']
+    tx.rollback()
+
+
+def test_apply_updates():
+    image = {'n': {'N': '1.50'}, 'tags': {'SS': ['a', 'b']}, 'nums': {'NS': ['1', '2']}}
+    updated = apply_updates(image, {'n': {'Action': 'ADD', 'Value': {'N': '1'}},
+                                    'tags': {'Action': 'DELETE', 'Value': {'SS': ['a']}},
+                                    'nums': {'Action': 'ADD', 'Value': {'NS': ['2.0', '3']}},
+                                    'new': {'Action': 'PUT', 'Value': {'S': 'x'}}})
+    assert updated == {'n': {'N': '2.5'}, 'tags': {'SS': ['b']}, 'nums': {'NS': ['1', '2', '3']},
+                       'new': {'S': 'x'}}
+    assert image['n'] == {'N': '1.50'}
+    # Updates DynamoDB would reject are not applied locally
+    assert apply_updates(image, {'tags': {'Action': 'ADD', 'Value': {'N': '1'}}}) is None
+    assert apply_updates(image, {'n': {'Action': 'DELETE', 'Value': {'NS': ['1']}}}) is None
@@ -0,0 +1,75 @@
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, ISOLATION_LEVEL_READ_COMMITTED, \
+    ISOLATION_LEVEL_READ_UNCOMMITTED, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    READ_COMMITTED and READ_UNCOMMITTED reads of items X locked and written by other transactions.
+
+"""
+
+
+def _tx(backend, isolation_level=ISOLATION_LEVEL_FULL_LOCK):
+    return Tx('test isolation', isolation_level, backend=backend, pool=None)
+
+
+def _counter(tx, key):
+    result = tx.get_item(BENCH_TABLE_NAME, key).get()
+    if not 'Item' in result:
+        return None
+    return result['Item']['counter']['N']
+
+
+def _writer(backend):
+    writer = _tx(backend)
+    writer.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(5).dict())
+    writer.get_item(BENCH_TABLE_NAME, 'new').put(Field('counter', 1).dict())
+    writer.get_item(BENCH_TABLE_NAME, '2').lock(LOCK_EXCLUSIVE)
+    return writer
+
+
+def test_read_committed():
+    backend = make_backend(items=10)
+    writer = _writer(backend)
+    tx = _tx(backend, ISOLATION_LEVEL_READ_COMMITTED)
+    # Before-images of the holder undo log, nothing of an inserted item
+    assert [_counter(tx, k) for k in ('1', 'new')] == ['0', None]
+    # X locked item without undo record is not modified by its holder: one lookup of the record, no wait
+    reads = tx.calls[('tx', 'get_item')]
+    assert _counter(tx, '2') == '0'
+    assert tx.calls[('tx', 'get_item')] == reads + 1
+    assert all(i.lock_state is None for i in tx.tx_items)
+    writer.commit()
+    assert [_counter(tx, k) for k in ('1', 'new')] == ['5', '1']
+    tx.commit()
+
+
+def test_read_uncommitted():
+    backend = make_backend(items=10)
+    writer = _writer(backend)
+    tx = _tx(backend, ISOLATION_LEVEL_READ_UNCOMMITTED)
+    assert [_counter(tx, k) for k in ('1', 'new', '2')] == ['5', '1', '0']
+    assert not ('tx', 'get_item') in tx.calls
+    assert all(i.lock_state is None for i in tx.tx_items)
+    writer.rollback()
+    assert [_counter(tx, k) for k in ('1', 'new')] == ['0', None]
+    tx.commit()
+
+
+def test_writes_lock():
+    backend = make_backend(items=10)
+    tx = _tx(backend, ISOLATION_LEVEL_READ_COMMITTED)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '3')
+    assert _counter(tx, '3') == '0'
+    tx_item.update(Update('counter').add(1).dict())
+    assert tx_item.lock_state == LOCK_EXCLUSIVE
+    # Own writes are read from the image
+    assert _counter(tx, '3') == '1'
+    other = _tx(backend, ISOLATION_LEVEL_READ_COMMITTED)
+    assert _counter(other, '3') == '0'
+    tx.commit()
+    other.commit()
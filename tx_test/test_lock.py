@@ -0,0 +1,65 @@
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED, LOCKS_DATA_FIELD, X_LOCK_DATA_FIELD, \
+    NotExistingItem
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Lock protocol of TxItem: one conditional update per uncontended lock or upgrade, S/X conflicts, lock waits.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test lock', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _tokens(backend, key):
+    item = backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}})['Item']
+    return item.get(LOCKS_DATA_FIELD, {}).get('SS', [])
+
+
+def test_uncontended_lock_is_one_update():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    assert tx_item.lock(LOCK_SHARED)
+    assert tx_item.lock(LOCK_EXCLUSIVE)
+    assert tx.calls[('lock', 'update_item')] == 2
+    assert not ('lock', 'get_item') in tx.calls
+    # Upgrade adds X token, S token is removed by unlock
+    own_hex = str(tx.tx_uuid).replace('-', '')
+    assert sorted(_tokens(backend, '1')) == ['S' + own_hex, 'X' + own_hex]
+    tx.commit()
+    assert _tokens(backend, '1') == []
+    assert not X_LOCK_DATA_FIELD in backend.get_item(BENCH_TABLE_NAME, {'id': {'S': '1'}})['Item']
+
+
+def test_lock_conflicts():
+    backend = make_backend(items=10)
+    tx1, tx2, tx3 = _tx(backend), _tx(backend), _tx(backend)
+    assert tx1.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_SHARED)
+    assert tx2.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_SHARED)
+    tx_item = tx3.get_item(BENCH_TABLE_NAME, '1')
+    assert not tx_item.lock(LOCK_EXCLUSIVE)
+    assert sorted(lock['tx_uuid'] for lock in tx_item.locks) == sorted([str(tx1.tx_uuid), str(tx2.tx_uuid)])
+    tx1.commit()
+    tx2.commit()
+    assert tx_item.lock(LOCK_EXCLUSIVE)
+    assert not tx1.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_SHARED)
+    tx3.rollback()
+
+
+def test_missing_item():
+    backend = make_backend(items=1)
+    tx = _tx(backend)
+    try:
+        tx.get_item(BENCH_TABLE_NAME, 'missing').lock(LOCK_SHARED)
+        assert False
+    except NotExistingItem:
+        pass
+    # Failed lock request creates nothing
+    assert backend.get_item(BENCH_TABLE_NAME, {'id': {'S': 'missing'}}) == {}
+    tx.rollback()
@@ -0,0 +1,150 @@
+import threading
+from time import sleep
+
+from dynamodb2.constructor import Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx, TxConflict
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED, LOCKS_DATA_FIELD, LockWaitTime
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Tx.lock_all: concurrent tries, ordered waits, release of partial locks and S->X upgrades.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test lock all', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _tokens(backend, key):
+    item = backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}})['Item']
+    return item.get(LOCKS_DATA_FIELD, {}).get('SS', [])
+
+
+def _counter(backend, key):
+    return backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}})['Item']['counter']['N']
+
+
+def test_lock_all_releases_on_timeout():
+    backend = make_backend(items=10)
+    holder = _tx(backend)
+    assert holder.get_item(BENCH_TABLE_NAME, '3').lock(LOCK_EXCLUSIVE)
+    tx = _tx(backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(6)]
+    try:
+        tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=0.05)
+        assert False
+    except LockWaitTime:
+        pass
+    assert [_tokens(backend, str(n)) for n in (0, 1, 2, 4, 5)] == [[]] * 5
+    assert all(i.lock_state is None for i in tx_items)
+    holder.commit()
+    assert tx.lock_all(tx_items, LOCK_EXCLUSIVE)
+    assert all(i.lock_state == LOCK_EXCLUSIVE for i in tx_items)
+    tx.commit()
+
+
+def test_lock_all_missing():
+    backend = make_backend(items=3)
+    tx = _tx(backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(5)]
+    missing = []
+    tx.lock_all(tx_items, LOCK_SHARED, missing=missing)
+    assert sorted(i.hash_key_value for i in missing) == ['3', '4']
+    assert [i.lock_state for i in tx_items] == [LOCK_SHARED] * 3 + [None] * 2
+    tx.commit()
+
+
+def test_lock_all_opposite_order():
+    backend = make_backend(rtt=0.001, items=10)
+    keys = [str(n) for n in range(8)]
+    errors = []
+
+    def run(keys):
+        try:
+            for _ in range(5):
+                tx = _tx(backend)
+                tx.lock_all([tx.get_item(BENCH_TABLE_NAME, k) for k in keys], LOCK_EXCLUSIVE, max_wait_time=10)
+                tx.commit()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(k,)) for k in (keys, list(reversed(keys)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [_tokens(backend, k) for k in keys] == [[]] * len(keys)
+
+
+def _upgrade_race(update_key):
+    """
+
+    tx holds S lock of '1' and upgrades '0' and '1' while other holds X lock of '0' and waits for '1'
+
+    @return: Error of tx.lock_all or None, errors of other
+    """
+    backend = make_backend(items=10)
+    tx, other = _tx(backend), _tx(backend)
+    upgraded = tx.get_item(BENCH_TABLE_NAME, '1')
+    upgraded.get()
+    other_items = dict((k, other.get_item(BENCH_TABLE_NAME, k)) for k in ('0', '1'))
+    assert other_items['0'].lock(LOCK_EXCLUSIVE)
+    errors = []
+
+    def run():
+        try:
+            other.lock_all(list(other_items.values()), LOCK_EXCLUSIVE, max_wait_time=5)
+            other_items[update_key].update(Update('counter').add(1).dict())
+            other.commit()
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    sleep(0.05)
+    error = None
+    try:
+        tx.lock_all([tx.get_item(BENCH_TABLE_NAME, '0'), upgraded], LOCK_EXCLUSIVE, max_wait_time=5)
+        assert upgraded.lock_state == LOCK_EXCLUSIVE
+        tx.commit()
+    except TxConflict as e:
+        error = e
+        tx.rollback()
+    thread.join()
+    assert [_tokens(backend, k) for k in ('0', '1')] == [[], []]
+    assert _counter(backend, update_key) == '1'
+    return error, errors
+
+
+def test_upgrade_gives_up_s_lock_out_of_order():
+    # Without giving up the S lock of '1' both transactions would wait for each other until max_wait_time
+    assert _upgrade_race('0') == (None, [])
+
+
+def test_upgrade_of_changed_item_conflicts():
+    error, errors = _upgrade_race('1')
+    assert isinstance(error, TxConflict)
+    assert errors == []
+
+
+def test_failed_upgrade_keeps_s_lock():
+    backend = make_backend(items=10)
+    holder, tx = _tx(backend), _tx(backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, k) for k in ('0', '1')]
+    tx_items[0].get()
+    assert holder.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_SHARED)
+    try:
+        tx.lock_all(tx_items, LOCK_EXCLUSIVE, max_wait_time=0.05)
+        assert False
+    except LockWaitTime:
+        pass
+    # '0' is before the busy item, its upgrade is turned back into the S lock
+    assert [i.lock_state for i in tx_items] == [LOCK_SHARED, None]
+    assert _tokens(backend, '0') == ['S' + str(tx.tx_uuid).replace('-', '')]
+    holder.commit()
+    tx.commit()
@@ -0,0 +1,58 @@
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_DATA_TABLE_NAME, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Undo log persistence: PutItem for one record, BatchWriteItem for records queued by lock_all.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test log', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _undo_records(backend, tx):
+    return [r for r in backend.tables[TX_DATA_TABLE_NAME].items.values() if r['tx_uuid']['S'] == str(tx.tx_uuid)]
+
+
+def test_single_record_is_put():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').put(Field('counter', 5).dict())
+    # The before-image is durable before the data is written
+    assert [r['operation']['S'] for r in _undo_records(backend, tx)] == ['PUT']
+    tx.commit()
+    assert tx.calls[('tx', 'put_item')] == 2
+    assert not ('tx', 'batch_write_item') in tx.calls
+
+
+def test_lock_all_records_are_batched():
+    backend = make_backend(items=40)
+    tx = _tx(backend)
+    tx_items = [tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(30)]
+    tx.lock_all(tx_items, LOCK_EXCLUSIVE)
+    # 25 queued records are written at once, the rest with the first write
+    assert tx.calls[('tx', 'batch_write_item')] == 1
+    for tx_item in tx_items:
+        tx_item.update(Update('counter').add(1).dict())
+    assert tx.calls[('tx', 'batch_write_item')] == 2
+    assert tx.calls[('tx', 'put_item')] == 1
+    assert len(_undo_records(backend, tx)) == 30
+    tx.rollback()
+    assert all(v['counter'] == {'N': '0'} for v in backend.tables[BENCH_TABLE_NAME].items.values())
+
+
+def test_queued_records_of_unwritten_items_are_dropped():
+    backend = make_backend(items=10)
+    for end in ('commit', 'rollback'):
+        tx = _tx(backend)
+        tx.lock_all([tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(3)], LOCK_EXCLUSIVE)
+        getattr(tx, end)()
+        assert _undo_records(backend, tx) == []
+        assert not ('data', 'put_item') in tx.calls
+        assert not ('tx', 'batch_write_item') in tx.calls
@@ -0,0 +1,114 @@
+from dynamodb2 import metrics
+from dynamodb2.constructor import Update
+from dynamodb2.metrics import AggregatingSink, Histogram, MetricsSink
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx, stat_from_calls
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Request metrics: sink registry, AggregatingSink snapshots, consumed capacity and Tx.calls counters.
+
+"""
+
+
+class RecordingSink(MetricsSink):
+    def __init__(self):
+        self.calls = []
+        self.lock_waits = []
+        self.retries = []
+
+    def call(self, category, operation, table_name, latency, outcome, capacity_units):
+        self.calls.append((category, operation, table_name, outcome, capacity_units))
+
+    def lock_wait(self, lock_wait):
+        self.lock_waits.append(lock_wait)
+
+    def retry(self, category, operation, table_name, reason):
+        self.retries.append((category, operation, table_name, reason))
+
+
+def _tx(backend):
+    return Tx('test metrics', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _update(backend):
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.commit()
+    return tx
+
+
+def test_sinks_receive_every_call():
+    backend = make_backend(items=10)
+    _tx(backend).commit()
+    sink, aggregating = RecordingSink(), AggregatingSink()
+    metrics.add_sink(sink)
+    metrics.add_sink(aggregating)
+    try:
+        tx = _update(backend)
+    finally:
+        metrics.clear_sinks()
+    assert metrics.sinks == ()
+    assert len(sink.calls) == sum(tx.calls.values())
+    assert ('data', 'update_item', BENCH_TABLE_NAME, metrics.OUTCOME_OK, None) in sink.calls
+    snapshot = aggregating.snapshot()
+    assert sum(c['latency']['count'] for c in snapshot['calls']) == len(sink.calls)
+    assert set((c['category'], c['operation']) for c in snapshot['calls']) == set(tx.calls)
+    # Unregistered sinks see nothing
+    _update(backend)
+    assert len(sink.calls) == sum(tx.calls.values())
+
+
+def test_outcomes_retries_and_lock_waits():
+    backend = make_backend(items=10)
+    holder = _tx(backend)
+    holder.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_EXCLUSIVE)
+    sink = AggregatingSink()
+    metrics.add_sink(sink)
+    try:
+        tx = _tx(backend)
+        assert not tx.get_item(BENCH_TABLE_NAME, '1').wait_lock(LOCK_EXCLUSIVE, wait_time=0.01, max_wait_time=0.05,
+                                                                  generate_exception=False)
+        tx.rollback()
+    finally:
+        metrics.remove_sink(sink)
+    holder.rollback()
+    snapshot = sink.snapshot()
+    lock_update = [c for c in snapshot['calls'] if c['category'] == 'lock' and c['operation'] == 'update_item'][0]
+    assert lock_update['outcomes']['ConditionalCheckFailedException'] >= 2
+    assert lock_update['retries'] >= 1
+    assert [(w['table'], w['lock'], w['acquired'], w['timeouts']) for w in snapshot['lock_waits']] == \
+        [(BENCH_TABLE_NAME, LOCK_EXCLUSIVE, 0, 1)]
+    sink.reset()
+    assert sink.snapshot() == {'calls': [], 'lock_waits': []}
+
+
+def test_consumed_capacity():
+    backend = make_backend(items=10)
+    sink = AggregatingSink()
+    metrics.add_sink(sink)
+    metrics.set_consumed_capacity('TOTAL')
+    try:
+        _update(backend)
+    finally:
+        metrics.set_consumed_capacity(None)
+        metrics.remove_sink(sink)
+    data_update = [c for c in sink.snapshot()['calls'] if c['category'] == 'data' and c['table'] == BENCH_TABLE_NAME]
+    assert data_update[0]['capacity_units'] > 0
+
+
+def test_histogram():
+    histogram = Histogram((0.01, 0.1, 1.0))
+    for value in [0.005] * 90 + [0.05] * 9 + [5.0]:
+        histogram.observe(value)
+    assert (histogram.count, histogram.max) == (100, 5.0)
+    assert (histogram.percentile(50), histogram.percentile(95), histogram.percentile(100)) == (0.01, 0.1, 5.0)
+    assert histogram.to_dict()['counts'] == [90, 9, 0, 1]
+
+
+def test_stat_from_calls():
+    stat = stat_from_calls({('data', 'update_item'): 2, ('lock', 'update_item'): 3, ('tx', 'batch_write_item'): 1})
+    assert (stat['UPDATE'], stat['UPDATE1'], stat['BATCH_WRITE1']) == (2, 3, 1)
@@ -0,0 +1,143 @@
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_MODE_LOCK, TX_MODE_OPTIMISTIC, Tx, TxConflict
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCKS_DATA_FIELD, VERSION_DATA_FIELD, NotExistingItem, \
+    use_item_versions
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Optimistic mode: buffered writes validated by item versions at commit, deletes of both modes.
+
+"""
+
+
+def _tx(backend, mode=TX_MODE_OPTIMISTIC):
+    return Tx('test optimistic', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None, mode=mode)
+
+
+def _item(backend, key):
+    return backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}}).get('Item')
+
+
+def _counter(backend, key):
+    return _item(backend, key)['counter']['N']
+
+
+def _conflict(tx):
+    try:
+        tx.commit()
+    except TxConflict:
+        return True
+    return False
+
+
+def test_single_write():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').put(Field('counter', 7).dict())
+    tx.commit()
+    assert tx.round_trips() == 1
+    assert _counter(backend, '1') == '7'
+    # Updates of an item not read need its image, the item is read at commit
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.commit()
+    assert tx.round_trips() == 2
+    assert _counter(backend, '1') == '8'
+    assert not LOCKS_DATA_FIELD in backend.get_item(BENCH_TABLE_NAME, {'id': {'S': '1'}})['Item']
+
+
+def test_write_conflict():
+    backend = make_backend(items=10)
+    tx1, tx2 = _tx(backend), _tx(backend)
+    for tx in (tx1, tx2):
+        tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+        assert tx_item.get()['Item']['counter'] == {'N': '0'}
+        tx_item.update(Update('counter').add(1).dict())
+    tx1.commit()
+    assert _conflict(tx2)
+    assert _counter(backend, '1') == '1'
+
+
+def test_read_conflict_restores_writes():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').get()
+    tx.get_item(BENCH_TABLE_NAME, '2').get()
+    tx.get_item(BENCH_TABLE_NAME, '3').update(Update('counter').add(1).dict())
+    other = _tx(backend)
+    other.get_item(BENCH_TABLE_NAME, '2').update(Update('counter').add(5).dict())
+    other.commit()
+    assert _conflict(tx)
+    assert [_counter(backend, k) for k in ('1', '2', '3')] == ['0', '5', '0']
+    assert not LOCKS_DATA_FIELD in backend.get_item(BENCH_TABLE_NAME, {'id': {'S': '3'}})['Item']
+
+
+def test_locked_item_conflicts():
+    backend = make_backend(items=10)
+    holder = _tx(backend, TX_MODE_LOCK)
+    assert holder.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_EXCLUSIVE)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    assert _conflict(tx)
+    holder.commit()
+    assert _counter(backend, '1') == '0'
+
+
+def test_lock_mode_versions():
+    backend = make_backend(items=10)
+    use_item_versions(False)
+    try:
+        tx = _tx(backend, TX_MODE_LOCK)
+        tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+        tx.get_item(BENCH_TABLE_NAME, '2').put(Field('counter', 1).dict())
+        tx.commit()
+        # No optimistic transaction may read the items, no version is written
+        assert not any(VERSION_DATA_FIELD in _item(backend, k) for k in ('1', '2'))
+        reader = _tx(backend)
+        reader.get_item(BENCH_TABLE_NAME, '1').get()
+        reader.get_item(BENCH_TABLE_NAME, '3').update(Update('counter').add(1).dict())
+        # Since the optimistic transaction is created, lock mode writes change versions it validates
+        tx = _tx(backend, TX_MODE_LOCK)
+        tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+        tx.commit()
+        assert VERSION_DATA_FIELD in _item(backend, '1')
+        assert _conflict(reader)
+        assert [_counter(backend, k) for k in ('1', '3')] == ['2', '0']
+    finally:
+        use_item_versions(False)
+
+
+def test_delete():
+    backend = make_backend(items=10)
+    for mode in (TX_MODE_LOCK, TX_MODE_OPTIMISTIC):
+        for end in ('rollback', 'commit'):
+            tx = _tx(backend, mode)
+            tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+            tx_item.delete()
+            # Deleted for the transaction, left in place for others until commit
+            assert tx_item.get() == {}
+            assert _counter(backend, '1') == '0'
+            getattr(tx, end)()
+            if end == 'rollback':
+                assert not LOCKS_DATA_FIELD in _item(backend, '1')
+        assert _item(backend, '1') is None
+        backend.put_item(BENCH_TABLE_NAME, {'id': {'S': '1'}, 'counter': {'N': '0'}})
+
+
+def test_lock_mode_put_after_delete():
+    backend = make_backend(items=10)
+    tx = _tx(backend, TX_MODE_LOCK)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    tx_item.delete()
+    try:
+        tx_item.update(Update('counter').add(1).dict())
+        assert False
+    except NotExistingItem:
+        pass
+    tx_item.put(Field('counter', 3).dict())
+    assert tx_item.get()['Item']['counter'] == {'N': '3'}
+    tx.commit()
+    assert _counter(backend, '1') == '3'
@@ -0,0 +1,64 @@
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.constructor import Update
+from dynamodb2.pool import ConnectionPool
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Connection pool: connections are borrowed by one Tx at a time and returned on commit/rollback.
+
+"""
+
+
+def _pool(backend, max_size=2):
+    created = []
+
+    def factory(access_key, secret_access_key, region):
+        connection = AWSDynamoDB2Connection(access_key, secret_access_key, region, backend=backend)
+        created.append(connection)
+        return connection
+
+    return ConnectionPool(max_size, factory), created
+
+
+def test_connection_is_reused():
+    backend = make_backend(items=10)
+    pool, created = _pool(backend)
+    tx = Tx('test pool', ISOLATION_LEVEL_FULL_LOCK, pool=pool)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.commit()
+    tx = Tx('test pool', ISOLATION_LEVEL_FULL_LOCK, pool=pool)
+    assert tx.connection is created[0]
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.rollback()
+    assert len(created) == 1
+    assert pool.stat == {'HIT': 1, 'MISS': 1, 'RELEASE': 2, 'DISCARD': 0}
+
+
+def test_concurrent_transactions_borrow_own_connections():
+    backend = make_backend(items=10)
+    pool, created = _pool(backend)
+    txs = [Tx('test pool', ISOLATION_LEVEL_FULL_LOCK, pool=pool) for _ in range(3)]
+    assert len(set(id(tx.connection) for tx in txs)) == 3
+    for tx in txs:
+        tx.commit()
+    # Idle connections above max_size are dropped
+    assert pool.stat['DISCARD'] == 1
+    pool.set_max_size(1)
+    assert pool.stat['DISCARD'] == 2
+    assert Tx('test pool', ISOLATION_LEVEL_FULL_LOCK, pool=pool).connection in created
+
+
+def test_keyed_by_credentials():
+    backend = make_backend(items=1)
+    pool, created = _pool(backend)
+    connection = pool.acquire('key 1', 'secret', 'us-east-1')
+    pool.release(connection)
+    assert not pool.acquire('key 2', 'secret', 'us-east-1') is connection
+    assert pool.acquire('key 1', 'secret', 'us-east-1') is connection
+    # Connections not created by the pool are not kept
+    pool.release(AWSDynamoDB2Connection(backend=backend))
+    assert pool.stat['RELEASE'] == 1
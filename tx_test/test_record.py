@@ -0,0 +1,78 @@
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, ISOLATION_LEVEL_READ_COMMITTED, TX_TABLE_NAME, \
+    TX_RECORD_FLUSH_EVERY_MUTATION, Tx
+from dynamodb2.transaction.item import LOCK_SHARED
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Tx record: created by the first lock with the locked tables, appends coalesced by the flush policy.
+
+"""
+
+OTHER_TABLE_NAME = 'tx-test-other'
+
+
+def _tx(backend, isolation_level=ISOLATION_LEVEL_FULL_LOCK, **kwargs):
+    return Tx('test record', isolation_level, backend=backend, pool=None, **kwargs)
+
+
+def _record(backend, tx):
+    return backend.get_item(TX_TABLE_NAME, {'tx_uuid': {'S': str(tx.tx_uuid)}}).get('Item')
+
+
+def _backend():
+    backend = make_backend(items=10)
+    backend.create_table([dict(AttributeName='id', AttributeType='S')], OTHER_TABLE_NAME,
+                         [dict(AttributeName='id', KeyType='HASH')], dict(ReadCapacityUnits=5, WriteCapacityUnits=5))
+    backend.put_item(OTHER_TABLE_NAME, Field('id', '1').dict())
+    return backend
+
+
+def test_no_record_without_locks():
+    backend = _backend()
+    tx = _tx(backend, ISOLATION_LEVEL_READ_COMMITTED)
+    assert tx.get_item(BENCH_TABLE_NAME, '1').get()['Item']['counter'] == {'N': '0'}
+    tx.commit()
+    assert tx.round_trips() == 1
+    assert _record(backend, tx) is None
+    tx = _tx(backend)
+    tx.rollback()
+    assert tx.round_trips() == 0
+
+
+def test_record_is_created_by_first_lock():
+    backend = _backend()
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').lock(LOCK_SHARED)
+    record = _record(backend, tx)
+    assert (record['status'], record['tables']) == ({'S': 'START'}, {'SS': [BENCH_TABLE_NAME]})
+    assert not ('tx', 'update_item') in tx.calls
+    # Other table is added to the record before its first lock
+    tx.get_item(OTHER_TABLE_NAME, '1').lock(LOCK_SHARED)
+    assert sorted(_record(backend, tx)['tables']['SS']) == sorted([BENCH_TABLE_NAME, OTHER_TABLE_NAME])
+    assert tx.calls[('tx', 'update_item')] == 1
+    tx.commit()
+    assert _record(backend, tx)['status'] == {'S': 'COMMIT'}
+    assert tx.calls[('tx', 'put_item')] == 1
+
+
+def test_appends_are_coalesced():
+    backend = _backend()
+    tx = _tx(backend)
+    for n in range(3):
+        tx.get_item(BENCH_TABLE_NAME, str(n)).update(Update('counter').add(1).dict())
+    # START record, one IN-FLIGHT flush before the first write, later appends are written with COMMIT
+    tx.commit()
+    assert tx.calls[('tx', 'update_item')] == 2
+    record = _record(backend, tx)
+    assert len(record['recs']['SS']) == len(record['logs']['SS']) == 3
+    tx = _tx(backend, tx_record_flush_policy=TX_RECORD_FLUSH_EVERY_MUTATION)
+    for n in range(3):
+        tx.get_item(BENCH_TABLE_NAME, str(n)).update(Update('counter').add(1).dict())
+    tx.commit()
+    assert tx.calls[('tx', 'update_item')] == 4
+    assert len(_record(backend, tx)['logs']['SS']) == 3
+
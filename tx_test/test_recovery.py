@@ -0,0 +1,92 @@
+from time import sleep
+
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, TX_TABLE_NAME, Tx
+from dynamodb2.transaction.item import LOCK_SHARED, LOCK_DATA_FIELDS, LOCKS_DATA_FIELD, lock_token
+from dynamodb2.transaction.recovery import Janitor
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Janitor: rollback of abandoned transactions and sweep of orphaned lock tokens.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test recovery', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _item(backend, key):
+    return backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}}).get('Item')
+
+
+def _status(backend, tx):
+    return backend.get_item(TX_TABLE_NAME, {'tx_uuid': {'S': str(tx.tx_uuid)}})['Item']['status']['S']
+
+
+def _janitor(backend, tables=None):
+    # Clocks of transactions and janitor are the same, every unfinished transaction is abandoned
+    sleep(0.01)
+    return Janitor(backend=backend, max_age=0, segments=2, tables=tables)
+
+
+def test_recover_abandoned_transaction():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.get_item(BENCH_TABLE_NAME, 'new').put(Field('counter', 1).dict())
+    tx.get_item(BENCH_TABLE_NAME, '2').get()
+    committed = _tx(backend)
+    committed.get_item(BENCH_TABLE_NAME, '3').update(Update('counter').add(1).dict())
+    committed.commit()
+    janitor = _janitor(backend)
+    assert janitor.run_once() == {'recovered': 1, 'unlocked': 0}
+    assert _status(backend, tx) == 'ROLLBACK'
+    assert _item(backend, '1') == {'id': {'S': '1'}, 'counter': {'N': '0'}}
+    assert _item(backend, 'new') is None
+    # Read-only item is found by the 'tables' set of the tx record
+    assert _item(backend, '2') == {'id': {'S': '2'}, 'counter': {'N': '0'}}
+    assert _item(backend, '3')['counter'] == {'N': '1'}
+    assert janitor.run_once() == {'recovered': 0, 'unlocked': 0}
+
+
+def test_recover_transaction_without_writes():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').get()
+    tx.get_item(BENCH_TABLE_NAME, '2').lock(LOCK_SHARED)
+    assert _janitor(backend).run_once()['recovered'] == 1
+    assert [LOCKS_DATA_FIELD in _item(backend, k) for k in ('1', '2')] == [False, False]
+
+
+def test_sweep_orphaned_locks():
+    backend = make_backend(items=10)
+    orphan = '6f1c2d3e-0000-11e5-8000-000000000001'
+    backend.update_item(BENCH_TABLE_NAME, {'id': {'S': '1'}}, {
+        LOCKS_DATA_FIELD: {'Action': 'ADD', 'Value': {'SS': [lock_token(orphan, LOCK_SHARED)]}}})
+    live = _tx(backend)
+    live.get_item(BENCH_TABLE_NAME, '2').lock(LOCK_SHARED)
+    janitor = Janitor(backend=backend, max_age=300, segments=2, tables=[BENCH_TABLE_NAME])
+    assert janitor.run_once() == {'recovered': 0, 'unlocked': 1}
+    assert not any(f in _item(backend, '1') for f in LOCK_DATA_FIELDS)
+    assert LOCKS_DATA_FIELD in _item(backend, '2')
+    live.commit()
+
+
+def test_tables_are_scanned_once_per_pass():
+    backend = make_backend(items=10)
+    txs = [_tx(backend) for _ in range(3)]
+    for n, tx in enumerate(txs):
+        tx.get_item(BENCH_TABLE_NAME, str(n)).update(Update('counter').add(1).dict())
+        tx.get_item(BENCH_TABLE_NAME, str(n + 5)).lock(LOCK_SHARED)
+    janitor = _janitor(backend)
+    scans = backend.calls.get('Scan', 0)
+    assert janitor.run_once() == {'recovered': 3, 'unlocked': 0}
+    # One segmented scan of tx-info table and one of the data table
+    assert backend.calls['Scan'] - scans == 2 * janitor.segments
+    assert all(_status(backend, tx) == 'ROLLBACK' for tx in txs)
+    assert not any(LOCKS_DATA_FIELD in v for v in backend.tables[BENCH_TABLE_NAME].items.values())
+    assert all(v['counter'] == {'N': '0'} for v in backend.tables[BENCH_TABLE_NAME].items.values())
@@ -0,0 +1,114 @@
+import simplejson as json
+
+from dynamodb2.constructor import Field, Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.item import LOCKS_DATA_FIELD
+from dynamodb2.transaction.rollback import RESTORE_DELETE, RESTORE_PUT, holder_expected, plan_rollback, rollback
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Rollback planning (earliest before-image per item), idempotent restore and undo log deduplication.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test rollback', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _item(backend, key):
+    return backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}}).get('Item')
+
+
+def _log_record(creation_date, key, operation, attributes=None):
+    log_record = {
+        'creation_date': {'S': creation_date},
+        'table': {'S': BENCH_TABLE_NAME},
+        'key': {'S': json.dumps({'id': {'S': key}})},
+        'operation': {'S': operation}
+    }
+    if not attributes is None:
+        log_record['data'] = {'S': json.dumps({'Attributes': attributes})}
+    return log_record
+
+
+def test_plan_keeps_earliest_before_image():
+    records = [
+        _log_record('2015-06-01T12:00:02', '1', 'PUT', {'id': {'S': '1'}, 'counter': {'N': '2'}}),
+        _log_record('2015-06-01T12:00:01', '1', 'PUT', {'id': {'S': '1'}, 'counter': {'N': '1'}}),
+        _log_record('2015-06-01T12:00:03', '2', 'DELETE'),
+        _log_record('2015-06-01T12:00:04', '2', 'PUT', {'id': {'S': '2'}}),
+        _log_record('2015-06-01T12:00:05', '3', 'PUT')
+    ]
+    steps = plan_rollback(records)
+    assert [(s.key['id']['S'], s.operation) for s in steps] == [('1', RESTORE_PUT), ('2', RESTORE_DELETE)]
+    assert steps[0].item['counter'] == {'N': '1'}
+
+
+def test_rollback_restores_items():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    for _ in range(3):
+        tx_item.update(Update('counter').add(1).dict())
+    tx.get_item(BENCH_TABLE_NAME, 'new').put(Field('counter', 1).dict())
+    tx.get_item(BENCH_TABLE_NAME, '2').get()
+    assert _item(backend, '1')['counter'] == {'N': '3'}
+    tx.rollback()
+    assert _item(backend, '1') == {'id': {'S': '1'}, 'counter': {'N': '0'}}
+    assert _item(backend, 'new') is None
+    assert _item(backend, '2') == {'id': {'S': '2'}, 'counter': {'N': '0'}}
+
+
+def test_rollback_is_repeatable():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(1).dict())
+    tx.get_item(BENCH_TABLE_NAME, '2').update(Update('counter').add(1).dict())
+    tx.flush_tx_log()
+    steps = plan_rollback(tx.tx_log)
+    expected = holder_expected(str(tx.tx_uuid))
+    # Interrupted rollback: only the first item is restored, then the whole plan is repeated. The restored item
+    # has no lock of the transaction any more, it is not written again.
+    assert rollback(tx._call, steps[:1], expected) == 1
+    assert rollback(tx._call, steps, expected) == 1
+    assert [_item(backend, k)['counter'] for k in ('1', '2')] == [{'N': '0'}, {'N': '0'}]
+    tx.rollback()
+    # Released items are not touched any more
+    other = _tx(backend)
+    other.get_item(BENCH_TABLE_NAME, '1').update(Update('counter').add(5).dict())
+    other.commit()
+    assert rollback(tx._call, steps, expected) == 0
+    assert _item(backend, '1')['counter'] == {'N': '5'}
+    assert not LOCKS_DATA_FIELD in _item(backend, '1')
+
+
+def test_one_before_image_per_item():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    for _ in range(50):
+        tx_item.update(Update('counter').add(1).dict())
+    tx.commit()
+    # The tx record and one undo record
+    assert len(tx.tx_log) == 1
+    assert tx.calls[('tx', 'put_item')] == 2
+    assert not ('tx', 'batch_write_item') in tx.calls
+    assert tx.calls[('data', 'update_item')] == 50
+    assert _item(backend, '1')['counter'] == {'N': '50'}
+
+
+def test_before_image_of_created_item():
+    backend = make_backend(items=10)
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, 'new')
+    tx_item.put(Field('counter', 1).dict())
+    tx_item.put(Field('counter', 2).dict())
+    tx_item.update(Update('counter').add(1).dict())
+    # Later writes of a created item keep its DELETE record
+    assert [r['operation']['S'] for r in tx.tx_log] == ['DELETE']
+    tx.rollback()
+    assert _item(backend, 'new') is None
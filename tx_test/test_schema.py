@@ -0,0 +1,65 @@
+import gc
+from time import sleep
+import weakref
+
+from dynamodb2 import AWSDynamoDB2Connection
+from dynamodb2.schema import TableSchemaCache
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Table descriptor cache: one describe_table per table, TTL, invalidation and backend scoped entries.
+
+"""
+
+
+def _connection(backend, cache):
+    return AWSDynamoDB2Connection(backend=backend, cache=cache)
+
+
+def test_descriptor_is_cached():
+    backend = make_backend(items=1)
+    cache = TableSchemaCache()
+    connection = _connection(backend, cache)
+    assert connection.cached_key_schema(BENCH_TABLE_NAME) is None
+    for _ in range(3):
+        assert connection.get_key_name(BENCH_TABLE_NAME) == ['id']
+    # Connections of the same backend share descriptors
+    assert _connection(backend, cache).gen_key_attribute(BENCH_TABLE_NAME, 1) == {'id': {'S': '1'}}
+    assert backend.calls['DescribeTable'] == 1
+    assert connection.cached_key_schema(BENCH_TABLE_NAME).hash_key_type == 'S'
+
+
+def test_ttl_and_invalidate():
+    backend = make_backend(items=1)
+    connection = _connection(backend, TableSchemaCache(ttl=0.05))
+    connection.prewarm([BENCH_TABLE_NAME])
+    connection.get_key_schema(BENCH_TABLE_NAME)
+    assert backend.calls['DescribeTable'] == 1
+    sleep(0.1)
+    assert connection.cached_key_schema(BENCH_TABLE_NAME) is None
+    connection.get_key_schema(BENCH_TABLE_NAME)
+    assert backend.calls['DescribeTable'] == 2
+    connection.invalidate_table_descriptor(BENCH_TABLE_NAME)
+    connection.get_key_schema(BENCH_TABLE_NAME)
+    connection.invalidate_table_descriptor()
+    connection.get_key_schema(BENCH_TABLE_NAME)
+    assert backend.calls['DescribeTable'] == 4
+
+
+def test_backends_are_not_kept_alive():
+    cache = TableSchemaCache()
+    backend, other = make_backend(items=1), make_backend(items=1)
+    _connection(backend, cache).get_key_schema(BENCH_TABLE_NAME)
+    _connection(other, cache).get_key_schema(BENCH_TABLE_NAME)
+    # Descriptors of other backends are their own
+    assert backend.calls['DescribeTable'] == other.calls['DescribeTable'] == 1
+    _connection(other, cache).invalidate_table_descriptor()
+    assert not _connection(backend, cache).cached_key_schema(BENCH_TABLE_NAME) is None
+    backend_refs = [weakref.ref(backend), weakref.ref(other)]
+    del backend, other
+    gc.collect()
+    assert [r() for r in backend_refs] == [None, None]
+    assert len(cache.backend_entries) == 0
@@ -0,0 +1,69 @@
+import uuid
+
+import simplejson as json
+
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED, LOCKS_DATA_FIELD, X_LOCK_DATA_FIELD, \
+    legacy_lock_token, lock_token, parse_lock_token, parse_locks, use_legacy_lock_tokens
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Compact lock tokens, and JSON tokens of older versions which are still read and released.
+
+"""
+
+
+def _tx(backend):
+    return Tx('test token', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+
+
+def _item(backend, key):
+    return backend.get_item(BENCH_TABLE_NAME, {'id': {'S': key}})['Item']
+
+
+def test_parse():
+    tx_uuid = str(uuid.uuid4())
+    token = lock_token(tx_uuid, LOCK_EXCLUSIVE)
+    assert len(token) == 33 and token[0] == LOCK_EXCLUSIVE
+    assert parse_lock_token(token) == (tx_uuid, LOCK_EXCLUSIVE)
+    assert parse_lock_token(legacy_lock_token(tx_uuid, LOCK_SHARED)) == (tx_uuid, LOCK_SHARED)
+    other = str(uuid.uuid4())
+    tokens = [lock_token(tx_uuid, LOCK_SHARED), legacy_lock_token(tx_uuid, LOCK_SHARED),
+              lock_token(other, LOCK_SHARED), legacy_lock_token(other, LOCK_EXCLUSIVE)]
+    # Own tokens of both formats are not conflicts
+    assert parse_locks(tokens, tx_uuid) == [{'tx_uuid': other, 'lock': LOCK_SHARED},
+                                            {'tx_uuid': other, 'lock': LOCK_EXCLUSIVE}]
+
+
+def test_legacy_token():
+    backend = make_backend(items=10)
+    holder = '6f1c2d3e-0000-11e5-8000-000000000001'
+    backend.update_item(BENCH_TABLE_NAME, {'id': {'S': '1'}}, {
+        LOCKS_DATA_FIELD: {'Action': 'PUT', 'Value': {'SS': [json.dumps({'tx_uuid': holder, 'lock': 'X'})]}},
+        X_LOCK_DATA_FIELD: {'Action': 'PUT', 'Value': {'S': holder}}})
+    tx = _tx(backend)
+    tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+    assert not tx_item.lock(LOCK_SHARED)
+    assert tx_item.locks == [{'tx_uuid': holder, 'lock': LOCK_EXCLUSIVE}]
+    tx.rollback()
+
+
+def test_legacy_tokens_are_written_and_released():
+    backend = make_backend(items=10)
+    use_legacy_lock_tokens(True)
+    try:
+        tx = _tx(backend)
+        tx_item = tx.get_item(BENCH_TABLE_NAME, '1')
+        assert tx_item.lock(LOCK_SHARED)
+        assert json.loads(_item(backend, '1')[LOCKS_DATA_FIELD]['SS'][0]) == {'tx_uuid': tx_item.tx_uuid_str,
+                                                                               'lock': LOCK_SHARED}
+        assert tx_item.lock(LOCK_EXCLUSIVE)
+    finally:
+        use_legacy_lock_tokens(False)
+    # Locks taken in legacy format are released by the compact format version
+    tx.commit()
+    assert not LOCKS_DATA_FIELD in _item(backend, '1')
+    assert not X_LOCK_DATA_FIELD in _item(backend, '1')
@@ -0,0 +1,70 @@
+import random
+
+from dynamodb2 import tracing
+from dynamodb2.constructor import Update
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Sampled tracing: sampling per transaction, span nesting across pool threads, span limit.
+
+"""
+
+
+def _traced(backend, sample_rate=1.0, max_spans=10000, end='commit'):
+    exporter = tracing.InMemoryExporter()
+    tracing.set_tracer(tracing.Tracer(sample_rate, exporter, max_spans))
+    try:
+        tx = Tx('test tracing', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None)
+        tx_items = [tx.get_item(BENCH_TABLE_NAME, str(n)) for n in range(3)]
+        tx.lock_all(tx_items, LOCK_EXCLUSIVE)
+        for tx_item in tx_items:
+            tx_item.update(Update('counter').add(1).dict())
+        getattr(tx, end)()
+    finally:
+        tracing.set_tracer(None)
+    return tx, exporter.traces
+
+
+def _parents(trace):
+    spans = trace.render()['spans']
+    names = dict((s['span_id'], s['name']) for s in spans)
+    return [(s['name'], names.get(s['parent_id']), s['attributes'].get('category')) for s in spans]
+
+
+def test_sampling():
+    backend = make_backend(items=10)
+    tx, traces = _traced(backend, 0.0)
+    assert tx.trace is None and traces == []
+    random.seed(3)
+    sampled = sum(len(_traced(backend, 0.5)[1]) for _ in range(40))
+    assert 10 < sampled < 30
+    tx, traces = _traced(backend)
+    assert tx.trace is None
+    root = traces[0].render()['spans'][0]
+    assert (root['name'], root['parent_id'], root['attributes']['status']) == ('tx', None, 'COMMIT')
+    assert root['attributes']['round_trips'] == tx.round_trips()
+
+
+def test_pool_thread_spans_are_nested():
+    backend = make_backend(items=10)
+    for end in ('commit', 'rollback'):
+        tx, traces = _traced(backend, end=end)
+        parents = _parents(traces[0])
+        assert parents.count(('update_item', 'lock_all', 'lock')) == 3
+        assert parents.count(('update_item', end, 'lock')) == 3
+        assert parents.count(('update_item', 'update', 'data')) == 3
+        assert not [p for p in parents if p[1] is None and p[0] != 'tx']
+    assert parents.count(('put_item', 'rollback', 'data')) == 3
+
+
+def test_max_spans():
+    backend = make_backend(items=10)
+    tx, traces = _traced(backend, max_spans=5)
+    rendered = traces[0].render()
+    assert len(rendered['spans']) == 6
+    assert rendered['dropped_spans'] > 0
@@ -0,0 +1,102 @@
+import random
+import threading
+
+from dynamodb2.transaction import ISOLATION_LEVEL_FULL_LOCK, Tx
+from dynamodb2.transaction.item import LOCK_EXCLUSIVE, LOCK_SHARED, LockWaitTime
+from dynamodb2.transaction.wait import AgeFairBackoff, ExponentialBackoff, FixedWait, WaitStrategy, \
+    add_lock_wait_listener, remove_lock_wait_listener
+from tx_bench import BENCH_TABLE_NAME, make_backend
+
+__author__ = 'drblez'
+
+"""
+
+    Lock wait strategies, jitter and LockWait records of contended waits.
+
+"""
+
+
+class RecordingWait(WaitStrategy):
+    def __init__(self, wait_time):
+        self.wait_time = wait_time
+        self.attempts = []
+
+    def delay(self, attempt, tx_item):
+        self.attempts.append(attempt)
+        return self.wait_time
+
+
+def _tx(backend, **kwargs):
+    return Tx('test wait', ISOLATION_LEVEL_FULL_LOCK, backend=backend, pool=None, **kwargs)
+
+
+def test_backoff_delays():
+    assert [ExponentialBackoff(0.01, 0.1, jitter=False).delay(a, None) for a in range(1, 6)] == \
+        [0.02, 0.04, 0.08, 0.1, 0.1]
+    # Large attempt numbers stay capped
+    assert ExponentialBackoff(0.01, 0.1, jitter=False).delay(10 ** 6, None) == 0.1
+    assert FixedWait(0.3).delay(7, None) == 0.3
+
+
+def test_full_jitter():
+    random.seed(1)
+    strategy = ExponentialBackoff(0.01, 0.1)
+    delays = [strategy.delay(3, None) for _ in range(200)]
+    assert all(0 <= d <= 0.08 for d in delays)
+    # Full jitter spreads waiters over the whole window
+    assert min(delays) < 0.02 and max(delays) > 0.06
+
+
+def test_age_fair_backoff():
+    backend = make_backend(items=1)
+    young, old, urgent = _tx(backend), _tx(backend), _tx(backend, priority=1)
+    old.start_time -= 1
+    strategy = AgeFairBackoff(0.1, 0.4, jitter=False, age_horizon=1.0)
+    delays = [strategy.delay(5, tx.get_item(BENCH_TABLE_NAME, '0')) for tx in (young, old, urgent)]
+    assert abs(delays[0] - 0.4) < 0.01
+    assert abs(delays[1] - 0.2) < 0.01
+    assert abs(delays[2] - 0.2) < 0.01
+
+
+def test_wait_lock_times_out():
+    backend = make_backend(items=1)
+    holder = _tx(backend)
+    assert holder.get_item(BENCH_TABLE_NAME, 'hot').lock(LOCK_EXCLUSIVE)
+    waits = []
+    add_lock_wait_listener(waits.append)
+    try:
+        tx = _tx(backend)
+        strategy = RecordingWait(0.01)
+        try:
+            tx.get_item(BENCH_TABLE_NAME, 'hot').wait_lock(LOCK_SHARED, max_wait_time=0.1, wait_strategy=strategy)
+            assert False
+        except LockWaitTime:
+            pass
+        assert not tx.get_item(BENCH_TABLE_NAME, 'hot').wait_lock(LOCK_SHARED, max_wait_time=0.05,
+                                                                   generate_exception=False)
+    finally:
+        remove_lock_wait_listener(waits.append)
+    assert strategy.attempts[:3] == [1, 2, 3]
+    assert [w.acquired for w in waits] == [False, False]
+    assert waits[0].holders == [holder.get_item(BENCH_TABLE_NAME, 'hot').tx_uuid_str]
+    assert waits[0].attempts == len(strategy.attempts) + 1
+    assert waits[0].wait_time >= 0.1
+    assert tx.lock_waits == waits
+    tx.rollback()
+    holder.rollback()
+
+
+def test_wait_lock_acquired():
+    backend = make_backend(items=1)
+    holder = _tx(backend)
+    assert holder.get_item(BENCH_TABLE_NAME, 'hot').lock(LOCK_EXCLUSIVE)
+    timer = threading.Timer(0.05, holder.commit)
+    timer.start()
+    tx = _tx(backend)
+    assert tx.get_item(BENCH_TABLE_NAME, 'hot').wait_lock(LOCK_EXCLUSIVE, wait_time=0.01, max_wait_time=5)
+    timer.join()
+    assert len(tx.lock_waits) == 1
+    lock_wait = tx.lock_waits[0]
+    assert lock_wait.acquired and lock_wait.attempts > 1
+    assert (lock_wait.table_name, lock_wait.lock_state) == (BENCH_TABLE_NAME, LOCK_EXCLUSIVE)
+    tx.commit()